@@ -0,0 +1,79 @@
+import click
+from timeit import Timer
+from urllib.parse import parse_qsl, urlencode
+from stiff.utils import encode_qs, parse_qs_pairs, parse_qs_single
+
+QS_SAMPLES = [
+    "from-id=fi-tok&char=3&token=0&token-length=1",
+    "from-id=zh-untok&char=12",
+    "l=murha&wn=fin,qf2",
+    "l=olla_kyse&wn=qwf",
+    "transfer-type=aligned&transfer-from=3&transform-chain=%5B%5D",
+    "transfer-type=unaligned&transfer-from=10" "&transform-chain=%5B%27deriv%27%5D",
+    "transfer-type=aligned&transfer-from-wordnets=fin+qf2"
+    "&transfer-from-source=zh-tok&transfer-from-lemma-path=omor%2Crecurs"
+    "&transfer-from-anchor-positions=from-id%3Dzh-tok%26char%3D0%26token%3D0"
+    "&transfer-from-anchor-char-length=2",
+]
+
+
+def time_per_call(func, args, number):
+    def run():
+        for arg in args:
+            func(arg)
+
+    return min(Timer(run).repeat(5, number)) / (number * len(args))
+
+
+def report(name, old, new):
+    click.echo(
+        "{:<8} {:>10.3f}us {:>10.3f}us {:>8.2f}x".format(
+            name, old * 1e6, new * 1e6, old / new
+        )
+    )
+
+
+@click.group()
+def bench():
+    """
+    Micro-benchmarks of hot functions against what they replace.
+    """
+    pass
+
+
+@bench.command("qs")
+@click.option("--number", default=10000)
+def qs(number):
+    """
+    Compare the STIFF query string decoder and encoder with parse_qsl(...)
+    and urlencode(...) on typical attribute values.
+    """
+    dicts = [dict(parse_qsl(sample)) for sample in QS_SAMPLES]
+    for sample, qs_dict in zip(QS_SAMPLES, dicts):
+        assert parse_qs_single(sample) == qs_dict
+        assert encode_qs(qs_dict) == urlencode(qs_dict)
+    click.echo("{:<8} {:>12} {:>12} {:>9}".format("", "urllib", "stiff", "speedup"))
+    report(
+        "decode",
+        time_per_call(lambda qs: dict(parse_qsl(qs)), QS_SAMPLES, number),
+        time_per_call(parse_qs_single, QS_SAMPLES, number),
+    )
+
+    def parse_cold(qs):
+        parse_qs_pairs.cache_clear()
+        return parse_qs_single(qs)
+
+    report(
+        "cold",
+        time_per_call(lambda qs: dict(parse_qsl(qs)), QS_SAMPLES, number),
+        time_per_call(parse_cold, QS_SAMPLES, number),
+    )
+    report(
+        "encode",
+        time_per_call(urlencode, dicts, number),
+        time_per_call(encode_qs, dicts, number),
+    )
+
+
+if __name__ == "__main__":
+    bench()
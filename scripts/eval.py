@@ -3,6 +3,12 @@ from lxml import etree
 import click
 from stiff.utils.anns import get_ann_pos, get_ann_pos_dict
 from stiff.utils.xml import iter_sentences, iter_sent_to_pairs, iter_sentence_id_pairs
+from stiff.utils.offsets import (
+    INDEX_SUFFIX,
+    get_offsets,
+    iter_sentence_id_offsets,
+    read_block,
+)
 from stiff.data.constants import UNI_POS_WN_MAP, WN_UNI_POS_MAP
 from stiff.sup_corpus import next_key, iter_lexelts
 import pandas as pd
@@ -56,6 +62,18 @@ def align_with_gold(gold_sents, guess_sents, max_slack=1000):
         yield gold_id, gold_sent, guess_sent
 
 
+def seek_with_gold(gold_sents, guess_fp):
+    """
+    Like align_with_gold(...), but seeks directly to the GUESS sentences using
+    their byte offsets rather than parsing all of GUESS.
+    """
+    guess_offsets = dict(iter_sentence_id_offsets(get_offsets(guess_fp)))
+    for gold_id, gold_sent in gold_sents:
+        if gold_id not in guess_offsets:
+            raise SampleGoldIterationException(f"GUESS does not contain {gold_id}")
+        yield gold_id, gold_sent, read_block(guess_fp, guess_offsets[gold_id])
+
+
 def anns_to_set(anns):
     return {(int(get_ann_pos_dict(ann)["token"]), ann.text) for ann in anns}
 
@@ -113,15 +131,16 @@ def get_num_tokens(gold_sent, guess_sent):
     return sent_text.count(" ") + 1 if sent_text else 0
 
 
-def pr_one(gold_etree, guess_fp, score_func, trace_individual=False):
+def pr_one(gold_etree, guess_fp, score_func, trace_individual=False, seek=False):
     total_tp = 0
     total_fp = 0
     total_fn = 0
     gold_sents = list(iter_sent_to_pairs(iter(gold_etree.xpath("//sentence"))))
-    guess_sents = iter_sentence_id_pairs(guess_fp)
-    for idx, (sent_id, gold_sent, guess_sent) in enumerate(
-        align_with_gold(iter(gold_sents), guess_sents)
-    ):
+    if seek:
+        aligned = seek_with_gold(iter(gold_sents), guess_fp)
+    else:
+        aligned = align_with_gold(iter(gold_sents), iter_sentence_id_pairs(guess_fp))
+    for idx, (sent_id, gold_sent, guess_sent) in enumerate(aligned):
 
         gold_anns = gold_sent.xpath(".//annotation")
         guess_anns = guess_sent.xpath(".//annotation")
@@ -153,12 +172,18 @@ def get_score_func(score):
 @click.argument("guess", type=click.File("rb"), nargs=-1)
 @click.option("--trace-individual/--no-trace-individual", default=False)
 @click.option("--score", type=click.Choice(["ann", "tok"]))
-def pr(gold, guess, trace_individual, score):
+@click.option(
+    "--seek/--stream",
+    default=False,
+    help="Seek to the GUESS sentences by byte offset. "
+    "GUESS must be uncompressed. Uses GUESS.idx if it exists.",
+)
+def pr(gold, guess, trace_individual, score, seek):
     score_func = get_score_func(score)
     gold_etree = etree.parse(gold)
     for guess_fp in guess:
         print(guess_fp)
-        print(pr_one(gold_etree, guess_fp, score_func, trace_individual))
+        print(pr_one(gold_etree, guess_fp, score_func, trace_individual, seek))
 
 
 @eval.command("pr-eval")
@@ -167,16 +192,23 @@ def pr(gold, guess, trace_individual, score):
 @click.argument("csv_out", type=click.Path())
 @click.option("--trace-individual/--no-trace-individual", default=False)
 @click.option("--score", type=click.Choice(["ann", "tok"]))
-def pr_eval(gold, eval, csv_out, trace_individual, score):
+@click.option("--seek/--stream", default=False)
+def pr_eval(gold, eval, csv_out, trace_individual, score, seek):
     score_func = get_score_func(score)
     gold_etree = etree.parse(gold)
     data = []
     for entry in listdir(eval):
+        if entry.endswith(INDEX_SUFFIX):
+            continue
         name = entry.rsplit(".", 1)[0]
         if trace_individual:
             print(name)
         precision, recall, f_1 = pr_one(
-            gold_etree, open(pjoin(eval, entry), "rb"), score_func, trace_individual
+            gold_etree,
+            open(pjoin(eval, entry), "rb"),
+            score_func,
+            trace_individual,
+            seek,
         )
         data.append(
             {"name": name, "precision": precision, "recall": recall, "f_1": f_1}
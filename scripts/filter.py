@@ -14,9 +14,15 @@ from stiff.utils.xml import (
 from stiff.data.constants import DEFAULT_SAMPLE_LINES, DEFAULT_SAMPLE_MAX
 from stiff.filter import (
     decode_dom_arg,
-    get_finnpos_analys,
-    greedy_max_span,
-    trim_anns,
+    decode_naive_pos_arg,
+    chain_stages,
+    char_span_dom as sent_char_span_dom,
+    mk_filter_lang,
+    mk_finnpos_rm_pos,
+    mk_fold_support,
+    mk_rm_empty,
+    mk_tok_span_dom,
+    rm_ambg as sent_rm_ambg,
     HasSupportTournament,
     AlignTournament,
     NaiveLemmaTournament,
@@ -34,8 +40,8 @@ from stiff.filter import (
     HypTournament,
     SupportedOnlyHypTournament,
 )
-from stiff.utils.anns import get_ann_pos, get_ann_pos_dict
-from urllib.parse import urlencode
+from stiff.utils.bytestream import fast_transform_sentences
+from stiff.utils.offsets import INDEX_SUFFIX, map_file, scan_offsets, write_offsets
 from more_itertools import peekable
 
 
@@ -70,13 +76,7 @@ def filter_lang(lang, inf, outf):
     language.
     """
 
-    def remove_other_langs(elem):
-        for ann in elem.xpath("./annotations/annotation | ./text"):
-            if ann.attrib["lang"] == lang:
-                continue
-            ann.getparent().remove(ann)
-
-    transform_sentences(inf, remove_other_langs, outf)
+    transform_sentences(inf, mk_filter_lang(lang), outf)
 
 
 @filter.command("fold-support")
@@ -89,40 +89,7 @@ def fold_support(lang, inf, outf):
     is anchored into annotations which it supports in LANG.
     """
 
-    def tran(elem):
-        xpath = "./annotations/annotation[@lang='{}']".format(lang)
-        for ann in elem.xpath(xpath):
-            support = ann.attrib.get("support")
-            if not support:
-                continue
-            new_support = []
-            for supp in support.split(" "):
-                supp = parse_qs_single(supp)
-                trans_from = supp["transfer-from"]
-                from_elem = elem.xpath(
-                    "./annotations/annotation[@id='{}']".format(trans_from)
-                )[0]
-                from_wordnets = from_elem.attrib["wordnets"]
-                anchor_positions = from_elem.attrib["anchor-positions"]
-                for position in anchor_positions.split(" "):
-                    from_anchor = parse_qs_single(position)
-                    from_source = from_anchor["from-id"]
-                from_lemma_path = from_elem.attrib["lemma-path"]
-                from_anchor_char_length = len(from_elem.attrib["anchor"])
-                del supp["transfer-from"]
-                supp.update(
-                    {
-                        "transfer-from-wordnets": from_wordnets,
-                        "transfer-from-source": from_source,
-                        "transfer-from-lemma-path": from_lemma_path,
-                        "transfer-from-anchor-positions": anchor_positions,
-                        "transfer-from-anchor-char-length": from_anchor_char_length,
-                    }
-                )
-                new_support.append(urlencode(supp))
-            ann.attrib["support"] = " ".join(new_support)
-
-    transform_sentences(inf, tran, outf)
+    transform_sentences(inf, mk_fold_support(lang), outf)
 
 
 @filter.command()
@@ -154,15 +121,7 @@ def rm_empty(inf, outf, text):
     Remove sentences with no annotations, or optionally with no text instead.
     """
 
-    def remove_empty(elem):
-        if (
-            len(elem.xpath("./text")) == 0
-            if text
-            else len(elem.xpath("./annotations/annotation")) == 0
-        ):
-            return BYPASS
-
-    transform_sentences(inf, remove_empty, outf)
+    transform_sentences(inf, mk_rm_empty(text), outf)
 
 
 @filter.command("rm-ambg")
@@ -173,21 +132,6 @@ def rm_ambg(inf, outf):
     Remove ambiguous annotations of the same span.
     """
 
-    def sent_rm_ambg(sent):
-        anns = sent.xpath("./annotations/annotation")
-        new_anns = anns.copy()
-        span_counts = {}
-        for ann in anns:
-            span = get_ann_pos(ann)
-            if span not in span_counts:
-                span_counts[span] = 0
-            span_counts[span] += 1
-        for ann in anns:
-            span = get_ann_pos(ann)
-            if span_counts[span] >= 2:
-                new_anns.remove(ann)
-        trim_anns(anns, new_anns)
-
     transform_sentences(inf, sent_rm_ambg, outf)
 
 
@@ -237,7 +181,7 @@ def head(inf, outf, sentences):
             return BREAK
         seen_sents += 1
 
-    transform_sentences(inf, count_break_sent, outf)
+    fast_transform_sentences(inf, count_break_sent, outf)
     inf.close()
     outf.close()
 
@@ -260,12 +204,28 @@ def sample(inf, outf):
             return BYPASS
         seen_sents += 1
 
-    transform_sentences(inf, count_break_sent, outf)
+    fast_transform_sentences(inf, count_break_sent, outf)
 
     if seen_sents <= max(DEFAULT_SAMPLE_LINES):
         print("Not enough sentences in input to sample.")
 
 
+@filter.command("index")
+@click.argument("inf", type=click.Path(exists=True, dir_okay=False))
+@click.argument("outf", type=click.File("w"), required=False)
+def index(inf, outf):
+    """
+    Write the byte offset, id and annotation count of every <sentence> and
+    <subtitle> in INF, which must be an uncompressed file rather than a pipe
+    since it is memory mapped, to OUTF (default INF.idx).
+    """
+    if outf is None:
+        outf = open(inf + INDEX_SUFFIX, "w")
+    with open(inf, "rb") as inf_fp:
+        write_offsets(scan_offsets(map_file(inf_fp)), outf)
+    outf.close()
+
+
 class MultiFile:
     def __init__(self, *fps):
         self.fps = fps
@@ -435,22 +395,7 @@ def tok_span_dom(inf, outf, sup_only=False):
     dominates), proceed greedily.
     """
 
-    def sent_span_dom(sent):
-        anns = sent.xpath("./annotations/annotation")
-        token_positions = {}
-        for ann in anns:
-            if sup_only and not HasSupportTournament.rank(ann):
-                continue
-            tok, tok_len = get_ann_pos(ann)
-            token_positions.setdefault(tok, []).append((tok_len, ann))
-        new_anns = greedy_max_span(token_positions)
-        if sup_only:
-            for ann in anns:
-                if not HasSupportTournament.rank(ann):
-                    new_anns.append(ann)
-        trim_anns(anns, new_anns)
-
-    transform_sentences(inf, sent_span_dom, outf)
+    transform_sentences(inf, mk_tok_span_dom(sup_only), outf)
 
 
 @filter.command("char-span-dom")
@@ -465,32 +410,7 @@ def char_span_dom(inf, outf):
     (none dominates), proceed greedily.
     """
 
-    def sent_span_dom(sent):
-        anns = sent.xpath("./annotations/annotation")
-        starts = []
-        for ann in anns:
-            anchor_pos = get_ann_pos_dict(ann)
-            anchor = ann.attrib["anchor"]
-            starts.append(int(anchor_pos["char"]))
-        starts.sort()
-        char_positions = {}
-        for ann in anns:
-            anchor_pos = get_ann_pos_dict(ann)
-            anchor = ann.attrib["anchor"]
-            cur_start = int(anchor_pos["char"])
-            cur_start_idx = starts.index(cur_start)
-            anchor_len = len(anchor)
-            span = 0
-            while (
-                cur_start_idx + span < len(starts)
-                and starts[cur_start_idx + span] <= cur_start + anchor_len
-            ):
-                span += 1
-            char_positions.setdefault(cur_start, []).append((span, ann))
-        new_anns = greedy_max_span(char_positions)
-        trim_anns(anns, new_anns)
-
-    transform_sentences(inf, sent_span_dom, outf)
+    transform_sentences(inf, sent_char_span_dom, outf)
 
 
 @filter.command("src-char-len-dom")
@@ -559,20 +479,7 @@ def finnpos_naive_pos_dom(inf, outf, proc):
     Naive POS filter: Based on matching exactly the POS. Either as requirement
     or dominance filter.
     """
-    if proc == "dom":
-        rm_ranks = []
-        do_dom = True
-    elif proc == "rm-dom":
-        rm_ranks = [-1]
-        do_dom = True
-    elif proc == "rm":
-        rm_ranks = [-1]
-        do_dom = False
-    elif proc == "rm-agg":
-        rm_ranks = [-1, 0]
-        do_dom = False
-
-    return NaivePosTournament(do_dom, rm_ranks).proc_stream(inf, outf)
+    return NaivePosTournament(*decode_naive_pos_arg(proc)).proc_stream(inf, outf)
 
 
 @filter.command("finnpos-rm-pos")
@@ -585,41 +492,7 @@ def finnpos_rm_pos(inf, outf, level):
     PRONOUN, since this POS never exists in WordNet.
     """
 
-    def m(feat, val):
-        def inner(feats):
-            return feat in feats and feats[feat] == val
-
-        return inner
-
-    to_remove = [m("pos", "PRONOUN")]
-    if level in ("normal", "agg"):
-        to_remove.extend(
-            (
-                m("pos", "NUMERAL"),
-                m("pos", "INTERJECTION"),
-                m("pos", "CONJUNCTION"),
-                m("pos", "PARTICLE"),
-                m("pos", "PUNCTUATION"),
-                m("proper", "PROPER"),
-            )
-        )
-    if level == "agg":
-        to_remove.append(m("pos", "ADPOSITION"))
-
-    def sent_rm_pos(sent):
-        finnpos_analys = get_finnpos_analys(sent)
-        anns = sent.xpath("./annotations/annotation")
-        new_anns = anns.copy()
-        for ann in anns:
-            tok, tok_len = get_ann_pos(ann)
-            if tok_len != 1:
-                continue
-            props = finnpos_analys[tok][1]
-            if any((match(props) for match in to_remove)):
-                new_anns.remove(ann)
-        trim_anns(anns, new_anns)
-
-    transform_sentences(inf, sent_rm_pos, outf)
+    transform_sentences(inf, mk_finnpos_rm_pos(level), outf)
 
 
 @filter.command("non-wiki-src")
@@ -645,6 +518,57 @@ def supported_non_wiki_src(inf, outf):
     return SupportedOnlyNonWikiSrc().proc_stream(inf, outf)
 
 
+@filter.command("ann-table")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("table", type=click.File("wb"))
+@click.option(
+    "--stage",
+    "stages",
+    multiple=True,
+    help="Only include the columns needed by these stages.",
+)
+def ann_table(inf, table, stages):
+    """
+    Build a columnar table of the annotations in INF for table-proc. INF
+    should already have had fold-support and lang applied.
+    """
+    from stiff.ann_table import ALL_COLUMNS, build_ann_table, stage_columns
+
+    columns = stage_columns(stages) if stages else ALL_COLUMNS
+    build_ann_table(inf, columns).save(table)
+
+
+@filter.command("table-proc")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("table", type=click.File("rb"))
+@click.argument("outf", type=click.File("wb"))
+@click.argument("stages", nargs=-1)
+def table_proc(inf, table, outf, stages):
+    """
+    Run a chain of ranking tournament STAGES, given as in a variant's list of
+    stages, on the annotation table of INF and then remove the losing
+    annotations from INF in a single pass.
+    """
+    from stiff.ann_table import AnnTable, project_table
+
+    ann_table = AnnTable.load(table)
+    alive = ann_table.run_stages(stages)
+    project_table(inf, ann_table, alive, outf)
+
+
+@filter.command("chain")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("outf", type=click.File("wb"))
+@click.argument("stages", nargs=-1)
+def chain(inf, outf, stages):
+    """
+    Run a chain of STAGES in a single pass over INF. Each stage is given as a
+    quoted filter.py command line without INF and OUTF, e.g.
+    "finnpos-rm-pos --level=agg", or as a short stage code.
+    """
+    transform_sentences(inf, chain_stages(stages), outf)
+
+
 @filter.command("hyp-dom")
 @click.argument("inf", type=click.File("rb"))
 @click.argument("outf", type=click.File("wb"))
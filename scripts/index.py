@@ -0,0 +1,81 @@
+import click
+from stiff.utils.lemma_index import (
+    KINDS,
+    LEMMA_INDEX_SUFFIX,
+    LemmaIndex,
+    build_lemma_index,
+    read_keyfile,
+)
+from stiff.utils.offsets import map_file
+
+
+@click.group()
+def index():
+    """
+    Build and query inverted indices from lemmas and synsets to the sentences
+    of uncompressed STIFF, variant or unified XML files.
+    """
+    pass
+
+
+@index.command("build")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("index_path", type=click.Path(), required=False)
+@click.option(
+    "--keyfile",
+    type=click.File("r"),
+    help="Take the synsets of instances without a key attribute from this keyfile.",
+)
+def build(inf, index_path, keyfile):
+    """
+    Build the lemma index of INF at INDEX_PATH (default INF.lemmas.sqlite).
+    For unified XML which has been through unified-split, pass its keyfile with
+    --keyfile.
+    """
+    if index_path is None:
+        index_path = inf.name + LEMMA_INDEX_SUFFIX
+    inst_keys = read_keyfile(keyfile) if keyfile is not None else None
+    build_lemma_index(inf, index_path, inst_keys)
+
+
+@index.command("query")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("keys", nargs=-1, required=True)
+@click.option("--kind", type=click.Choice(KINDS), default="lemma")
+@click.option("--index", "index_path", type=click.Path(exists=True))
+@click.option(
+    "--ids/--xml", help="Print the ids and byte offsets of the matching sentences."
+)
+@click.option("--outf", type=click.File("wb"), default="-")
+def query(inf, keys, kind, index_path, ids, outf):
+    """
+    Write the sentences of INF containing any of KEYS, which are lemmas,
+    lemma.pos pairs or synset ids according to --kind.
+    """
+    try:
+        lemma_index = LemmaIndex.for_file(inf, index_path)
+    except (FileNotFoundError, ValueError) as exc:
+        raise click.ClickException("{}. Run index.py build first.".format(exc))
+    matches = {}
+    for key in keys:
+        for sent_id, offset in lemma_index.lookup(kind, key):
+            matches[offset.offset] = (sent_id, offset)
+    lemma_index.close()
+    if ids:
+        for _, (sent_id, offset) in sorted(matches.items()):
+            outf.write(
+                "{}\t{}\t{}\n".format(sent_id, offset.offset, offset.length).encode(
+                    "utf-8"
+                )
+            )
+        return
+    buf = map_file(inf)
+    outf.write(b"<corpus>\n")
+    for _, (sent_id, offset) in sorted(matches.items()):
+        outf.write(buf[offset.offset : offset.offset + offset.length])
+        outf.write(b"\n")
+    outf.write(b"</corpus>\n")
+
+
+if __name__ == "__main__":
+    index()
@@ -2,7 +2,7 @@ import re
 from lxml import etree
 import sys
 import click
-from stiff.utils import parse_qs_single, wnlemma_to_analy_lemma
+from stiff.utils import encode_qs, parse_qs_single, wnlemma_to_analy_lemma
 from stiff.utils.xml import (
     eq_matcher,
     iter_sentences,
@@ -14,19 +14,25 @@ from stiff.utils.xml import (
     fixup_missing_text,
     iter_sentences_opensubs18,
     iter_blocks,
+    BufferedOutput,
 )
 from xml.sax.saxutils import escape
-import pygtrie
 from stiff.data.constants import WN_UNI_POS_MAP, UNI_POS_WN_MAP
+from stiff.munge.babelnet import compile_bn2wn, open_bn2wn
+from stiff.munge.scatter import ScatterWriter
+from stiff.utils.extsort import DEFAULT_RUN_SIZE, external_sort
 from finntk.wordnet.reader import fiwn, get_en_fi_maps
 from finntk.wordnet.utils import maybe_fi2en_ss, pre_id_to_post, post_id_to_pre, pre2ss
 from finntk.omor.extract import lemma_intersect
 from os.path import join as pjoin
 from os import makedirs, listdir
 from contextlib import contextmanager
-from typing import Dict, Set, IO, List, Optional
+from functools import lru_cache
+from io import StringIO
+from typing import Any, Dict, Set, IO, List, Optional, Tuple
 from collections import Counter
-from urllib.parse import urlencode
+from itertools import groupby
+from operator import itemgetter
 import pickle
 from nltk.corpus import wordnet
 
@@ -89,13 +95,119 @@ def get_lemma(ann):
     return best_lemma
 
 
+def iter_stiff_sentences(stiff: IO, input_fmt: str):
+    """
+    Returns the source written to the Unified header and an iterator of
+    (unified sentence id, sentence element) pairs for each input format.
+    """
+    if input_fmt == "man-ann-stiff":
+        return "stiff", iter_sentences_opensubs18_man_ann(stiff)
+    elif input_fmt == "stiff":
+        return "stiff", opensubs18_ids_to_unified(iter_sentences_opensubs18(stiff))
+    else:
+        assert input_fmt == "man-ann-europarl"
+        return "eurosense", iter_sentences_eurosense(stiff)
+
+
+def ann_char_id(ann, text_id: Optional[str]) -> int:
+    """
+    Get the character offset of the anchor of ANN in the text with id TEXT_ID
+    (or any text if it is None), preferring the last such anchor position.
+    """
+    for pos_enc in reversed(ann.attrib["anchor-positions"].split(" ")):
+        pos = parse_qs_single(pos_enc)
+        if text_id is None or pos["from-id"] == text_id:
+            return int(pos["char"])
+    assert False, "Didn't find a usable anchor position"
+
+
+def iter_token_offsets(sent: str):
+    """
+    Yields (start, end) for each space separated token of SENT which starts
+    before the end of SENT.
+    """
+    start = 0
+    while start < len(sent):
+        end = sent.find(" ", start)
+        if end == -1:
+            end = len(sent)
+        yield start, end
+        start = end + 1
+
+
+def iter_unified_tokens(sent_elem):
+    """
+    Yields (lemma, keys, pos, text) for each token of an unambiguously tagged
+    STIFF sentence. Untagged tokens (<wf>) have lemma, keys and pos set to
+    None while tagged tokens (<instance>) have their keys as a list.
+
+    The annotations are sorted into a queue by anchor position once. Each
+    token then takes the annotations anchored at its start from the front of
+    the queue, so this is linear in the number of tokens and annotations.
+    """
+    text_elem = sent_elem.find("text")
+    text_id = text_elem.attrib.get("id")
+    anns = sorted(
+        (ann_char_id(ann, text_id), ann.attrib["anchor"], get_lemma(ann), ann.text)
+        for ann in sent_elem.iter("annotation")
+    )
+    ann_idx = 0
+    sent = text_elem.text
+    for start, end in iter_token_offsets(sent):
+        cursor = start
+        instance = None
+        while ann_idx < len(anns):
+            char_id, anchor, lemma, ann = anns[ann_idx]
+            assert (
+                char_id >= cursor
+            ), "Moved past anchor position - can't have overlapping anchors"
+            if char_id > cursor:
+                # Try again to move past leading punctation which has been
+                # put in the same token like: `-ajoneuvo` with anchor
+                # ajoneuvo
+
+                # XXX: This approach just deletes the leading punctation.
+                # Probably not what is wanted but servicable for the time
+                # being.
+                old_cursor = cursor
+                while not (
+                    sent[cursor].isalnum() or sent[cursor].isspace()
+                ) and cursor < min(char_id, len(sent)):
+                    cursor += 1
+                if cursor != char_id:
+                    # Reset
+                    cursor = old_cursor
+                    break
+            if instance is None:
+                instance = {"lemma": lemma, "anchor": anchor, "key": []}
+            else:
+                assert (
+                    instance["lemma"] == lemma
+                ), "Can't tag an instance with multiple lemmas"
+                assert (
+                    instance["anchor"] == anchor
+                ), "Can't have different anchors at different positions"
+            instance["key"].append(ann)
+            ann_idx += 1
+        if instance is not None:
+            pos = WN_UNI_POS_MAP[instance["key"][-1][-1]]
+            # XXX: This approach just deletes the trailing punctation.
+            # Probably not what is wanted but servicable for the time
+            # being. Old code:
+            # cursor += len(instance["anchor"]) + 1
+            yield instance["lemma"], instance["key"], pos, instance["anchor"]
+        else:
+            yield None, None, None, sent[cursor:end]
+
+
+INPUT_FMTS = ["man-ann-stiff", "man-ann-europarl", "stiff"]
+
+
 @munge.command("stiff-to-unified")
 @click.argument("stiff", type=click.File("rb"))
 @click.argument("unified", type=click.File("w"))
 @click.option(
-    "--input-fmt",
-    type=click.Choice(["man-ann-stiff", "man-ann-europarl", "stiff"]),
-    default="stiff",
+    "--input-fmt", type=click.Choice(INPUT_FMTS), default="stiff",
 )
 def stiff_to_unified(stiff: IO, unified: IO, input_fmt: str):
     """
@@ -103,101 +215,39 @@ def stiff_to_unified(stiff: IO, unified: IO, input_fmt: str):
     format) to the Unified format. Note that this assumes is that previous
     filtering has produced an unambiguous tagging.
     """
-    write_header(unified, "eurosense" if input_fmt == "man-ann-europarl" else "stiff")
-    if input_fmt == "man-ann-stiff":
-        sent_iter = iter_sentences_opensubs18_man_ann(stiff)
-    elif input_fmt == "stiff":
-        sent_iter = opensubs18_ids_to_unified(iter_sentences_opensubs18(stiff))
-    else:
-        assert input_fmt == "man-ann-europarl"
-        sent_iter = iter_sentences_eurosense(stiff)
+    source, sent_iter = iter_stiff_sentences(stiff, input_fmt)
+    write_header(unified, source)
     for sent_id, sent_elem in sent_iter:
         unified.write('<sentence id="{}">\n'.format(sent_id))
-        text_elem = sent_elem.xpath("text")[0]
-        text_id = text_elem.attrib.get("id")
-        anns = []
-        for ann in sent_elem.xpath(".//annotation"):
-            our_pos = None
-            for pos_enc in ann.attrib["anchor-positions"].split(" "):
-                pos = parse_qs_single(pos_enc)
-                if text_id is None or pos["from-id"] == text_id:
-                    our_pos = pos
-            assert our_pos is not None, "Didn't find a usable anchor position"
-            char_id = int(our_pos["char"])
-            anns.append((char_id, ann.attrib["anchor"], get_lemma(ann), ann.text))
-        anns.sort()
-        sent = text_elem.text
-        cursor = 0
-        while cursor < len(sent):
-            instance = None
-            while 1:
-                if not len(anns):
-                    break
-                char_id, anchor, lemma, ann = anns[0]
-                assert (
-                    char_id >= cursor
-                ), "Moved past anchor position - can't have overlapping anchors"
-                if char_id > cursor:
-                    # Try again to move past leading punctation which has been
-                    # put in the same token like: `-ajoneuvo` with anchor
-                    # ajoneuvo
-
-                    # XXX: This approach just deletes the leading punctation.
-                    # Probably not what is wanted but servicable for the time
-                    # being.
-                    old_cursor = cursor
-                    while not (
-                        sent[cursor].isalnum() or sent[cursor].isspace()
-                    ) and cursor < min(char_id, len(sent)):
-                        cursor += 1
-                    if cursor != char_id:
-                        # Reset
-                        cursor = old_cursor
-                        break
-                if instance is None:
-                    instance = {"lemma": lemma, "anchor": anchor, "key": []}
-                else:
-                    assert (
-                        instance["lemma"] == lemma
-                    ), "Can't tag an instance with multiple lemmas"
-                    assert (
-                        instance["anchor"] == anchor
-                    ), "Can't have different anchors at different positions"
-                instance["key"].append(ann)
-                del anns[0]
-            if instance is not None:
-                pos = WN_UNI_POS_MAP[instance["key"][-1][-1]]
+        for lemma, keys, pos, text in iter_unified_tokens(sent_elem):
+            if lemma is None:
+                unified.write("<wf>{}</wf>\n".format(escape(text)))
+            else:
                 unified.write(
                     '<instance lemma="{}" key="{}" pos="{}">{}</instance>\n'.format(
-                        instance["lemma"],
-                        " ".join(instance["key"]),
-                        pos,
-                        instance["anchor"],
+                        lemma, " ".join(keys), pos, text
                     )
                 )
-                # XXX: This approach just deletes the trailing punctation.
-                # Probably not what is wanted but servicable for the time
-                # being. Old code:
-                # cursor += len(instance["anchor"]) + 1
-
-                end_pos = sent.find(" ", cursor)
-                if end_pos == -1:
-                    break
-                cursor = end_pos + 1
-            else:
-                end_pos = sent.find(" ", cursor)
-                if end_pos == -1:
-                    end_pos = None
-                unified.write("<wf>{}</wf>\n".format(escape(sent[cursor:end_pos])))
-                if end_pos is None:
-                    break
-                cursor = end_pos + 1
         unified.write("</sentence>")
 
     unified.write("</text>\n")
     unified.write("</corpus>\n")
 
 
+def split_key(sent_elem, keyout: IO):
+    """
+    Move the inline keys of the instances of a Unified sentence to KEYOUT,
+    giving each instance an id.
+    """
+    sent_id = sent_elem.attrib["id"]
+    for idx, inst in enumerate(sent_elem.xpath("instance")):
+        key = inst.attrib["key"]
+        del inst.attrib["key"]
+        key_id = "{}.{:08d}".format(sent_id, idx)
+        inst.attrib["id"] = key_id
+        keyout.write("{} {}\n".format(key_id, key))
+
+
 @munge.command("unified-split")
 @click.argument("inf", type=click.File("rb", lazy=True))
 @click.argument("outf", type=click.File("wb"))
@@ -208,16 +258,7 @@ def unified_split(inf: IO, outf: IO, keyout: IO):
     keys inline.
     """
 
-    def sent_split_key(sent_elem):
-        sent_id = sent_elem.attrib["id"]
-        for idx, inst in enumerate(sent_elem.xpath("instance")):
-            key = inst.attrib["key"]
-            del inst.attrib["key"]
-            key_id = "{}.{:08d}".format(sent_id, idx)
-            inst.attrib["id"] = key_id
-            keyout.write("{} {}\n".format(key_id, key))
-
-    transform_sentences(inf, sent_split_key, outf)
+    transform_sentences(inf, lambda sent: split_key(sent, keyout), outf)
 
 
 def iter_anchored_anns(sent_elem, once_only=True):
@@ -272,6 +313,43 @@ def write_header(unified, source):
     unified.write('<text id="' + source + '">\n')
 
 
+def iter_longest_anchor_matches(sent: str, anchors: Dict[Tuple[str, ...], Any]):
+    """
+    Greedily match the longest anchor at each token of the space separated
+    SENT, where ANCHORS maps tuples of anchor tokens to values. Yields
+    (anchor, value) for each match and (token, None) for each unmatched token,
+    apart from an unmatched final token which is left out.
+
+    Each attempt only builds tuples of the next few tokens for a dict lookup,
+    so this is linear in the length of SENT for anchors of bounded length.
+    """
+    if not sent:
+        return
+    # An empty anchor never counts as a match
+    anchor_lens = sorted(
+        {len(anchor) for anchor in anchors if anchor != ("",)}, reverse=True
+    )
+    toks = sent.split(" ")
+    # A trailing space doesn't start another token
+    num_toks = len(toks) - 1 if sent.endswith(" ") else len(toks)
+    idx = 0
+    while idx < num_toks:
+        for anchor_len in anchor_lens:
+            if idx + anchor_len > len(toks):
+                continue
+            anchor = tuple(toks[idx : idx + anchor_len])
+            match_val = anchors.get(anchor)
+            if match_val is not None and anchor != ("",):
+                yield " ".join(anchor), match_val
+                idx += anchor_len
+                break
+        else:
+            if idx == len(toks) - 1:
+                break
+            yield toks[idx], None
+            idx += 1
+
+
 @munge.command("eurosense-to-unified")
 @click.argument("eurosense", type=click.File("rb", lazy=True))
 @click.argument("unified", type=click.File("w"))
@@ -285,29 +363,22 @@ def eurosense_to_unified(eurosense: IO, unified: IO):
     write_header(unified, "eurosense")
     for sent_id, sent_elem in iter_sentences_eurosense(eurosense):
         unified.write('<sentence id="{}">\n'.format(sent_id))
-        trie = pygtrie.StringTrie(separator=" ")
-        anns = sent_elem.xpath(".//annotation")
-        for ann in anns:
-            trie[ann.attrib["anchor"]] = (ann.text, ann.attrib["lemma"])
-        sent = sent_elem.xpath("text")[0].text
-        cursor = 0
-        while cursor < len(sent):
-            match_anchor, match_val = trie.longest_prefix(sent[cursor:])
-            if match_anchor:
+        anchors = {}
+        for ann in sent_elem.iter("annotation"):
+            anchor_toks = tuple(ann.attrib["anchor"].split(" "))
+            anchors[anchor_toks] = (ann.text, ann.attrib["lemma"])
+        sent = sent_elem.find("text").text
+        for anchor, match_val in iter_longest_anchor_matches(sent, anchors):
+            if match_val is not None:
                 sense_key, lemma = match_val
                 pos = WN_UNI_POS_MAP[sense_key[-1]]
                 unified.write(
                     '<instance lemma="{}" pos="{}" key="{}">{}</instance>\n'.format(
-                        lemma, pos, sense_key, match_anchor
+                        lemma, pos, sense_key, anchor
                     )
                 )
-                cursor += len(match_anchor) + 1
             else:
-                end_pos = sent.find(" ", cursor)
-                if end_pos == -1:
-                    break
-                unified.write("<wf>{}</wf>\n".format(escape(sent[cursor:end_pos])))
-                cursor = end_pos + 1
+                unified.write("<wf>{}</wf>\n".format(escape(anchor)))
         unified.write("</sentence>\n")
     unified.write("</text>\n")
     unified.write("</corpus>\n")
@@ -317,12 +388,13 @@ def eurosense_to_unified(eurosense: IO, unified: IO):
 @click.argument("inf", type=click.File("rb", lazy=True))
 @click.argument("outf", type=click.File("wb"))
 def lemma_to_synset(inf: IO, outf: IO):
-    from stiff.munge.utils import synset_id_of_ann
+    transform_blocks(eq_matcher("annotation"), inf, ann_lemma_to_synset, outf)
+
 
-    def l2ss(ann):
-        ann.text = pre_id_to_post(synset_id_of_ann(ann))
+def ann_lemma_to_synset(ann):
+    from stiff.munge.utils import synset_id_of_ann
 
-    transform_blocks(eq_matcher("annotation"), inf, l2ss, outf)
+    ann.text = pre_id_to_post(synset_id_of_ann(ann))
 
 
 def iter_synsets(synset_list):
@@ -333,42 +405,53 @@ def iter_synsets(synset_list):
         yield synset_id, synset
 
 
-@munge.command("eurosense-lemma-fix")
-@click.argument("inf", type=click.File("rb"))
-@click.argument("outf", type=click.File("wb"))
-@click.option("--keep-unknown/--drop-unknown")
-@click.option("--quiet", default=False)
-def eurosense_fix_lemmas(inf: IO, outf: IO, keep_unknown: bool, quiet: bool):
-    """
-    Eurosense contains many lemmas which are not in the set of lemmas for the
-    synset in FinnWordNet. There are two reasons this might occur.
+# EuroSense annotations with the same text (the same list of synsets) are
+# very common, so the lemmas of each list are only looked up once
+SYNSET_LIST_CACHE_SIZE = 2 ** 16
 
-    Scenario A) Bad lemmatisation by Babelfy. In this case we can try and
-    recover the correct lemma by lemmatising ourself and combining with
-    information from WordNet
 
-    Scenario B) Extra lemmas have been associated with the WordNet synset in
-    BabelNet.  In this case there's nothing to do, and we should usually just
-    drop the annotation.
+@lru_cache(maxsize=SYNSET_LIST_CACHE_SIZE)
+def synset_list_lemma_map(synset_list, lower=False) -> Dict[str, Set[str]]:
     """
-    fi2en, en2fi = get_en_fi_maps()
+    Map the names of the lemmas of the synsets in SYNSET_LIST to the ids of
+    the synsets they belong to. The result is shared and must not be modified.
+    """
+    lemma_synset_map: Dict[str, Set[str]] = {}
+    for synset_id, synset in iter_synsets(synset_list):
+        for lemma in synset.lemmas():
+            lemma_str = lemma.name()
+            if lower:
+                lemma_str = lemma_str.lower()
+            lemma_synset_map.setdefault(lemma_str, set()).add(synset_id)
+    return lemma_synset_map
+
+
+@lru_cache(maxsize=SYNSET_LIST_CACHE_SIZE)
+def synset_list_lemma_names(synset_list) -> Tuple[str, ...]:
+    return tuple(
+        lemma.name()
+        for _, synset in iter_synsets(synset_list)
+        for lemma in synset.lemmas()
+    )
+
+
+def report_cache_info(func):
+    info = func.cache_info()
+    lookups = info.hits + info.misses
+    sys.stderr.write(
+        "{}: {} hits out of {} lookups ({:.1%})\n".format(
+            func.__name__, info.hits, lookups, info.hits / lookups if lookups else 0
+        )
+    )
+
 
+def mk_ann_fix_lemmas(keep_unknown: bool, quiet: bool):
     def ann_fix_lemmas(ann):
         # 1) check if their lemmatisation matches something in FiWN as is
         orig_lemma_str = ann.attrib["lemma"]
         orig_lemma_str = orig_lemma_str.replace("#", "").replace(" ", "_")
 
-        def mk_lemma_synset_map(lower=False):
-            lemma_synset_map = {}
-            for synset_id, synset in iter_synsets(ann.text):
-                for lemma in synset.lemmas():
-                    lemma_str = lemma.name()
-                    if lower:
-                        lemma_str = lemma_str.lower()
-                    lemma_synset_map.setdefault(lemma_str, set()).add(synset_id)
-            return lemma_synset_map
-
-        lemma_synset_map = mk_lemma_synset_map()
+        lemma_synset_map = synset_list_lemma_map(ann.text)
 
         if orig_lemma_str in lemma_synset_map:
             ann.text = " ".join(lemma_synset_map[orig_lemma_str])
@@ -377,7 +460,7 @@ def eurosense_fix_lemmas(inf: IO, outf: IO, keep_unknown: bool, quiet: bool):
         # 2) Try and just use the surface as is as the lemma
         lemmatised_anchor = ann.attrib["anchor"].replace(" ", "_")
 
-        lemma_synset_map_lower = mk_lemma_synset_map(lower=True)
+        lemma_synset_map_lower = synset_list_lemma_map(ann.text, lower=True)
         if lemmatised_anchor.lower() in lemma_synset_map_lower:
             ann.text = " ".join(lemma_synset_map_lower[lemmatised_anchor.lower()])
             # XXX: Should be lemma in original case rather than anchor in original case
@@ -417,7 +500,48 @@ def eurosense_fix_lemmas(inf: IO, outf: IO, keep_unknown: bool, quiet: bool):
         else:
             return BYPASS
 
+    return ann_fix_lemmas
+
+
+@munge.command("eurosense-lemma-fix")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("outf", type=click.File("wb"))
+@click.option("--keep-unknown/--drop-unknown")
+@click.option("--quiet", default=False)
+def eurosense_fix_lemmas(inf: IO, outf: IO, keep_unknown: bool, quiet: bool):
+    """
+    Eurosense contains many lemmas which are not in the set of lemmas for the
+    synset in FinnWordNet. There are two reasons this might occur.
+
+    Scenario A) Bad lemmatisation by Babelfy. In this case we can try and
+    recover the correct lemma by lemmatising ourself and combining with
+    information from WordNet
+
+    Scenario B) Extra lemmas have been associated with the WordNet synset in
+    BabelNet.  In this case there's nothing to do, and we should usually just
+    drop the annotation.
+    """
+    fi2en, en2fi = get_en_fi_maps()
+    ann_fix_lemmas = mk_ann_fix_lemmas(keep_unknown, quiet)
     transform_blocks(eq_matcher("annotation"), inf, ann_fix_lemmas, outf)
+    report_cache_info(synset_list_lemma_map)
+
+
+REANCHOR_EXTRA_BITS = {"ei", "olla"}
+
+
+def ann_reanchor(ann):
+    if " " not in ann.attrib["lemma"]:
+        return
+    lem_begin, lem_rest = ann.attrib["lemma"].split(" ", 1)
+    if lem_begin not in REANCHOR_EXTRA_BITS:
+        return
+    anchor_begin = ann.attrib["anchor"].split(" ", 1)[0]
+    for lemma_name in synset_list_lemma_names(ann.text):
+        if lemma_name.split("_", 1)[0] in (anchor_begin, lem_begin):
+            return
+    ann.attrib["lemma"] = lem_rest
+    ann.attrib["anchor"] = ann.attrib["anchor"].split(" ", 1)[1]
 
 
 @munge.command("eurosense-reanchor")
@@ -428,54 +552,83 @@ def eurosense_reanchor(inf: IO, outf: IO):
     Reanchors Eurosense lemmas which are actually forms including some "light"
     word like ei and olla by removing said unneccesary word.
     """
-    EXTRA_BITS = {"ei", "olla"}
     fi2en, en2fi = get_en_fi_maps()
-
-    def ann_reanchor(ann):
-        all_lemma_names = []
-        for _, synset in iter_synsets(ann.text):
-            for lemma in synset.lemmas():
-                all_lemma_names.append(lemma.name())
-        if " " not in ann.attrib["lemma"]:
-            return
-        lem_begin, lem_rest = ann.attrib["lemma"].split(" ", 1)
-        if lem_begin not in EXTRA_BITS:
-            return
-        anchor_begin = ann.attrib["anchor"].split(" ", 1)[0]
-        for lemma_name in all_lemma_names:
-            if lemma_name.split("_", 1)[0] in (anchor_begin, lem_begin):
-                return
-        ann.attrib["lemma"] = lem_rest
-        ann.attrib["anchor"] = ann.attrib["anchor"].split(" ", 1)[1]
-
     transform_blocks(eq_matcher("annotation"), inf, ann_reanchor, outf)
+    report_cache_info(synset_list_lemma_names)
 
 
 @munge.command("babelnet-lookup")
 @click.argument("inf", type=click.File("rb"))
-@click.argument("map_bn2wn", type=click.File("r"))
+@click.argument("map_bn2wn", type=click.Path(exists=True))
 @click.argument("outf", type=click.File("wb"))
-def babelnet_lookup(inf: IO, map_bn2wn: IO, outf: IO):
+def babelnet_lookup(inf: IO, map_bn2wn: str, outf: IO):
     """
-    This stage converts BabelNet ids to WordNet ids.
+    This stage converts BabelNet ids to WordNet ids. MAP_BN2WN can be either
+    the TSV or the output of compile-babelnet-map.
     """
-    bn2wn_map: Dict[str, Set[str]] = {}
-    for line in map_bn2wn:
-        bn, wn_full = line[:-1].split("\t")
-        wn_off = wn_full.split(":", 1)[1]
-        bn2wn_map.setdefault(bn, set()).add(wn_off)
+    transform_blocks(eq_matcher("annotation"), inf, mk_ann_bn2wn(map_bn2wn), outf)
+
+
+def mk_ann_bn2wn(map_bn2wn: str):
+    bn2wn = open_bn2wn(map_bn2wn)
 
     def ann_bn2wn(ann):
-        if ann.text not in bn2wn_map:
+        wn_ids = bn2wn(ann.text)
+        if wn_ids is None:
             return BYPASS
-        wn_ids = bn2wn_map[ann.text]
-        bits = []
-        for wn_id in wn_ids:
-            off, pos = wn_id[:-1], wn_id[-1]
-            bits.append("{}-{}".format(off, pos))
-        ann.text = " ".join(bits)
+        ann.text = wn_ids
+
+    return ann_bn2wn
+
+
+@munge.command("eurosense-to-stifflike")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("map_bn2wn", type=click.Path(exists=True))
+@click.argument("outf", type=click.File("wb"))
+@click.option("--quiet", default=False)
+def eurosense_to_stifflike(inf: IO, map_bn2wn: str, outf: IO, quiet: bool):
+    """
+    Convert EuroSense into a STIFF-like format in a single process. This gives
+    the same output as piping filter.py lang fi, babelnet-lookup,
+    eurosense-reanchor, eurosense-lemma-fix --drop-unknown and filter.py
+    rm-empty together, but each sentence is parsed only once.
+    """
+    from stiff.filter import mk_filter_lang, mk_rm_empty
+
+    fi2en, en2fi = get_en_fi_maps()
+    filter_lang = mk_filter_lang("fi")
+    ann_stages = [
+        mk_ann_bn2wn(map_bn2wn),
+        ann_reanchor,
+        mk_ann_fix_lemmas(False, quiet),
+    ]
+    rm_empty = mk_rm_empty()
+
+    def sent_to_stifflike(sent):
+        filter_lang(sent)
+        # Each annotation goes through all the stages before the next, which
+        # is equivalent since the stages only look at the annotation itself
+        for ann in sent.xpath("./annotations/annotation"):
+            for ann_stage in ann_stages:
+                if ann_stage(ann) is BYPASS:
+                    ann.getparent().remove(ann)
+                    break
+        return rm_empty(sent)
 
-    transform_blocks(eq_matcher("annotation"), inf, ann_bn2wn, outf)
+    transform_sentences(inf, sent_to_stifflike, outf)
+    report_cache_info(synset_list_lemma_names)
+    report_cache_info(synset_list_lemma_map)
+
+
+@munge.command("compile-babelnet-map")
+@click.argument("map_bn2wn", type=click.File("r"))
+@click.argument("outf", type=click.File("wb"))
+def compile_babelnet_map(map_bn2wn: IO, outf: IO):
+    """
+    Compile the BabelNet to WordNet TSV map into a sorted binary file which
+    babelnet-lookup can memory map rather than reading the TSV each time.
+    """
+    compile_bn2wn(map_bn2wn, outf)
 
 
 def lexical_sample_head(outf):
@@ -576,6 +729,69 @@ def lemma_to_synset_key(keyin, keyout):
         keyout.write("\n")
 
 
+def render(write, *args, **kwargs):
+    buf = StringIO()
+    write(*args, buf, **kwargs)
+    return buf.getvalue()
+
+
+def get_exclude(exclude_word: List[str], filter_key: Optional[IO]) -> Set[str]:
+    exclude = set(exclude_word)
+    if filter_key is not None:
+        exclude |= pickle.load(filter_key)
+    return exclude
+
+
+def iter_senseval_instances(
+    inf: IO, keyin: IO, exclude: Set[str], synset_group: bool, tags: List[bool]
+):
+    """
+    Yield (group_keys, lemma_str, pos_chr, key_line, instance_xml) for each
+    instance of the unified corpus INF with key KEYIN, where instance_xml
+    gives the rendered <instance> for each of TAGS.
+    """
+    for sent_elem in iter_sentences(inf):
+        for inst in sent_elem.xpath("instance"):
+
+            def read_key():
+                key_line = keyin.readline()
+                key_id, key_synset = key_line.rstrip().split(" ", 1)
+                assert key_id == inst.attrib["id"]
+                return key_id, key_synset
+
+            lemma_str = inst.attrib["lemma"].lower()
+            key_id, key_synset = read_key()
+
+            if lemma_str in exclude:
+                continue
+
+            pos_str = inst.attrib["pos"]
+            pos_chr = UNI_POS_WN_MAP[pos_str]
+            lemma_pos = "{}.{}".format(lemma_str, pos_chr)
+            if synset_group:
+                group_keys = key_synset.split(" ")
+            else:
+                group_keys = [lemma_pos]
+
+            # Rendered once and shared between all groups
+            instance_xml = {}
+            for tag in tags:
+                out_f = StringIO()
+                with instance(inst, out_f):
+                    write_context(sent_elem, inst, out_f, write_tag=tag)
+                instance_xml[tag] = out_f.getvalue()
+            key_line = "{} {} {}\n".format(lemma_pos, key_id, key_synset)
+
+            yield group_keys, lemma_str, pos_chr, key_line, instance_xml
+
+
+def render_lexelt_head(synset_group, group_key, lemma_str, pos_chr):
+    if synset_group:
+        return render(lexelt_synset_head, group_key)
+    else:
+        return render(lexelt_head, lemma_str, pos_chr)
+
+
 @munge.command("unified-to-senseval")
 @click.argument("inf", type=click.File("rb"))
 @click.argument("keyin", type=click.File("r"))
@@ -608,35 +824,17 @@ def unified_to_senseval(
             return "train.xml"
 
     seen_keys: Set[str] = set()
-    filter = None
-    if filter_key is not None:
-        exclude = pickle.load(filter_key)
-    for sent_elem in iter_sentences(inf):
-        for inst in sent_elem.xpath("instance"):
-
-            def read_key():
-                key_line = keyin.readline()
-                key_id, key_synset = key_line.rstrip().split(" ", 1)
-                assert key_id == inst.attrib["id"]
-                return key_id, key_synset
-
-            lemma_str = inst.attrib["lemma"].lower()
-            key_id, key_synset = read_key()
-
-            if lemma_str in exclude:
-                continue
-
-            pos_str = inst.attrib["pos"]
-            pos_chr = UNI_POS_WN_MAP[pos_str]
-            lemma_pos = "{}.{}".format(lemma_str, pos_chr)
-            if synset_group:
-                group_keys = key_synset.split(" ")
-            else:
-                group_keys = [lemma_pos]
-
+    exclude = get_exclude(exclude_word, filter_key)
+    tags = [False, True] if write_tag else [False]
+    with ScatterWriter() as writer:
+        for (
+            group_keys,
+            lemma_str,
+            pos_chr,
+            key_line,
+            instance_xml,
+        ) in iter_senseval_instances(inf, keyin, exclude, synset_group, tags):
             for group_key in group_keys:
-                if filter is not None and group_key not in filter:
-                    continue
                 new_group = group_key not in seen_keys
                 seen_keys.add(group_key)
 
@@ -646,46 +844,93 @@ def unified_to_senseval(
                     makedirs(group_dir, exist_ok=True)
 
                 # Write XML
-                def write_xml(tag=False):
+                for tag in tags:
                     out_fn = pjoin(group_dir, train_out(tag))
                     if new_group:
-                        out_f = open(out_fn, "w")
-                        lexical_sample_head(out_f)
-                        if synset_group:
-                            lexelt_synset_head(group_key, out_f)
-                        else:
-                            lexelt_head(lemma_str, pos_chr, out_f)
-                    else:
-                        out_f = open(out_fn, "a")
-                    with instance(inst, out_f):
-                        write_context(sent_elem, inst, out_f, write_tag=tag)
-                    out_f.close()
-
-                write_xml()
-                if write_tag:
-                    write_xml(True)
+                        writer.write(out_fn, render(lexical_sample_head))
+                        writer.write(
+                            out_fn,
+                            render_lexelt_head(
+                                synset_group, group_key, lemma_str, pos_chr
+                            ),
+                        )
+                    writer.write(out_fn, instance_xml[tag])
 
                 # Write key file
-                key_fn = pjoin(group_dir, "train.key")
-                if new_group:
-                    key_f = open(key_fn, "w")
-                else:
-                    key_f = open(key_fn, "a")
-                out_line = "{} {} {}\n".format(lemma_pos, key_id, key_synset)
-                key_f.write(out_line)
-                key_f.close()
-
-    for group_key in seen_keys:
-
-        def write_foot(tag=False):
-            out_fn = pjoin(outdir, group_key, train_out(tag))
-            with open(out_fn, "a") as out_f:
-                lexelt_foot(out_f)
-                lexical_sample_foot(out_f)
-
-        write_foot(False)
-        if write_tag:
-            write_foot(True)
+                writer.write(pjoin(group_dir, "train.key"), key_line)
+
+        foot = render(lexelt_foot) + render(lexical_sample_foot)
+        for group_key in seen_keys:
+            for tag in tags:
+                writer.write(pjoin(outdir, group_key, train_out(tag)), foot)
+    click.echo(writer.stats(), err=True)
+
+
+@munge.command("unified-to-senseval-gathered")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("keyin", type=click.File("r"))
+@click.argument("outf", type=click.File("w"))
+@click.argument("key3out", type=click.File("w"))
+@click.argument("keyout", type=click.File("w"))
+@click.option("--outtagf", type=click.File("w"))
+@click.option("--exclude-word", multiple=True)
+@click.option("--synset-group/--lemma-group")
+@click.option("--filter-key", type=click.File("rb"))
+@click.option("--run-size", type=int, default=DEFAULT_RUN_SIZE)
+def unified_to_senseval_gathered(
+    inf: IO,
+    keyin: IO,
+    outf: IO,
+    key3out: IO,
+    keyout: IO,
+    outtagf: Optional[IO],
+    exclude_word: List[str],
+    synset_group: bool,
+    filter_key: Optional[IO],
+    run_size: int,
+):
+    """
+    Does the same as unified-to-senseval followed by senseval-gather and
+    unified-key-to-ims-test, but groups the instances with an external sort
+    rather than scattering them into a directory per group. The groups are
+    written in sorted order.
+    """
+    exclude = get_exclude(exclude_word, filter_key)
+    outfs = [outf]
+    if outtagf is not None:
+        outfs.append(outtagf)
+    tags = [False, True][: len(outfs)]
+
+    def iter_records():
+        for (
+            group_keys,
+            lemma_str,
+            pos_chr,
+            key_line,
+            instance_xml,
+        ) in iter_senseval_instances(inf, keyin, exclude, synset_group, tags):
+            xmls = [instance_xml[tag] for tag in tags]
+            for group_key in group_keys:
+                yield group_key, lemma_str, pos_chr, key_line, xmls
+
+    for out_f in outfs:
+        lexical_sample_head(out_f)
+    records = external_sort(iter_records(), key=itemgetter(0), run_size=run_size)
+    for group_key, group in groupby(records, key=itemgetter(0)):
+        for idx, (_, lemma_str, pos_chr, key_line, xmls) in enumerate(group):
+            if idx == 0:
+                head = render_lexelt_head(synset_group, group_key, lemma_str, pos_chr)
+                for out_f in outfs:
+                    out_f.write(head)
+            for out_f, xml in zip(outfs, xmls):
+                out_f.write(xml)
+            key3out.write(key_line)
+            bits = key_line.split(" ")
+            keyout.write("{} {}".format(bits[1], " ".join(bits[2:])))
+        for out_f in outfs:
+            lexelt_foot(out_f)
+    for out_f in outfs:
+        lexical_sample_foot(out_f)
 
 
 @munge.command("senseval-gather")
@@ -741,13 +986,68 @@ def finnpos_senseval(inf: IO, outf: IO):
     return finnpos_senseval_impl(inf, outf)
 
 
+def seg_memo_options(func):
+    func = click.option(
+        "--seg-memo",
+        "seg_memo_path",
+        type=click.Path(dir_okay=False),
+        envvar="STIFF_OMORFI_SEG_MEMO",
+        help="Load the memo of OMorFi segmentations from this file and save "
+        "it back afterwards.",
+    )(func)
+    func = click.option(
+        "--seg-memo-size",
+        type=int,
+        default=None,
+        help="The maximum number of segmentations to memoise.",
+    )(func)
+    return func
+
+
+@contextmanager
+def seg_memo(path: Optional[str], max_size: Optional[int]):
+    from stiff.munge.seg import mk_seg_memo, SEG_MEMO_SIZE
+
+    memo = mk_seg_memo(path, max_size if max_size is not None else SEG_MEMO_SIZE)
+    yield memo
+    memo.save()
+    click.echo("OMorFi segmentation memo: " + memo.stats(), err=True)
+
+
 @munge.command("omorfi-segment-senseval")
 @click.argument("inf", type=click.File("rb"))
 @click.argument("outf", type=click.File("wb"))
-def omorfi_segment_senseval(inf: IO, outf: IO):
+@seg_memo_options
+def omorfi_segment_senseval(
+    inf: IO, outf: IO, seg_memo_path: Optional[str], seg_memo_size: Optional[int]
+):
     from stiff.munge.seg import omorfi_segment_senseval as omorfi_segment_senseval_impl
 
-    return omorfi_segment_senseval_impl(inf, outf)
+    with seg_memo(seg_memo_path, seg_memo_size) as memo:
+        omorfi_segment_senseval_impl(inf, outf, memo)
+
+
+@munge.command("finnpos-omorfi-senseval")
+@click.argument("inf", type=click.File("rb"))
+@click.argument("tag_outf", type=click.File("wb"))
+@click.argument("seg_outf", type=click.File("wb"))
+@seg_memo_options
+def finnpos_omorfi_senseval(
+    inf: IO,
+    tag_outf: IO,
+    seg_outf: IO,
+    seg_memo_path: Optional[str],
+    seg_memo_size: Optional[int],
+):
+    """
+    Do finnpos-senseval and omorfi-segment-senseval in a single pass over INF,
+    writing the FinnPOS tagged contexts to TAG_OUTF and the OMorFi segmented
+    contexts to SEG_OUTF.
+    """
+    from stiff.munge.pos import finnpos_omorfi_senseval as finnpos_omorfi_senseval_impl
+
+    with seg_memo(seg_memo_path, seg_memo_size) as memo:
+        finnpos_omorfi_senseval_impl(inf, tag_outf, seg_outf, memo)
 
 
 @munge.command("man-ann-select")
@@ -799,6 +1099,10 @@ def man_ann_select(inf: IO, outf: IO, source, end):
     "FiWN2 or OMW FiWN wikitionary based extensions",
 )
 def stiff_select_wn(inf: IO, outf: IO, wn):
+    transform_blocks(eq_matcher("annotation"), inf, mk_select_wn(wn), outf)
+
+
+def mk_select_wn(wn):
     from stiff.munge.utils import langs_of_wns
 
     selected_wns = set(wn)
@@ -825,7 +1129,7 @@ def stiff_select_wn(inf: IO, outf: IO, wn):
             if not common_wns:
                 continue
             wnlemma_dict["wn"] = ",".join(common_wns)
-            new_wmlemmas_bits.append(urlencode(wnlemma_dict))
+            new_wmlemmas_bits.append(encode_qs(wnlemma_dict))
         ann.attrib["wnlemma"] = " ".join(new_wmlemmas_bits)
 
         # annotation > #text
@@ -842,7 +1146,71 @@ def stiff_select_wn(inf: IO, outf: IO, wn):
         else:
             ann.text = bits[1]
 
-    transform_blocks(eq_matcher("annotation"), inf, select_wn, outf)
+    return select_wn
+
+
+@munge.command("stiff-to-unified-direct")
+@click.argument("stiff", type=click.File("rb"))
+@click.argument("outf", type=click.File("wb"))
+@click.argument("keyout", type=click.File("w"))
+@click.option(
+    "--input-fmt", type=click.Choice(INPUT_FMTS), default="stiff",
+)
+@click.option(
+    "--wn",
+    type=click.Choice(["fin", "qf2", "qwf"]),
+    default=["qf2"],
+    multiple=True,
+    help="Which WordNet (multiple allowed) to use as in stiff-select-wn",
+)
+def stiff_to_unified_direct(stiff: IO, outf: IO, keyout: IO, input_fmt: str, wn):
+    """
+    Convert STIFF to the Unified format and its keyfile in a single process.
+    This gives the same output as piping stiff-select-wn, filter.py
+    tok-span-dom, lemma-to-synset, stiff-to-unified and unified-split together,
+    but each sentence is parsed only once.
+    """
+    from stiff.filter import mk_tok_span_dom
+
+    select_wn = mk_select_wn(wn)
+    tok_span_dom = mk_tok_span_dom(False)
+    source, sent_iter = iter_stiff_sentences(stiff, input_fmt)
+    out = BufferedOutput(outf)
+    out.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+    with etree.xmlfile(out, encoding="utf-8") as xf:
+        with xf.element("corpus", {"lang": "fi", "source": source}):
+            xf.write("\n")
+            with xf.element("text", {"id": source}):
+                xf.write("\n")
+                for sent_id, sent_elem in sent_iter:
+                    for ann in sent_elem.xpath(".//annotation"):
+                        if select_wn(ann) is BYPASS:
+                            ann.getparent().remove(ann)
+                    tok_span_dom(sent_elem)
+                    for ann in sent_elem.xpath(".//annotation"):
+                        ann_lemma_to_synset(ann)
+                    # Build the same tree unified-split would parse from the
+                    # output of stiff-to-unified
+                    unified_sent = etree.Element("sentence", id=sent_id)
+                    unified_sent.text = "\n"
+                    for lemma, keys, pos, text in iter_unified_tokens(sent_elem):
+                        if lemma is None:
+                            tok = etree.SubElement(unified_sent, "wf")
+                        else:
+                            tok = etree.SubElement(
+                                unified_sent,
+                                "instance",
+                                lemma=lemma,
+                                key=" ".join(keys),
+                                pos=pos,
+                            )
+                        tok.text = text or None
+                        tok.tail = "\n"
+                    split_key(unified_sent, keyout)
+                    xf.write(unified_sent)
+            xf.write("\n")
+    out.write(b"\n")
+    out.flush()
 
 
 @munge.command("senseval-select-lemma")
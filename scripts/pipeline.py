@@ -29,20 +29,22 @@ def pipeline():
 
 def mk_eurosense2stifflike_pipeline(pipeline, babel2wn_map):
     tmp_dir = os.environ.get("EUROSENSE_PIPELINE_TMPDIR")
+    if tmp_dir is None:
+        # All the steps in one process, when there are no intermediates to dump
+        return (
+            pipeline
+            | python[munge_py, "eurosense-to-stifflike", "-", babel2wn_map, "-"]
+        )
     pipeline = pipeline | python[filter_py, "lang", "fi", "-", "-"]
-    if tmp_dir is not None:
-        pipeline = pipeline | tee["-", pjoin(tmp_dir, "lang.fi.xml")]
+    pipeline = pipeline | tee["-", pjoin(tmp_dir, "lang.fi.xml")]
     pipeline = pipeline | python[munge_py, "babelnet-lookup", "-", babel2wn_map, "-"]
-    if tmp_dir is not None:
-        pipeline = pipeline | tee["-", pjoin(tmp_dir, "wordnet.looked.up.xml")]
+    pipeline = pipeline | tee["-", pjoin(tmp_dir, "wordnet.looked.up.xml")]
     pipeline = pipeline | python[munge_py, "eurosense-reanchor", "-", "-"]
-    if tmp_dir is not None:
-        pipeline = pipeline | tee["-", pjoin(tmp_dir, "reanchored.xml")]
+    pipeline = pipeline | tee["-", pjoin(tmp_dir, "reanchored.xml")]
     pipeline = (
         pipeline | python[munge_py, "eurosense-lemma-fix", "--drop-unknown", "-", "-"]
     )
-    if tmp_dir is not None:
-        pipeline = pipeline | tee["-", pjoin(tmp_dir, "lemma-fixed.xml")]
+    pipeline = pipeline | tee["-", pjoin(tmp_dir, "lemma-fixed.xml")]
     pipeline = pipeline | python[filter_py, "rm-empty", "-", "-"]
     return pipeline
 
@@ -92,9 +94,31 @@ def eurosense2unified(inf, outf, keyout, head, babel2wn_map):
     type=click.Choice(["man-ann-stiff", "man-ann-europarl", "stiff"]),
     default="stiff",
 )
-def stiff2unified(inf, outf, keyout, head, input_fmt):
+@click.option(
+    "--direct/--piped",
+    default=True,
+    help="Do the conversion in a single munge.py stiff-to-unified-direct "
+    "process rather than piping together a process per step.",
+)
+def stiff2unified(inf, outf, keyout, head, input_fmt, direct):
+    pipeline = add_head(filter_py, add_zstd(inf), head)
+    if direct:
+        pipeline = (
+            pipeline
+            | python[
+                munge_py,
+                "stiff-to-unified-direct",
+                "--input-fmt",
+                input_fmt,
+                "-",
+                outf,
+                keyout,
+            ]
+        )
+        pipeline(retcode=[-13, 0], stderr=sys.stderr)
+        return
     pipeline = (
-        add_head(filter_py, add_zstd(inf), head)
+        pipeline
         | python[munge_py, "stiff-select-wn", "--wn", "qf2", "-", "-"]
         | python[filter_py, "tok-span-dom", "-", "-"]
         | python[munge_py, "lemma-to-synset", "-", "-"]
@@ -114,6 +138,11 @@ def stiff2unified(inf, outf, keyout, head, input_fmt):
 @click.option("--semcor/--fin")
 @click.option("--exclude-word", multiple=True)
 @click.option("--filter-key", type=click.Path())
+@click.option(
+    "--direct/--scatter",
+    help="Group the instances with an external sort and write the outputs "
+    "directly rather than scattering them into a temporary directory per word.",
+)
 def unified_to_sup(
     inf,
     keyin,
@@ -124,6 +153,7 @@ def unified_to_sup(
     semcor=False,
     exclude_word: Optional[List[str]] = None,
     filter_key: Optional[str] = None,
+    direct=False,
 ):
     """
     Make the unified format into the senseval format used by the supervised
@@ -131,6 +161,32 @@ def unified_to_sup(
     """
     if exclude_word is None:
         exclude_word = []
+    if semcor and outtagf is None:
+        raise click.UsageError("--semcor requires OUTTAGF")
+
+    if direct:
+        if semcor:
+            synsets_key = tempfile.mktemp(suffix="synsets.key")
+            python(munge_py, "lemma-to-synset-key", keyin, synsets_key)
+            keyin = synsets_key
+        args = [
+            munge_py,
+            "unified-to-senseval-gathered",
+            inf,
+            keyin,
+            outf,
+            key3out,
+            keyout,
+        ]
+        for ex in exclude_word:
+            args.extend(["--exclude-word", ex])
+        if filter_key:
+            args.extend(["--filter-key", filter_key])
+        if semcor:
+            args.extend(["--synset-group", "--outtagf", outtagf])
+        python(*args)
+        return
+
     tempdir = tempfile.mkdtemp(prefix="train")
 
     def u2s(keyin, tempdir, synset_group=False, write_tag=False):
@@ -289,10 +345,17 @@ def unified_to_single_eval(seg, inf, keyin, dirout, exclude):
         pdict["sup"],
         pdict["sup3key"],
         pdict["supkey"],
-        exclude,
+        None,
+        exclude_word=exclude,
+        direct=True,
+    )
+    python(
+        munge_py,
+        "finnpos-omorfi-senseval",
+        pdict["sup"],
+        pdict["suptag"],
+        pdict["supseg"],
     )
-    python(munge_py, "finnpos-senseval", pdict["sup"], pdict["suptag"])
-    python(munge_py, "omorfi-segment-senseval", pdict["sup"], pdict["supseg"])
 
 
 @pipeline.command("mk-stiff")
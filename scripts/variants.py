@@ -15,6 +15,7 @@ from stiff.methods import (
     lookup_stage,
 )
 from stiff.utils.pipeline import add_head, ensure_dir, exec_pipeline
+from stiff.utils.stage_cache import StageCache, tee_zstd
 from plumbum import local
 from string import Template
 
@@ -22,6 +23,9 @@ python = local[sys.executable]
 
 dir = os.path.dirname(os.path.realpath(__file__))
 filter_py = os.path.join(dir, "filter.py")
+variants_py = os.path.realpath(__file__)
+
+FOLD_STAGES = ["fold-support fi", "lang fi"]
 
 
 @click.group()
@@ -32,32 +36,89 @@ def variants():
     pass
 
 
+def fold_pipeline(inf, head=None):
+    from plumbum.cmd import zstdcat
+
+    pipeline = add_head(
+        filter_py, zstdcat["-D", "zstd-compression-dictionary", inf], head
+    )
+    return add_stages(pipeline, FOLD_STAGES)
+
+
+def stage_cmd(stage):
+    return python[[filter_py] + lookup_stage(stage).split(" ") + ["-", "-"]]
+
+
+def add_stages(pipeline, stages):
+    for stage in stages:
+        pipeline = pipeline | stage_cmd(stage)
+    return pipeline
+
+
+def cached_pipeline(stage_cache, inf, method_stages, head=None):
+    """
+    Make a pipeline which starts from the longest cached prefix of the stages
+    of a method and stores the output of every stage after it in the cache.
+    """
+    from plumbum.cmd import zstdcat
+
+    stages = FOLD_STAGES + [lookup_stage(stage) for stage in method_stages]
+    if head is not None:
+        stages.insert(0, f"head --sentences {head}")
+    start = stage_cache.longest_prefix(stages)
+    if os.environ.get("TRACE_PIPELINE"):
+        print(f"Reusing {start} of {len(stages)} stages from the cache")
+    if start:
+        pipeline = zstdcat[stage_cache.path(stages[:start])]
+    else:
+        pipeline = zstdcat["-D", "zstd-compression-dictionary", inf]
+    for end in range(start + 1, len(stages) + 1):
+        pipeline = (
+            pipeline
+            | stage_cmd(stages[end - 1])
+            | python[variants_py, "cache-tee", stage_cache.tmp_path(stages[:end])]
+        )
+    return pipeline
+
+
 @variants.command("proc")
 @click.argument("method")
 @click.argument("inf", type=click.Path(exists=True))
 @click.argument("outf", type=click.Path())
 @click.option("--head", default=None)
 @click.option("--no-zstd-out/--zstd-out")
-def proc(method, inf, outf, head=None, no_zstd_out=False):
-    from plumbum.cmd import zstdcat, zstdmt
+@click.option(
+    "--table",
+    type=click.Path(exists=True),
+    default=None,
+    help="Run all stages at once on an annotation table made by ann-table.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    envvar="STIFF_STAGE_CACHE",
+    default=None,
+    help="Reuse and store the output of each prefix of the stages in this "
+    "directory.",
+)
+def proc(method, inf, outf, head=None, no_zstd_out=False, table=None, cache_dir=None):
+    from plumbum.cmd import zstdmt
 
     if os.environ.get("TRACE_PIPELINE"):
         print(method)
-    pipeline = add_head(
-        filter_py, zstdcat["-D", "zstd-compression-dictionary", inf], head
-    )
-
-    pipeline = (
-        pipeline
-        | python[filter_py, "fold-support", "fi", "-", "-"]
-        | python[filter_py, "lang", "fi", "-", "-"]
-    )
 
     method_stages = METHODS[method]
-    for stage in method_stages:
-        long_stage = lookup_stage(stage)
-        args = [filter_py] + long_stage.split(" ") + ["-", "-"]
-        pipeline = pipeline | python[args]
+    stage_cache = None
+    if table is not None:
+        if cache_dir is not None:
+            raise click.UsageError("--table cannot be used with --cache-dir")
+        args = [filter_py, "table-proc", "-", table, "-"] + method_stages
+        pipeline = fold_pipeline(inf, head) | python[args]
+    elif cache_dir is not None:
+        stage_cache = StageCache(cache_dir, inf)
+        pipeline = cached_pipeline(stage_cache, inf, method_stages, head)
+    else:
+        pipeline = add_stages(fold_pipeline(inf, head), method_stages)
 
     if not no_zstd_out:
         pipeline = (
@@ -66,7 +127,36 @@ def proc(method, inf, outf, head=None, no_zstd_out=False):
     else:
         pipeline = pipeline > outf
 
-    exec_pipeline(pipeline, retcode=[-13, 0])
+    if stage_cache is None:
+        exec_pipeline(pipeline, retcode=[-13, 0])
+        return
+    try:
+        exec_pipeline(pipeline, retcode=[-13, 0])
+    except BaseException:
+        stage_cache.discard()
+        raise
+    stage_cache.commit()
+
+
+@variants.command("cache-tee")
+@click.argument("path", type=click.Path())
+def cache_tee(path):
+    """
+    Copy stdin to stdout while writing a zstd compressed copy to PATH. Used
+    by proc --cache-dir.
+    """
+    tee_zstd(sys.stdin.buffer, sys.stdout.buffer, path)
+
+
+@variants.command("ann-table")
+@click.argument("inf", type=click.Path(exists=True))
+@click.argument("table", type=click.Path())
+def ann_table(inf, table):
+    """
+    Build the annotation table used by proc --table from the raw corpus INF.
+    """
+    pipeline = fold_pipeline(inf) | python[filter_py, "ann-table", "-", table]
+    exec_pipeline(pipeline)
 
 
 @variants.command("eval")
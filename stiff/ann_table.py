@@ -0,0 +1,274 @@
+"""
+A columnar table of the annotations of a whole STIFF corpus, so that chains of
+ranking tournaments can be run as grouped array operations rather than one
+pass over the XML per stage.
+
+The rank given to an annotation by any RankTournament depends only on the
+annotation and its sentence, never on which other annotations are left, so
+the ranks are computed once per annotation and stored as columns. Each
+annotation is identified by its position in the document, and the
+annotations sharing a span within a sentence share a group number. Running a
+chain of stages then only updates a boolean array of which annotations are
+still alive, which is finally projected back onto the XML.
+"""
+from dataclasses import dataclass
+from typing import Dict, IO, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from stiff.filter import (
+    AlignTournament,
+    FreqRankDom,
+    HasSupportTournament,
+    LemmaPathTournament,
+    NaiveLemmaTournament,
+    NaivePosTournament,
+    NonDerivTournament,
+    PreferNonWikiSourceDom,
+    PreferNonWikiTargetDom,
+    SrcCharLenTournament,
+    decode_dom_arg,
+    decode_naive_pos_arg,
+    get_finnpos_feats,
+    get_rm_pos_matchers,
+    has_rm_pos,
+    trim_anns,
+)
+from stiff.methods import lookup_stage
+from stiff.utils.anns import SentCache
+from stiff.utils.xml import iter_sentences, transform_sentences
+
+RANK_COLUMNS = {
+    "support": HasSupportTournament,
+    "align": AlignTournament,
+    "non-deriv": NonDerivTournament,
+    "freq": FreqRankDom,
+    "src-char-len": SrcCharLenTournament,
+    "non-recurs": LemmaPathTournament,
+    "naive-lemma": NaiveLemmaTournament,
+    "naive-pos": NaivePosTournament,
+    "non-wiki-trg": PreferNonWikiTargetDom,
+    "non-wiki-src": PreferNonWikiSourceDom,
+}
+RM_POS_LEVELS = ("soft", "normal", "agg")
+# Ranks of AlphabeticDom are orderings of the annotation text rather than
+# numbers so they are numbered after the whole corpus has been seen
+ALPHA_COLUMN = "alpha"
+
+
+@dataclass
+class TableStage:
+    column: Optional[str]
+    do_dom: bool = True
+    rm_ranks: Tuple[int, ...] = ()
+    filter_column: Optional[str] = None
+    filter_vals: Tuple[int, ...] = ()
+
+
+def mk_table_stages() -> Dict[str, TableStage]:
+    stages = {
+        "freq-dom": TableStage("freq"),
+        "break-ties": TableStage(ALPHA_COLUMN),
+        "src-char-len-dom": TableStage("src-char-len"),
+        "supported-freq-dom": TableStage(
+            "freq", filter_column="support", filter_vals=(1,)
+        ),
+        "supported-non-wiki-src": TableStage(
+            "non-wiki-src", filter_column="support", filter_vals=(1,)
+        ),
+        "rm-ambg": TableStage(None),
+    }
+    for command, column in [
+        ("has-support-dom", "support"),
+        ("align-dom", "align"),
+        ("non-deriv-dom", "non-deriv"),
+        ("non-recurs-dom", "non-recurs"),
+        ("finnpos-naive-lemma-dom", "naive-lemma"),
+        ("non-wiki-src", "non-wiki-src"),
+        ("non-wiki-trg", "non-wiki-trg"),
+    ]:
+        for proc in ("dom", "rm"):
+            do_dom, rm_ranks = decode_dom_arg(proc)
+            stages[f"{command} --proc={proc}"] = TableStage(column, do_dom, rm_ranks)
+    for proc in ("dom", "rm-dom", "rm", "rm-agg"):
+        do_dom, rm_ranks = decode_naive_pos_arg(proc)
+        stages[f"finnpos-naive-pos-dom --proc={proc}"] = TableStage(
+            "naive-pos", do_dom, tuple(rm_ranks)
+        )
+    for level in RM_POS_LEVELS:
+        stages[f"finnpos-rm-pos --level={level}"] = TableStage(
+            f"rm-pos-{level}", False, (0,)
+        )
+    return stages
+
+
+TABLE_STAGES = mk_table_stages()
+
+
+def get_table_stage(stage: str) -> TableStage:
+    long_stage = lookup_stage(stage)
+    if long_stage not in TABLE_STAGES:
+        raise ValueError(f"Stage {stage!r} cannot be run on an annotation table")
+    return TABLE_STAGES[long_stage]
+
+
+def stage_columns(stages: Iterable[str]) -> List[str]:
+    columns: List[str] = []
+    for stage in stages:
+        table_stage = get_table_stage(stage)
+        for column in (table_stage.column, table_stage.filter_column):
+            if column is not None and column not in columns:
+                columns.append(column)
+    return columns
+
+
+ALL_COLUMNS = stage_columns(TABLE_STAGES)
+
+
+class AnnTable:
+    """
+    Columns of equal length with one entry per annotation in document order:
+
+     * group: the number of the (sentence, token, token length) span
+     * every requested rank column
+
+    sent_anns gives the number of annotations in each sentence.
+    """
+
+    def __init__(self, sent_anns: np.ndarray, group: np.ndarray, columns):
+        self.sent_anns = sent_anns
+        self.group = group
+        self.columns: Dict[str, np.ndarray] = columns
+        self.num_groups = int(group.max()) + 1 if len(group) else 0
+
+    def __len__(self):
+        return len(self.group)
+
+    def save(self, outf: IO):
+        np.savez_compressed(
+            outf, sent_anns=self.sent_anns, group=self.group, **self.columns
+        )
+
+    @classmethod
+    def load(cls, inf: IO) -> "AnnTable":
+        data = np.load(inf)
+        columns = {
+            key: data[key] for key in data.files if key not in ("sent_anns", "group")
+        }
+        return cls(data["sent_anns"], data["group"], columns)
+
+    def alive(self) -> np.ndarray:
+        return np.ones(len(self), dtype=bool)
+
+    def run_stage(self, stage: str, alive: np.ndarray):
+        """
+        Run STAGE, updating ALIVE in place.
+        """
+        table_stage = get_table_stage(stage)
+        if table_stage.column is None:
+            # rm-ambg
+            counts = np.bincount(self.group[alive], minlength=self.num_groups)
+            alive &= counts[self.group] < 2
+            return
+        if table_stage.column not in self.columns:
+            raise ValueError(f"Table has no column {table_stage.column!r}")
+        ranks = self.columns[table_stage.column]
+        part = alive.copy()
+        if table_stage.filter_column is not None:
+            part &= np.isin(
+                self.columns[table_stage.filter_column], table_stage.filter_vals
+            )
+        if table_stage.rm_ranks:
+            removed = part & np.isin(ranks, table_stage.rm_ranks)
+            alive &= ~removed
+            part &= ~removed
+        if table_stage.do_dom:
+            best = np.full(self.num_groups, np.iinfo(ranks.dtype).min, ranks.dtype)
+            np.maximum.at(best, self.group[part], ranks[part])
+            alive &= ~(part & (ranks < best[self.group]))
+
+    def run_stages(self, stages: Iterable[str]) -> np.ndarray:
+        alive = self.alive()
+        for stage in stages:
+            self.run_stage(stage, alive)
+        return alive
+
+
+def build_ann_table(inf: IO, columns: Iterable[str] = ALL_COLUMNS) -> AnnTable:
+    """
+    Build an AnnTable with the given rank COLUMNS from the STIFF XML in INF.
+    """
+    columns = list(columns)
+    rm_pos_matchers = {
+        level: get_rm_pos_matchers(level)
+        for level in RM_POS_LEVELS
+        if f"rm-pos-{level}" in columns
+    }
+    sent_anns = []
+    group = []
+    values: Dict[str, list] = {column: [] for column in columns}
+    num_groups = 0
+    for sent in iter_sentences(inf):
+        cache = SentCache(sent)
+        extras = {
+            column: RANK_COLUMNS[column].prepare_sent(cache)
+            for column in columns
+            if column in RANK_COLUMNS
+        }
+        if rm_pos_matchers:
+            finnpos_feats = get_finnpos_feats(cache)
+        anns = cache.anns()
+        sent_anns.append(len(anns))
+        sent_groups: Dict[Tuple[int, int], int] = {}
+        for ann in anns:
+            span = ann.pos
+            if span not in sent_groups:
+                sent_groups[span] = num_groups
+                num_groups += 1
+            group.append(sent_groups[span])
+            for column in columns:
+                if column == ALPHA_COLUMN:
+                    value = ann.text
+                elif column in RANK_COLUMNS:
+                    value = RANK_COLUMNS[column].rank(ann, *extras[column])
+                else:
+                    level = column[len("rm-pos-") :]
+                    to_remove = rm_pos_matchers[level]
+                    value = 0 if has_rm_pos(ann, finnpos_feats, to_remove) else 1
+                values[column].append(value)
+    if ALPHA_COLUMN in values:
+        # AlphabeticDom prefers texts which sort first
+        texts = values[ALPHA_COLUMN]
+        order = {text: idx for idx, text in enumerate(sorted(set(texts)))}
+        values[ALPHA_COLUMN] = [-order[text] for text in texts]
+    return AnnTable(
+        np.array(sent_anns, dtype=np.int64),
+        np.array(group, dtype=np.int64),
+        {column: np.array(vals, dtype=np.int64) for column, vals in values.items()},
+    )
+
+
+def project_table(inf: IO, table: AnnTable, alive: np.ndarray, outf: IO):
+    """
+    Write the STIFF XML in INF to OUTF keeping only the annotations which are
+    ALIVE according to TABLE. INF must be the document TABLE was built from or
+    a prefix of it, such as the output of head.
+    """
+    ann_idx = 0
+    sent_idx = 0
+
+    def proc_sent(sent):
+        nonlocal ann_idx, sent_idx
+        anns = sent.xpath("./annotations/annotation")
+        if sent_idx >= len(table.sent_anns) or table.sent_anns[sent_idx] != len(anns):
+            raise ValueError(
+                "Sentence {} does not match the annotation table".format(
+                    sent.attrib.get("id")
+                )
+            )
+        sent_alive = alive[ann_idx : ann_idx + len(anns)]
+        trim_anns(anns, [ann for ann, keep in zip(anns, sent_alive) if keep])
+        ann_idx += len(anns)
+        sent_idx += 1
+
+    transform_sentences(inf, proc_sent, outf)
@@ -1,11 +1,20 @@
-import ast
 from abc import ABC, abstractmethod
-from functools import reduce, total_ordering
-import json
-
-from stiff.utils import parse_qs_single
-from stiff.utils.anns import get_ann_pos
-from stiff.utils.xml import transform_sentences
+from bisect import bisect_left, bisect_right
+from functools import lru_cache, reduce, total_ordering
+from itertools import accumulate
+from typing import FrozenSet, Set
+
+from stiff.methods import lookup_stage
+from stiff.utils import encode_qs, parse_qs_single
+from stiff.utils.anns import (
+    SentCache,
+    ann_elem,
+    ann_view,
+    parse_transform_chain,
+    upgrade_support,
+)
+from stiff.utils.gram import get_finnpos_analys, get_finnpos_feats
+from stiff.utils.xml import BREAK, BYPASS, transform_sentences
 
 
 def decode_dom_arg(proc):
@@ -15,6 +24,17 @@ def decode_dom_arg(proc):
         return False, (0,)
 
 
+def decode_naive_pos_arg(proc):
+    if proc == "dom":
+        return True, []
+    elif proc == "rm-dom":
+        return True, [-1]
+    elif proc == "rm":
+        return False, [-1]
+    elif proc == "rm-agg":
+        return False, [-1, 0]
+
+
 def get_wn_pos(ann):
     wn_ids = ann.text.split(" ")
     poses = [wn_id.rsplit(".", 2)[-2] for wn_id in wn_ids]
@@ -33,16 +53,10 @@ def get_headword_offset(ann):
         return 0
     else:
         # "n" "r" "a"
-        tok, tok_len = get_ann_pos(ann)
+        tok, tok_len = ann_view(ann).pos
         return tok_len - 1
 
 
-def get_finnpos_analys(sent):
-    gram = sent.xpath("gram[@type='finnpos']")
-    assert len(gram) == 1
-    return json.loads(gram[0].text)
-
-
 FINNPOS_WN_POS_MAP = {"VERB": "v", "NOUN": "n", "ADVERB": "r", "ADJECTIVE": "a"}
 
 
@@ -57,10 +71,95 @@ def lemmatized_pos_match(wn_pos, finnpos_feats):
         return -1
 
 
+def get_rm_pos_matchers(level):
+    def m(feat, val):
+        def inner(feats):
+            return feat in feats and feats[feat] == val
+
+        return inner
+
+    to_remove = [m("pos", "PRONOUN")]
+    if level in ("normal", "agg"):
+        to_remove.extend(
+            (
+                m("pos", "NUMERAL"),
+                m("pos", "INTERJECTION"),
+                m("pos", "CONJUNCTION"),
+                m("pos", "PARTICLE"),
+                m("pos", "PUNCTUATION"),
+                m("proper", "PROPER"),
+            )
+        )
+    if level == "agg":
+        to_remove.append(m("pos", "ADPOSITION"))
+    return to_remove
+
+
+def has_rm_pos(ann, finnpos_feats, to_remove):
+    """
+    Does ANN cover a single token with a POS matched by one of TO_REMOVE?
+    """
+    tok, tok_len = ann_view(ann).pos
+    if tok_len != 1:
+        return False
+    props = finnpos_feats[tok]
+    return any((match(props) for match in to_remove))
+
+
 def trim_anns(anns, new_anns):
     for ann in anns:
         if ann not in new_anns:
-            ann.getparent().remove(ann)
+            elem = ann_elem(ann)
+            elem.getparent().remove(elem)
+
+
+def source_support(from_elem):
+    """
+    Get the information about a source annotation which fold-support puts in
+    the supports of the annotations it supports.
+    """
+    anchor_positions = from_elem.attrib["anchor-positions"]
+    for position in anchor_positions.split(" "):
+        from_source = parse_qs_single(position)["from-id"]
+    return {
+        "transfer-from-wordnets": from_elem.attrib["wordnets"],
+        "transfer-from-source": from_source,
+        "transfer-from-lemma-path": from_elem.attrib["lemma-path"],
+        "transfer-from-anchor-positions": anchor_positions,
+        "transfer-from-anchor-char-length": len(from_elem.attrib["anchor"]),
+    }
+
+
+def mk_fold_support(lang):
+    """
+    Make a sentence transformer for fold-support which can also be run
+    in-process along with other stages.
+    """
+    xpath = "./annotations/annotation[@lang='{}']".format(lang)
+
+    def fold_support(sent, cache=None):
+        anns_by_id = None
+        source_supports = {}
+        for ann in sent.xpath(xpath):
+            support = ann.attrib.get("support")
+            if not support:
+                continue
+            if anns_by_id is None:
+                anns_by_id = {}
+                for other in sent.xpath("./annotations/annotation"):
+                    anns_by_id.setdefault(other.attrib.get("id"), other)
+            new_support = []
+            for supp in support.split(" "):
+                supp = parse_qs_single(supp)
+                upgrade_support(supp)
+                trans_from = supp.pop("transfer-from")
+                if trans_from not in source_supports:
+                    source_supports[trans_from] = source_support(anns_by_id[trans_from])
+                supp.update(source_supports[trans_from])
+                new_support.append(encode_qs(supp))
+            ann.attrib["support"] = " ".join(new_support)
+
+    return fold_support
 
 
 class TournamentBase(ABC):
@@ -73,19 +172,21 @@ class TournamentBase(ABC):
         return transform_sentences(inf, self.proc_sent, outf)
 
     @staticmethod
-    def prepare_sent(sent):
+    def prepare_sent(cache):
         return ()
 
-    def get_anns(self, sent, *extra):
-        return sent.xpath("./annotations/annotation")
+    def get_anns(self, cache, *extra):
+        return cache.anns()
 
     @abstractmethod
     def proc_anns(self, anns):
         pass
 
-    def proc_sent(self, sent):
-        extra = self.prepare_sent(sent)
-        anns = self.get_anns(sent, *extra)
+    def proc_sent(self, sent, cache=None):
+        if cache is None:
+            cache = SentCache(sent)
+        extra = self.prepare_sent(cache)
+        anns = self.get_anns(cache, *extra)
         self.proc_anns(anns, *extra)
 
 
@@ -99,8 +200,9 @@ class NumRankTournamentBase(TournamentBase):
         new_anns = anns.copy()
         best_ranks = {}
         ranks = {}
+        keys = {}
         for ann in anns:
-            key = self.key(ann)
+            key = keys[ann] = self.key(ann)
             rank = self.rank(ann, *extra)
             ranks[ann] = rank
             if rank in self.rm_ranks:
@@ -110,8 +212,7 @@ class NumRankTournamentBase(TournamentBase):
                     best_ranks[key] = rank
         if self.do_dom:
             for ann in anns:
-                key = self.key(ann)
-                best_rank = best_ranks[key]
+                best_rank = best_ranks[keys[ann]]
                 if best_rank > ranks[ann]:
                     new_anns.remove(ann)
         trim_anns(anns, new_anns)
@@ -132,11 +233,43 @@ class DomOnlyRankTournament(NumRankTournamentBase):
 
 
 class CmpTournament(TournamentBase):
+    @staticmethod
+    def features(ann):
+        """
+        Precompute whatever cmp(...) needs to know about ANN. It is called
+        once per annotation and cmp(...) is passed the results.
+        """
+        return ann
+
     @staticmethod
     @abstractmethod
-    def cmp(ann1, ann2):
+    def cmp(feats1, feats2):
         pass
 
+    def nondominated(self, group_feats, *extra):
+        """
+        Returns the indices of GROUP_FEATS which are not dominated according
+        to cmp(...). Since cmp(...) should define a strict partial order, this
+        does not depend on the order of the comparisons, and so subclasses may
+        override it with something faster than comparing all pairs.
+        """
+        nondominated = set(range(len(group_feats)))
+        for idx, feats in enumerate(group_feats):
+            if idx not in nondominated:
+                continue
+            for other_idx, other_feats in enumerate(group_feats[idx + 1 :], idx + 1):
+                if other_idx not in nondominated:
+                    continue
+                cmp_res = self.cmp(feats, other_feats, *extra)
+                if cmp_res == -1:
+                    nondominated.remove(idx)
+                    break
+                elif cmp_res == 1:
+                    nondominated.remove(other_idx)
+                else:
+                    pass
+        return nondominated
+
     def proc_anns(self, anns, *extra):
         grouped = {}
         for ann in anns:
@@ -144,29 +277,17 @@ class CmpTournament(TournamentBase):
             grouped.setdefault(key, []).append(ann)
         new_anns = []
         for key, group_anns in grouped.items():
-            nondominated = set(range(len(group_anns)))
-            for idx, ann in enumerate(group_anns):
-                if idx not in nondominated:
-                    continue
-                for other_idx, other_ann in enumerate(group_anns[idx + 1 :], idx + 1):
-                    if other_idx not in nondominated:
-                        continue
-                    cmp_res = self.cmp(ann, other_ann, *extra)
-                    if cmp_res == -1:
-                        nondominated.remove(idx)
-                        break
-                    elif cmp_res == 1:
-                        nondominated.remove(other_idx)
-                    else:
-                        pass
-            new_anns.extend((group_anns[idx] for idx in nondominated))
+            group_feats = [self.features(ann, *extra) for ann in group_anns]
+            new_anns.extend(
+                (group_anns[idx] for idx in self.nondominated(group_feats, *extra))
+            )
         trim_anns(anns, new_anns)
 
 
 class SpanKeyMixin:
     @staticmethod
     def key(ann):
-        return get_ann_pos(ann)
+        return ann_view(ann).pos
 
 
 class HasSupportTournament(SpanKeyMixin, RankTournament):
@@ -178,11 +299,8 @@ class HasSupportTournament(SpanKeyMixin, RankTournament):
 class AlignTournament(SpanKeyMixin, RankTournament):
     @staticmethod
     def rank(ann):
-        if "support" not in ann.attrib:
-            return 0
         have_aligned = False
-        for support_qs in ann.attrib["support"].split(" "):
-            support = parse_qs_single(support_qs)
+        for support in ann_view(ann).supports:
             if support["transfer-type"] == "aligned":
                 have_aligned = True
         return 1 if have_aligned else 0
@@ -191,67 +309,66 @@ class AlignTournament(SpanKeyMixin, RankTournament):
 class SrcCharLenTournament(SpanKeyMixin, RankTournament):
     @staticmethod
     def rank(ann):
-        if "support" not in ann.attrib:
-            return 0
         max_len = 0
-        for support_qs in ann.attrib["support"].split(" "):
-            support = parse_qs_single(support_qs)
+        for support in ann_view(ann).supports:
             cur_len = int(support["transfer-from-anchor-char-length"])
             if cur_len > max_len:
                 max_len = cur_len
         return max_len
 
 
+def parse_src_spans(support_str):
+    """
+    Get the (char, length) spans of the source anchors of a support attribute.
+    """
+    spans = []
+    for support_qs in support_str.split(" ") if support_str else ():
+        support_dict = parse_qs_single(support_qs)
+        positions = parse_qs_single(support_dict["transfer-from-anchor-positions"])
+        spans.append(
+            (
+                int(positions["char"]),
+                int(support_dict["transfer-from-anchor-char-length"]),
+            )
+        )
+    return spans
+
+
+def cmp_span(span1, span2):
+    """
+    Returns  1 if span1 strictly contains span2
+          | -1 if span2 strictly contains span1
+          |  0 otherwise
+    """
+    char1, len1 = span1
+    char2, len2 = span2
+    end1 = char1 + len1
+    end2 = char2 + len2
+    if (char1 < char2 and end1 >= end2) or (char1 <= char2 and end1 > end2):
+        return 1
+    elif (char1 > char2 and end1 <= end2) or (char1 >= char2 and end1 < end2):
+        return -1
+    else:
+        return 0
+
+
 class SrcCharSpanTournament(SpanKeyMixin, CmpTournament):
     @staticmethod
-    def cmp(ann1, ann2):
+    def features(ann):
+        return ann_view(ann).parse_attr("support", parse_src_spans)
+
+    @staticmethod
+    def cmp(spans1, spans2):
         """
         Returns  1 if ann1 dominates ann2
               | -1 if ann2 dominates ann1
               |  0 otherwise
         """
-
-        def extract_spans(ann):
-            for support_qs in ann.attrib["support"].split(" "):
-                support_dict = parse_qs_single(support_qs)
-                positions = parse_qs_single(
-                    support_dict["transfer-from-anchor-positions"]
-                )
-                yield int(positions["char"]), int(
-                    support_dict["transfer-from-anchor-char-length"]
-                )
-
-        def cmp_sup(sup1, sup2):
-            """
-            Returns  1 if sup1 spans sup2
-                  | -1 if sup2 spans sup1
-                  |  0 otherwise
-            """
-            char1, len1 = sup1
-            char2, len2 = sup2
-            end1 = char1 + len1
-            end2 = char2 + len2
-            if (char1 < char2 and end1 >= end2) or (char1 <= char2 and end1 > end2):
-                return 1
-            elif (char1 > char2 and end1 <= end2) or (char1 >= char2 and end1 < end2):
-                return -1
-            else:
-                return 0
-
-        if "support" not in ann1.attrib and "support" not in ann2.attrib:
-            return 0
-
         ann1dom = any(
-            (
-                all((cmp_sup(span1, span2) == 1 for span2 in extract_spans(ann2)))
-                for span1 in extract_spans(ann1)
-            )
+            (all((cmp_span(span1, span2) == 1 for span2 in spans2)) for span1 in spans1)
         )
         ann2dom = any(
-            (
-                all((cmp_sup(span2, span1) == 1 for span1 in extract_spans(ann1)))
-                for span2 in extract_spans(ann2)
-            )
+            (all((cmp_span(span2, span1) == 1 for span1 in spans1)) for span2 in spans2)
         )
         if ann1dom and not ann2dom:
             return 1
@@ -260,24 +377,74 @@ class SrcCharSpanTournament(SpanKeyMixin, CmpTournament):
         else:
             return 0
 
+    def nondominated(self, group_spans, *extra):
+        """
+        An annotation with source spans is dominated when some source span of
+        another annotation strictly contains all of them, which is the case
+        when it contains their hull, and is not equal to it when the hull is
+        itself one of the spans. This is found for every annotation at once
+        using the maximum end of the spans starting before each point. An
+        annotation without any source spans is dominated by any annotation
+        with some.
+        """
+        starts = sorted(
+            (char, char + length) for spans in group_spans for char, length in spans
+        )
+        if not starts:
+            return range(len(group_spans))
+        start_chars = [char for char, _ in starts]
+        max_ends = list(accumulate((end for _, end in starts), max))
+
+        def max_end_before(char, inclusive):
+            idx = (bisect_right if inclusive else bisect_left)(start_chars, char)
+            return max_ends[idx - 1] if idx else None
+
+        result = []
+        for idx, spans in enumerate(group_spans):
+            if not spans:
+                continue
+            hull_start = min(char for char, _ in spans)
+            hull_end = max(char + length for char, length in spans)
+            hull_is_span = (hull_start, hull_end - hull_start) in spans
+            # A span (char, end) contains the hull when char <= hull_start and
+            # end >= hull_end
+            max_end = max_end_before(hull_start, True)
+            if max_end is not None and (
+                max_end > hull_end or (max_end == hull_end and not hull_is_span)
+            ):
+                continue
+            if hull_is_span:
+                # Starting strictly before the hull is also enough
+                max_end = max_end_before(hull_start, False)
+                if max_end is not None and max_end >= hull_end:
+                    continue
+            result.append(idx)
+        return result
+
 
 class FinnPOSMixin:
     @staticmethod
-    def prepare_sent(sent):
-        return (get_finnpos_analys(sent),)
+    def prepare_sent(cache):
+        return (get_finnpos_analys(cache),)
+
+
+class FinnPOSFeatsMixin:
+    @staticmethod
+    def prepare_sent(cache):
+        return (get_finnpos_feats(cache),)
 
 
 class NaiveLemmaTournament(FinnPOSMixin, SpanKeyMixin, RankTournament):
     @staticmethod
     def rank(ann, finnpos_analys):
-        if "wnlemma" not in ann.attrib or not ann.attrib["wnlemma"]:
+        view = ann_view(ann)
+        if not view.wnlemmas:
             return 0
-        tok, tok_len = get_ann_pos(ann)
+        tok, tok_len = view.pos
         head_off = get_headword_offset(ann)
         finnpos_head, feats = finnpos_analys[tok + head_off]
         any_match = False
-        for lemma_bit in ann.attrib["wnlemma"].split(" "):
-            lemma_dict = parse_qs_single(lemma_bit)
+        for lemma_dict in view.wnlemmas:
             lemma = lemma_dict["l"]
             wn_head = lemma.split("_")[head_off]
             if finnpos_head == wn_head:
@@ -285,13 +452,13 @@ class NaiveLemmaTournament(FinnPOSMixin, SpanKeyMixin, RankTournament):
         return 1 if any_match else 0
 
 
-class NaivePosTournament(FinnPOSMixin, SpanKeyMixin, RankTournament):
+class NaivePosTournament(FinnPOSFeatsMixin, SpanKeyMixin, RankTournament):
     @staticmethod
-    def rank(ann, finnpos_analys):
-        tok, tok_len = get_ann_pos(ann)
+    def rank(ann, finnpos_feats):
+        tok, tok_len = ann_view(ann).pos
         wn_pos = get_wn_pos(ann)
         head_off = get_headword_offset(ann)
-        lemma, feats = finnpos_analys[tok + head_off]
+        feats = finnpos_feats[tok + head_off]
         return lemmatized_pos_match(wn_pos, feats)
 
 
@@ -322,15 +489,11 @@ class ReverseOrder:
 class NonDerivTournament(SpanKeyMixin, RankTournament):
     @staticmethod
     def rank(ann):
-        if "support" not in ann.attrib:
-            return 0
         has_non_deriv = False
-        for support_qs in ann.attrib["support"].split(" "):
-            support = parse_qs_single(support_qs)
+        for support in ann_view(ann).supports:
             if "transform-chain" not in support:
                 return 0
-            # XXX: Should be json
-            transform_chain = ast.literal_eval(support["transform-chain"])
+            transform_chain = parse_transform_chain(support["transform-chain"])
             if "deriv" not in transform_chain:
                 has_non_deriv = True
         return 1 if has_non_deriv else 0
@@ -351,8 +514,8 @@ class AlphabeticDom(SpanKeyMixin, DomOnlyRankTournament):
 def mk_conditional_tournament(ApplyTour, FilterTour, filter_vals):
     class ConditionalTournament(ApplyTour):
         @staticmethod
-        def prepare_sent(sent):
-            return ApplyTour.prepare_sent(sent), FilterTour.prepare_sent(sent)
+        def prepare_sent(cache):
+            return ApplyTour.prepare_sent(cache), FilterTour.prepare_sent(cache)
 
         @staticmethod
         def key(ann):
@@ -361,8 +524,8 @@ def mk_conditional_tournament(ApplyTour, FilterTour, filter_vals):
             assert apply_key == filter_key
             return apply_key
 
-        def get_anns(self, sent, apply_extra, filter_extra):
-            anns = super().get_anns(sent)
+        def get_anns(self, cache, apply_extra, filter_extra):
+            anns = super().get_anns(cache)
             return [
                 ann
                 for ann in anns
@@ -374,8 +537,12 @@ def mk_conditional_tournament(ApplyTour, FilterTour, filter_vals):
             return ApplyTour.rank(ann, *apply_extra)
 
         @staticmethod
-        def cmp(ann1, ann2, apply_extra, filter_extra):
-            return ApplyTour.cmp(ann1, ann2, *apply_extra)
+        def features(ann, apply_extra, filter_extra):
+            return ApplyTour.features(ann, *apply_extra)
+
+        @staticmethod
+        def cmp(feats1, feats2, apply_extra, filter_extra):
+            return ApplyTour.cmp(feats1, feats2, *apply_extra)
 
     return ConditionalTournament
 
@@ -388,18 +555,15 @@ SupportedOnlyFreqRank = mk_conditional_tournament(
 class PreferNonWikiTargetDom(SpanKeyMixin, RankTournament):
     @staticmethod
     def rank(ann):
-        wordnets = set(ann.attrib["wordnets"].split(" "))
+        wordnets = set(ann_view(ann).wordnets)
         return 1 if (wordnets - {"qwf"}) else 0
 
 
 class PreferNonWikiSourceDom(SpanKeyMixin, RankTournament):
     @staticmethod
     def rank(ann):
-        if "support" not in ann.attrib:
-            return 0
         transfer_from = set()
-        for support_qs in ann.attrib["support"].split(" "):
-            support = parse_qs_single(support_qs)
+        for support in ann_view(ann).supports:
             transfer_from = support["transfer-from-wordnets"]
             transfer_from = set(transfer_from.split("+"))
         return 1 if (transfer_from - {"qwc"}) else 0
@@ -411,76 +575,279 @@ SupportedOnlyNonWikiSrc = mk_conditional_tournament(
 
 
 def greedy_max_span(positions):
-    max_pos = 0
-    for pos in positions:
-        positions[pos].sort(reverse=True, key=lambda pair: pair[0])
-        if pos > max_pos:
-            max_pos = pos
+    """
+    Select annotations greedily from the left. POSITIONS maps start positions
+    to lists of (length, ann) pairs. At each start, the annotations with the
+    greatest length are taken and the next start considered is the first one
+    at or after the end of them.
+    """
+    starts = sorted(positions)
     anns = []
-    cur_pos = 0
-    while cur_pos <= max_pos:
-        while cur_pos not in positions:
-            cur_pos += 1
-            if cur_pos > max_pos:
-                break
-        if cur_pos > max_pos:
-            break
-        cur_len, ann = positions[cur_pos][0]
-        anns.append(ann)
-        for other_len, ann in positions[cur_pos][1:]:
-            if other_len != cur_len:
-                break
-            anns.append(ann)
-        cur_pos += cur_len
+    idx = bisect_left(starts, 0)
+    while idx < len(starts):
+        cur_pos = starts[idx]
+        cur_len = max(length for length, _ in positions[cur_pos])
+        anns.extend(ann for length, ann in positions[cur_pos] if length == cur_len)
+        idx = bisect_left(starts, cur_pos + cur_len, idx + 1)
     return anns
 
 
-class HypTournament(SpanKeyMixin, CmpTournament):
-    @staticmethod
-    def cmp(ann1, ann2):
-        """
-        Returns  1 if ann1 dominates ann2
-              | -1 if ann2 dominates ann1
-              |  0 otherwise
-        """
+def tok_span_positions(anns):
+    """
+    Get the positions for greedy_max_span(...) of ANNS by token span.
+    """
+    token_positions = {}
+    for ann in anns:
+        tok, tok_len = ann_view(ann).pos
+        token_positions.setdefault(tok, []).append((tok_len, ann))
+    return token_positions
 
-        def hypernym_of(hyper, hypo):
-            return len(hypo) > len(hyper) and hypo[: len(hyper)] == hyper
 
-        def ann2ss(ann):
-            from stiff.munge.utils import synset_id_of_ann
-            from nltk.corpus import wordnet
-            from finntk.wordnet.utils import pre_id_to_post
+def char_span_positions(anns):
+    """
+    Get the positions for greedy_max_span(...) of ANNS by character start.
+    The length of each annotation is the number of annotations (including
+    itself) which start within its anchor.
+    """
+    ann_starts = [(int(ann_view(ann).pos_dict["char"]), ann) for ann in anns]
+    starts = sorted(start for start, _ in ann_starts)
+    char_positions = {}
+    for start, ann in ann_starts:
+        end = start + len(ann.attrib["anchor"])
+        span = bisect_right(starts, end) - bisect_left(starts, start)
+        char_positions.setdefault(start, []).append((span, ann))
+    return char_positions
 
-            synset_id = pre_id_to_post(synset_id_of_ann(ann))
-            # TODO: proper handling of new FinnWordNet synsets
-            if synset_id[0] == "9":
-                return
-            return wordnet.of2ss(synset_id)
 
-        syn1 = ann2ss(ann1)
-        syn2 = ann2ss(ann2)
-        syn1_dom = False
-        syn2_dom = False
+# Enough for the synsets commonly annotated in a corpus without growing
+# without bound on a long run
+ANN_SYNSET_CACHE_SIZE = 2 ** 17
 
-        if syn1 is None or syn2 is None:
-            return 0
 
-        for hyp_path1 in syn1.hypernym_paths():
-            for hyp_path2 in syn2.hypernym_paths():
-                if hypernym_of(hyp_path1, hyp_path2):
-                    syn1_dom = True
-                elif hypernym_of(hyp_path2, hyp_path1):
-                    syn2_dom = True
+def ann_synset(ann):
+    """
+    Get the NLTK WordNet synset of ANN, or None for new FinnWordNet synsets.
+    This only depends upon the wordnets and text of ANN so it is memoised on
+    them.
+    """
+    return wns_text_synset(ann.attrib["wordnets"], ann.text)
+
+
+@lru_cache(maxsize=ANN_SYNSET_CACHE_SIZE)
+def wns_text_synset(wordnets: str, text: str):
+    from stiff.munge.utils import synset_id_of_wns_text
+    from nltk.corpus import wordnet
+    from finntk.wordnet.utils import pre_id_to_post
+
+    synset_id = pre_id_to_post(synset_id_of_wns_text(wordnets, text))
+    # TODO: proper handling of new FinnWordNet synsets
+    if synset_id[0] == "9":
+        return None
+    return wordnet.of2ss(synset_id)
+
 
-        if syn1_dom and not syn2_dom:
+@lru_cache(maxsize=None)
+def synset_ancestors(synset) -> FrozenSet:
+    """
+    Get all proper hypernym ancestors of SYNSET. Like hypernym_paths(), this
+    also follows instance hypernyms.
+    """
+    ancestors: Set = set()
+    for hypernym in synset.hypernyms() + synset.instance_hypernyms():
+        ancestors.add(hypernym)
+        ancestors |= synset_ancestors(hypernym)
+    return frozenset(ancestors)
+
+
+class HypTournament(SpanKeyMixin, CmpTournament):
+    @staticmethod
+    def features(ann):
+        return ann_synset(ann)
+
+    @staticmethod
+    def cmp(syn1, syn2):
+        """
+        Returns  1 if syn1 is a hypernym ancestor of syn2
+              | -1 if syn2 is a hypernym ancestor of syn1
+              |  0 otherwise
+
+        Some hypernym path of syn1 being a prefix of some hypernym path of
+        syn2 is the same thing as syn1 being an ancestor of syn2.
+        """
+        if syn1 is None or syn2 is None:
+            return 0
+        if syn1 in synset_ancestors(syn2):
             return 1
-        elif syn2_dom and not syn1_dom:
+        elif syn2 in synset_ancestors(syn1):
             return -1
         else:
             return 0
 
+    def nondominated(self, group_synsets, *extra):
+        present = {synset for synset in group_synsets if synset is not None}
+        return [
+            idx
+            for idx, synset in enumerate(group_synsets)
+            if synset is None or present.isdisjoint(synset_ancestors(synset))
+        ]
+
 
 SupportedOnlyHypTournament = mk_conditional_tournament(
     HypTournament, HasSupportTournament, filter_vals=(1,)
 )
+
+
+def mk_filter_lang(lang):
+    def remove_other_langs(elem, cache=None):
+        for ann in elem.xpath("./annotations/annotation | ./text"):
+            if ann.attrib["lang"] == lang:
+                continue
+            ann.getparent().remove(ann)
+
+    return remove_other_langs
+
+
+def mk_rm_empty(text=False):
+    def remove_empty(elem, cache=None):
+        if (
+            len(elem.xpath("./text")) == 0
+            if text
+            else len(elem.xpath("./annotations/annotation")) == 0
+        ):
+            return BYPASS
+
+    return remove_empty
+
+
+def rm_ambg(sent, cache=None):
+    anns = (cache or SentCache(sent)).anns()
+    new_anns = anns.copy()
+    span_counts = {}
+    for ann in anns:
+        span = ann.pos
+        if span not in span_counts:
+            span_counts[span] = 0
+        span_counts[span] += 1
+    for ann in anns:
+        span = ann.pos
+        if span_counts[span] >= 2:
+            new_anns.remove(ann)
+    trim_anns(anns, new_anns)
+
+
+def mk_tok_span_dom(sup_only=False):
+    def tok_span_dom(sent, cache=None):
+        anns = (cache or SentCache(sent)).anns()
+        if sup_only:
+            span_anns = [ann for ann in anns if HasSupportTournament.rank(ann)]
+        else:
+            span_anns = anns
+        new_anns = greedy_max_span(tok_span_positions(span_anns))
+        if sup_only:
+            for ann in anns:
+                if not HasSupportTournament.rank(ann):
+                    new_anns.append(ann)
+        trim_anns(anns, new_anns)
+
+    return tok_span_dom
+
+
+def char_span_dom(sent, cache=None):
+    anns = (cache or SentCache(sent)).anns()
+    new_anns = greedy_max_span(char_span_positions(anns))
+    trim_anns(anns, new_anns)
+
+
+def mk_finnpos_rm_pos(level):
+    to_remove = get_rm_pos_matchers(level)
+
+    def finnpos_rm_pos(sent, cache=None):
+        if cache is None:
+            cache = SentCache(sent)
+        finnpos_feats = get_finnpos_feats(cache)
+        anns = cache.anns()
+        new_anns = anns.copy()
+        for ann in anns:
+            if has_rm_pos(ann, finnpos_feats, to_remove):
+                new_anns.remove(ann)
+        trim_anns(anns, new_anns)
+
+    return finnpos_rm_pos
+
+
+def tournament_stage(Tournament, decode=decode_dom_arg):
+    def mk(proc=None):
+        if proc is None:
+            return Tournament().proc_sent
+        return Tournament(*decode(proc)).proc_sent
+
+    return mk
+
+
+# Factories of sentence transformers for the filter.py commands which can be
+# run in-process by chain_stages(...). They take the same arguments and
+# options as the commands. The transformers take the sentence and optionally
+# its SentCache.
+STAGES = {
+    "lang": mk_filter_lang,
+    "fold-support": mk_fold_support,
+    "rm-empty": lambda text=False, annotations=False: mk_rm_empty(text),
+    "rm-ambg": lambda: rm_ambg,
+    "tok-span-dom": lambda sup_only=False, all_anns=False: mk_tok_span_dom(sup_only),
+    "char-span-dom": lambda: char_span_dom,
+    "finnpos-rm-pos": lambda level=None: mk_finnpos_rm_pos(level),
+    "has-support-dom": tournament_stage(HasSupportTournament),
+    "align-dom": tournament_stage(AlignTournament),
+    "non-deriv-dom": tournament_stage(NonDerivTournament),
+    "freq-dom": tournament_stage(FreqRankDom),
+    "break-ties": tournament_stage(AlphabeticDom),
+    "supported-freq-dom": tournament_stage(SupportedOnlyFreqRank),
+    "src-char-len-dom": tournament_stage(SrcCharLenTournament),
+    "src-char-span-dom": tournament_stage(SrcCharSpanTournament),
+    "non-recurs-dom": tournament_stage(LemmaPathTournament),
+    "finnpos-naive-lemma-dom": tournament_stage(NaiveLemmaTournament),
+    "finnpos-naive-pos-dom": tournament_stage(NaivePosTournament, decode_naive_pos_arg),
+    "non-wiki-src": tournament_stage(PreferNonWikiSourceDom),
+    "non-wiki-trg": tournament_stage(PreferNonWikiTargetDom),
+    "supported-non-wiki-src": tournament_stage(SupportedOnlyNonWikiSrc),
+    "hyp-dom": tournament_stage(HypTournament),
+    "hyp-sup": tournament_stage(SupportedOnlyHypTournament),
+}
+
+
+def get_stage_transformer(stage: str):
+    """
+    Get a sentence transformer for STAGE, given as a filter.py command line
+    without the input and output, e.g. "finnpos-rm-pos --level=agg", or as a
+    short stage code from stiff.methods.
+    """
+    command, *bits = lookup_stage(stage).split()
+    if command not in STAGES:
+        raise ValueError(f"Stage {command!r} cannot be run in-process")
+    args = []
+    opts = {}
+    for bit in bits:
+        if bit.startswith("--"):
+            key, eq, value = bit[2:].partition("=")
+            opts[key.replace("-", "_")] = value if eq else True
+        else:
+            args.append(bit)
+    return STAGES[command](*args, **opts)
+
+
+def chain_stages(stages):
+    """
+    Make a single sentence transformer which runs all of STAGES in turn, so
+    that they share a single parse of the input and a SentCache of what has
+    been parsed from each sentence, such as its annotation views and grams.
+    """
+    transformers = [get_stage_transformer(stage) for stage in stages]
+
+    def chained(sent):
+        cache = SentCache(sent)
+        for transformer in transformers:
+            retval = transformer(sent, cache)
+            if retval is BYPASS or retval is BREAK:
+                return retval
+
+    return chained
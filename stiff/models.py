@@ -11,7 +11,8 @@ from typing import (
     Type,
     TYPE_CHECKING,
 )
-from urllib.parse import urlencode
+from stiff.utils import encode_qs
+from stiff.utils.anns import encode_transform_chain
 
 if TYPE_CHECKING:
     from stiff.wordnet.base import ExtractableWordnet  # noqa: F401
@@ -32,7 +33,7 @@ class DataUtilMixin:
         for k in d.keys():
             if d[k] is None or d[k] == "":
                 del d[k]
-        return urlencode(d)
+        return encode_qs(d)
 
 
 @dataclass
@@ -61,6 +62,15 @@ class TagSupport(DataUtilMixin):
     transfer_from: Optional[int] = None
     transform_chain: List[str] = field(default_factory=list)
 
+    def urlencode(self):
+        d = {}
+        if self.transfer_type:
+            d["transfer-type"] = self.transfer_type
+        if self.transfer_from is not None:
+            d["transfer-from"] = self.transfer_from
+        d["transform-chain"] = encode_transform_chain(self.transform_chain)
+        return encode_qs(d)
+
 
 @dataclass
 class TaggedLemma:
@@ -0,0 +1,119 @@
+"""
+The map from BabelNet ids to WordNet ids used by babelnet-lookup.
+
+The map is distributed as a TSV of BabelNet id and wn:OFFSETPOS pairs. Since
+reading it takes a while and a lot of memory, it can be compiled once into a
+file of records sorted by BabelNet id which is memory mapped:
+
+    MAGIC  block_count  block_offset * (block_count + 1)  records
+
+where block_count and the offsets are little endian 64 bit integers and each
+record is "\\nBABELNET_ID\\tWORDNET_IDS" with the WordNet ids already
+formatted as babelnet-lookup writes them. The records are split into blocks
+of BLOCK_SIZE. Only the first BabelNet id of each block is read into memory
+on opening. A lookup bisects these to find its block and then searches the
+block for the record. Both kinds of file give the WordNet ids of a BabelNet
+id in the order they first appear in the TSV.
+"""
+import mmap
+import struct
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, IO, List, Optional
+
+MAGIC = b"BN2WNv1\n"
+HEADER = struct.Struct("<Q")
+OFFSET_SIZE = 8
+LOOKUP_CACHE_SIZE = 2 ** 16
+BLOCK_SIZE = 32
+
+
+def format_wn_ids(wn_ids: List[str]) -> str:
+    bits = []
+    for wn_id in wn_ids:
+        off, pos = wn_id[:-1], wn_id[-1]
+        bits.append("{}-{}".format(off, pos))
+    return " ".join(bits)
+
+
+def read_bn2wn_tsv(map_bn2wn: IO) -> Dict[str, str]:
+    bn2wn_ids: Dict[str, Dict[str, None]] = {}
+    for line in map_bn2wn:
+        bn, wn_full = line[:-1].split("\t")
+        wn_off = wn_full.split(":", 1)[1]
+        bn2wn_ids.setdefault(bn, {})[wn_off] = None
+    return {bn: format_wn_ids(list(wn_ids)) for bn, wn_ids in bn2wn_ids.items()}
+
+
+def compile_bn2wn(map_bn2wn: IO, outf: IO):
+    """
+    Compile the TSV map_bn2wn into the sorted binary format in outf.
+    """
+    records = [
+        b"\n" + bn + b"\t" + wn_ids
+        for bn, wn_ids in sorted(
+            (bn.encode("utf-8"), wn_ids.encode("utf-8"))
+            for bn, wn_ids in read_bn2wn_tsv(map_bn2wn).items()
+        )
+    ]
+    block_count = (len(records) + BLOCK_SIZE - 1) // BLOCK_SIZE
+    offset = len(MAGIC) + HEADER.size + OFFSET_SIZE * (block_count + 1)
+    offsets = []
+    for idx, record in enumerate(records):
+        if idx % BLOCK_SIZE == 0:
+            offsets.append(offset)
+        offset += len(record)
+    offsets.append(offset)
+    outf.write(MAGIC)
+    outf.write(HEADER.pack(block_count))
+    outf.write(struct.pack("<{}Q".format(len(offsets)), *offsets))
+    for record in records:
+        outf.write(record)
+
+
+class CompiledBn2Wn:
+    def __init__(self, fp: IO):
+        # The map stays valid after fp is closed
+        self.buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[: len(MAGIC)] != MAGIC:
+            self.buf.close()
+            raise ValueError("{} is not a compiled BabelNet map".format(fp.name))
+        (block_count,) = HEADER.unpack_from(self.buf, len(MAGIC))
+        self.offsets = struct.unpack_from(
+            "<{}Q".format(block_count + 1), self.buf, len(MAGIC) + HEADER.size
+        )
+        self.first_keys = [
+            self.buf[offset + 1 : self.buf.find(b"\t", offset + 1)]
+            for offset in self.offsets[:-1]
+        ]
+        self.get = lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self._get)
+
+    def _get(self, bn: Optional[str]) -> Optional[str]:
+        # The text of an empty <annotation/> is None
+        if bn is None:
+            return None
+        key = bn.encode("utf-8")
+        block_idx = bisect_right(self.first_keys, key) - 1
+        if block_idx < 0:
+            return None
+        block = self.buf[self.offsets[block_idx] : self.offsets[block_idx + 1]]
+        needle = b"\n" + key + b"\t"
+        start = block.find(needle)
+        if start < 0:
+            return None
+        start += len(needle)
+        end = block.find(b"\n", start)
+        return block[start : end if end >= 0 else len(block)].decode("utf-8")
+
+
+def open_bn2wn(path: str):
+    """
+    Open the BabelNet to WordNet map at path, which may either be the TSV or
+    a compiled map. Returns a function from a BabelNet id to the formatted
+    WordNet ids or None.
+    """
+    with open(path, "rb") as fp:
+        if fp.read(len(MAGIC)) == MAGIC:
+            return CompiledBn2Wn(fp).get
+    with open(path) as map_bn2wn:
+        return read_bn2wn_tsv(map_bn2wn).get
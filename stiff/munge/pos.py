@@ -1,16 +1,35 @@
 from finntk.finnpos import sent_finnpos
-from typing import IO, List
+from typing import IO, List, Optional
 
-from .utils import transform_senseval_contexts
+from stiff.utils.memo import LruMemo
+
+from .seg import omorfi_seg_tokens
+from .utils import transform_senseval_contexts, transform_senseval_contexts_multi
+
+
+def fmt_analy(analy) -> str:
+    surf, lemma, tags = analy
+    return "{}|LEM|{}|POS|{}".format(surf, lemma, tags["pos"])
+
+
+def finnpos_tag_tokens(sent: List[str]) -> List[str]:
+    analysed = sent_finnpos(sent)
+    return [fmt_analy(ana) for ana in analysed]
 
 
 def finnpos_senseval(inf: IO, outf: IO):
-    def fmt_analy(analy) -> str:
-        surf, lemma, tags = analy
-        return "{}|LEM|{}|POS|{}".format(surf, lemma, tags["pos"])
+    transform_senseval_contexts(inf, finnpos_tag_tokens, outf)
 
-    def tag_tokens(sent: List[str]) -> List[str]:
-        analysed = sent_finnpos(sent)
-        return [fmt_analy(ana) for ana in analysed]
 
-    transform_senseval_contexts(inf, tag_tokens, outf)
+def finnpos_omorfi_senseval(
+    inf: IO, tag_outf: IO, seg_outf: IO, memo: Optional[LruMemo[str]] = None
+):
+    """
+    Does finnpos_senseval(...) and omorfi_segment_senseval(...) together,
+    parsing INF only once.
+    """
+    transform_senseval_contexts_multi(
+        inf,
+        [finnpos_tag_tokens, lambda sent: omorfi_seg_tokens(sent, memo)],
+        [tag_outf, seg_outf],
+    )
@@ -0,0 +1,117 @@
+"""
+Writing many files a little at a time, as scatter type operations such as
+unified-to-senseval do, without opening and closing a file for every write.
+
+Writes are buffered per file and spilled once a file's buffer grows past
+spill_size or all buffers together pass max_buffered. Spilling goes through a
+pool of open file handles which is bounded by the open file limit, closing
+the least recently used handle when it is full. The first spill to a file
+truncates it and later ones append, so the files end up exactly as if every
+write had opened the file in append mode.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, IO, List, Set
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_MAX_OPEN = 256
+MAX_OPEN_CAP = 4096
+RESERVED_FDS = 64
+SPILL_SIZE = 64 * 1024
+MAX_BUFFERED = 64 * 1024 * 1024
+
+
+def default_max_open() -> int:
+    if resource is None:
+        return DEFAULT_MAX_OPEN
+    soft, _hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return MAX_OPEN_CAP
+    return max(1, min(soft - RESERVED_FDS, MAX_OPEN_CAP))
+
+
+class ScatterWriter:
+    def __init__(self, max_open=None, spill_size=SPILL_SIZE, max_buffered=MAX_BUFFERED):
+        self.max_open = max_open if max_open is not None else default_max_open()
+        self.spill_size = spill_size
+        self.max_buffered = max_buffered
+        self.buffers: Dict[str, List[str]] = {}
+        self.buffer_sizes: Dict[str, int] = {}
+        self.buffered = 0
+        self.handles: "OrderedDict[str, IO]" = OrderedDict()
+        self.started: Set[str] = set()
+        self.appends = 0
+        self.opens = 0
+        self.spills = 0
+        self.start_time = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def write(self, path: str, text: str):
+        """
+        Append TEXT to the file at PATH, which is truncated by the first write.
+        """
+        self.appends += 1
+        buf = self.buffers.get(path)
+        if buf is None:
+            buf = self.buffers[path] = []
+            self.buffer_sizes[path] = 0
+        buf.append(text)
+        self.buffer_sizes[path] += len(text)
+        self.buffered += len(text)
+        if self.buffer_sizes[path] >= self.spill_size:
+            self.spill(path)
+        elif self.buffered >= self.max_buffered:
+            self.flush()
+
+    def get_handle(self, path: str) -> IO:
+        handle = self.handles.get(path)
+        if handle is not None:
+            self.handles.move_to_end(path)
+            return handle
+        if len(self.handles) >= self.max_open:
+            _, lru_handle = self.handles.popitem(last=False)
+            lru_handle.close()
+        handle = open(path, "a" if path in self.started else "w")
+        self.started.add(path)
+        self.opens += 1
+        self.handles[path] = handle
+        return handle
+
+    def spill(self, path: str):
+        buf = self.buffers.pop(path)
+        self.buffered -= self.buffer_sizes.pop(path)
+        self.get_handle(path).write("".join(buf))
+        self.spills += 1
+
+    def flush(self):
+        for path in list(self.buffers):
+            self.spill(path)
+
+    def close(self):
+        self.flush()
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+    def stats(self) -> str:
+        elapsed = time.perf_counter() - self.start_time
+        return (
+            "{} appends to {} files in {:.1f}s ({:.0f} appends/s) "
+            "using {} opens and {} writes"
+        ).format(
+            self.appends,
+            len(self.started),
+            elapsed,
+            self.appends / elapsed if elapsed else 0.0,
+            self.opens,
+            self.spills,
+        )
@@ -1,22 +1,39 @@
-from typing import IO, List
+from typing import IO, List, Optional
 
+from stiff.utils.memo import LruMemo
 from .utils import transform_senseval_contexts
 
+# Contexts of the same lemma share many of their words so most tokens are
+# only segmented once
+SEG_MEMO_SIZE = 2 ** 18
+SEG_MEMO_VERSION = "omorfi-segment-1"
 
-def omorfi_segment_senseval(inf: IO, outf: IO):
-    # XXX: we should move any segments after the last of the lemma segment
-    # outside of the <head> tag -- might mean transform_senseval_contexts needs
-    # to be reworked
 
-    def seg_token(token: str) -> str:
-        from finntk.omor.inst import get_omorfi
-        from omorfi.token import get_segments
+def omorfi_seg_token(token: str) -> str:
+    from finntk.omor.inst import get_omorfi
+    from omorfi.token import get_segments
+
+    omorfi = get_omorfi()
+    segments = omorfi.segment(token)
+    return "→ ←".join(get_segments(segments[0], True, True, True, False, False))
+
 
-        omorfi = get_omorfi()
-        segments = omorfi.segment(token)
-        return "→ ←".join(get_segments(segments[0], True, True, True, False, False))
+def mk_seg_memo(
+    path: Optional[str] = None, max_size: int = SEG_MEMO_SIZE
+) -> LruMemo[str]:
+    return LruMemo(omorfi_seg_token, max_size, path, SEG_MEMO_VERSION)
 
-    def seg_tokens(sent: List[str]) -> List[str]:
-        return [seg_token(tok) for tok in sent]
 
-    transform_senseval_contexts(inf, seg_tokens, outf)
+def omorfi_seg_tokens(
+    sent: List[str], memo: Optional[LruMemo[str]] = None
+) -> List[str]:
+    if memo is None:
+        return [omorfi_seg_token(tok) for tok in sent]
+    return memo.map(sent)
+
+
+def omorfi_segment_senseval(inf: IO, outf: IO, memo: Optional[LruMemo[str]] = None):
+    # XXX: we should move any segments after the last of the lemma segment
+    # outside of the <head> tag -- might mean transform_senseval_contexts needs
+    # to be reworked
+    transform_senseval_contexts(inf, lambda sent: omorfi_seg_tokens(sent, memo), outf)
@@ -1,6 +1,7 @@
+from copy import deepcopy
 from lxml import etree
-from typing import Callable, IO, List
-from stiff.utils.xml import eq_matcher, transform_blocks
+from typing import Callable, IO, List, Tuple
+from stiff.utils.xml import eq_matcher, transform_blocks, transform_blocks_multi
 from stiff.wordnet.fin import Wordnet as WordnetFin
 
 
@@ -12,39 +13,83 @@ def space_tokenize(str):
         return []
 
 
+def split_context(context: etree.ElementBase) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Tokenise the text before, inside and after the <head> of a Senseval
+    <context>.
+    """
+    head_tag = context[0]
+    return (
+        space_tokenize(context.text),
+        space_tokenize(head_tag.text),
+        space_tokenize(head_tag.tail),
+    )
+
+
+def join_context(
+    context: etree.ElementBase,
+    before_tok: List[str],
+    head_tok: List[str],
+    new_sent: List[str],
+):
+    """
+    Put NEW_SENT, the transformed tokens of a <context> split into BEFORE_TOK
+    and HEAD_TOK, back into the context.
+    """
+    head_tag = context[0]
+    new_before = new_sent[: len(before_tok)]
+    new_head = new_sent[len(before_tok) : len(before_tok) + len(head_tok)]
+    new_after = new_sent[len(before_tok) + len(head_tok) :]
+
+    context.text = "\n" + "".join(tok + " " for tok in new_before)
+    head_tag.text = " ".join(tok for tok in new_head)
+    head_tag.tail = "".join(" " + tok for tok in new_after) + "\n"
+
+
 def transform_senseval_contexts(
     inf: IO, transform_tokens: Callable[[List[str]], List[str]], outf: IO
 ) -> None:
     def transform_context(context: etree.ElementBase) -> etree.ElementBase:
-        sent: List[str] = []
-        before = context.text
-        head_tag = context[0]
-        head = head_tag.text
-        after = head_tag.tail
+        before_tok, head_tok, after_tok = split_context(context)
+        sent = before_tok + head_tok + after_tok
+        join_context(context, before_tok, head_tok, transform_tokens(sent))
+        return context
 
-        before_tok = space_tokenize(before)
-        head_tok = space_tokenize(head)
-        after_tok = space_tokenize(after)
+    transform_blocks(eq_matcher("context"), inf, transform_context, outf)
 
-        sent = before_tok + head_tok + after_tok
-        new_sent = transform_tokens(sent)
 
-        new_before = new_sent[: len(before_tok)]
-        new_head = new_sent[len(before_tok) : len(before_tok) + len(head_tok)]
-        new_after = new_sent[len(before_tok) + len(head_tok) :]
+def transform_senseval_contexts_multi(
+    inf: IO, transforms_tokens: List[Callable[[List[str]], List[str]]], outfs: List[IO],
+) -> None:
+    """
+    Like transform_senseval_contexts(...), but parses and tokenises each
+    context once for all of TRANSFORMS_TOKENS, writing the result of each to
+    the corresponding file of OUTFS.
+    """
 
-        context.text = "\n" + "".join(tok + " " for tok in new_before)
-        head_tag.text = " ".join(tok for tok in new_head)
-        head_tag.tail = "".join(" " + tok for tok in new_after) + "\n"
-        return context
+    def transform_context(context: etree.ElementBase) -> List[etree.ElementBase]:
+        before_tok, head_tok, after_tok = split_context(context)
+        sent = before_tok + head_tok + after_tok
+        new_contexts = []
+        for idx, transform_tokens in enumerate(transforms_tokens):
+            if idx < len(transforms_tokens) - 1:
+                new_context = deepcopy(context)
+            else:
+                new_context = context
+            join_context(new_context, before_tok, head_tok, transform_tokens(sent))
+            new_contexts.append(new_context)
+        return new_contexts
 
-    transform_blocks(eq_matcher("context"), inf, transform_context, outf)
+    transform_blocks_multi(eq_matcher("context"), inf, transform_context, outfs)
 
 
 def synset_id_of_ann(ann):
-    wordnets = set(ann.attrib["wordnets"].split())
+    return synset_id_of_wns_text(ann.attrib["wordnets"], ann.text)
+
+
+def synset_id_of_wns_text(wordnets_str, synset_str):
+    wordnets = set(wordnets_str.split())
     langs = langs_of_wns(wordnets)
-    synset_str = ann.text
     chosen_wn = None
     if "eng" in langs:
         if "fin" in langs:
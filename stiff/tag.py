@@ -7,6 +7,7 @@ from finntk.wordnet.reader import fiwn_encnt
 from stiff.data.fixes import fix_all
 from stiff.extract import CmnExtractor, FinExtractor
 from stiff.corpus_read import WordAlignment
+from stiff.utils.gram import FINNPOS_POS_GRAM, encode_finnpos_pos
 from stiff.utils.opencc import get_opencc
 from stiff.models import Anchor, Tagging, Token, TagSupport
 from stiff.writers import Writer
@@ -203,6 +204,13 @@ def proc_line(
             ]
         ),
     )
+    writer.write_gram(
+        fi_id,
+        FINNPOS_POS_GRAM,
+        encode_finnpos_pos(
+            [fp_feats for _, _, fp_feats in fin_extractor.finnpos_analys]
+        ),
+    )
     writer.start_anns()
     write_anns(writer, "fi", fi_tagging)
     write_anns(writer, "zh", zh_tagging)
@@ -1,8 +1,54 @@
-from urllib.parse import parse_qsl
+import re
+from functools import lru_cache
+from sys import intern
+from typing import Mapping, Tuple
+from urllib.parse import quote_plus, unquote_plus
+
+QS_CACHE_SIZE = 2 ** 16
+QS_SAFE_RE = re.compile(r"[A-Za-z0-9_.\-~]*")
+
+
+@lru_cache(maxsize=QS_CACHE_SIZE)
+def parse_qs_pairs(qs: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    Parse a query string in the same way as parse_qsl(...) with its default
+    arguments. Most query strings in STIFF attributes are short, occur many
+    times over and contain no escapes, so they are parsed by splitting only
+    and both the results and the keys and values within them are interned.
+    """
+    escaped = "%" in qs or "+" in qs
+    pairs = []
+    for bit in qs.split("&"):
+        key, _, value = bit.partition("=")
+        # parse_qsl(...) skips pairs without a value
+        if not value:
+            continue
+        if escaped:
+            key = unquote_plus(key)
+            value = unquote_plus(value)
+        pairs.append((intern(key), intern(value)))
+    return tuple(pairs)
 
 
 def parse_qs_single(qs):
-    return dict(parse_qsl(qs))
+    return dict(parse_qs_pairs(qs))
+
+
+@lru_cache(maxsize=QS_CACHE_SIZE)
+def quote_qs(bit: str) -> str:
+    if QS_SAFE_RE.fullmatch(bit):
+        return bit
+    return quote_plus(bit)
+
+
+def encode_qs(qs_dict: Mapping) -> str:
+    """
+    Encode a dict as a query string in the same way as urlencode(...).
+    """
+    return "&".join(
+        quote_qs(str(key)) + "=" + quote_qs(str(value))
+        for key, value in qs_dict.items()
+    )
 
 
 def wnlemma_to_analy_lemma(wnlemma):
@@ -1,15 +1,178 @@
+import ast
+import json
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
 from stiff.utils import parse_qs_single
 
 
-def get_ann_pos_dict(ann):
-    anchor_poses = ann.attrib["anchor-positions"].split()
+def parse_pos_dict(anchor_positions: str) -> Dict[str, str]:
+    anchor_poses = anchor_positions.split()
     assert len(anchor_poses) == 1
-    anchor_pos_str = anchor_poses[0]
-    return parse_qs_single(anchor_pos_str)
+    return parse_qs_single(anchor_poses[0])
 
 
-def get_ann_pos(ann):
-    anchor_pos = get_ann_pos_dict(ann)
+def pos_dict_to_pos(anchor_pos: Dict[str, str]) -> Tuple[int, int]:
     tok = int(anchor_pos["token"])
     tok_len = int(anchor_pos["token-length"]) if "token-length" in anchor_pos else 1
     return tok, tok_len
+
+
+def parse_pos(anchor_positions: str) -> Tuple[int, int]:
+    return pos_dict_to_pos(parse_pos_dict(anchor_positions))
+
+
+def get_ann_pos_dict(ann):
+    return parse_pos_dict(ann.attrib["anchor-positions"])
+
+
+def get_ann_pos(ann):
+    return parse_pos(ann.attrib["anchor-positions"])
+
+
+def parse_wordnets(wordnets: Optional[str]) -> List[str]:
+    return wordnets.split(" ") if wordnets else []
+
+
+def parse_qs_list(qs_list: Optional[str]) -> List[Dict[str, str]]:
+    if not qs_list:
+        return []
+    return [parse_qs_single(qs) for qs in qs_list.split(" ")]
+
+
+# The transform-chain of a support was originally written as a Python list
+# literal. It is now written as compact JSON instead. Both are read.
+
+
+def encode_transform_chain(transform_chain: List[str]) -> str:
+    return json.dumps(transform_chain, separators=(",", ":"))
+
+
+@lru_cache(maxsize=None)
+def parse_transform_chain(transform_chain: str) -> Tuple[str, ...]:
+    """
+    Parse the transform-chain of a support in either format. There are only
+    ever a few distinct chains so they are all memoised.
+    """
+    try:
+        parsed = json.loads(transform_chain)
+    except ValueError:
+        parsed = ast.literal_eval(transform_chain)
+    return tuple(parsed)
+
+
+def upgrade_support(support: Dict[str, str]):
+    """
+    Rewrite the transform-chain of a parsed support in place in the current
+    format.
+    """
+    if "transform-chain" in support:
+        support["transform-chain"] = encode_transform_chain(
+            list(parse_transform_chain(support["transform-chain"]))
+        )
+
+
+class AnnotationView:
+    """
+    A view of an <annotation> which parses each attribute at most once. Parsed
+    values are remembered together with the raw attribute they were parsed
+    from, so modifications to the annotation are picked up. Parsed values are
+    shared and must not be modified. The attrib and text of the annotation are
+    passed through, so rankings can be given a view in place of the
+    annotation.
+    """
+
+    __slots__ = ("ann", "cache")
+
+    def __init__(self, ann):
+        self.ann = ann
+        self.cache: Dict[Tuple[str, Callable], Tuple[Optional[str], object]] = {}
+
+    def parse_attr(self, attr: str, parse: Callable):
+        raw = self.ann.attrib.get(attr)
+        key = (attr, parse)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == raw:
+            return cached[1]
+        value = parse(raw)
+        self.cache[key] = (raw, value)
+        return value
+
+    @property
+    def attrib(self):
+        return self.ann.attrib
+
+    @property
+    def text(self) -> Optional[str]:
+        return self.ann.text
+
+    @property
+    def pos_dict(self) -> Dict[str, str]:
+        return self.parse_attr("anchor-positions", parse_pos_dict)
+
+    @property
+    def pos(self) -> Tuple[int, int]:
+        return self.parse_attr("anchor-positions", parse_pos)
+
+    @property
+    def supports(self) -> List[Dict[str, str]]:
+        return self.parse_attr("support", parse_qs_list)
+
+    @property
+    def wnlemmas(self) -> List[Dict[str, str]]:
+        return self.parse_attr("wnlemma", parse_qs_list)
+
+    @property
+    def wordnets(self) -> List[str]:
+        return self.parse_attr("wordnets", parse_wordnets)
+
+
+def ann_view(ann) -> AnnotationView:
+    """
+    Get an AnnotationView of ANN, which may be an <annotation> or already an
+    AnnotationView, such as one from SentCache.views(...).
+    """
+    if isinstance(ann, AnnotationView):
+        return ann
+    return AnnotationView(ann)
+
+
+def ann_elem(ann):
+    """
+    Get the <annotation> of ANN, which may be an <annotation> or its
+    AnnotationView.
+    """
+    if isinstance(ann, AnnotationView):
+        return ann.ann
+    return ann
+
+
+class SentCache:
+    """
+    What has been parsed from a sentence while processing it. A SentCache is
+    made for each sentence and passed to every stage run on it, so stages run
+    in-process on the same sentence share the AnnotationViews of its
+    annotations and its parsed grams (see stiff.utils.gram).
+    """
+
+    __slots__ = ("sent", "ann_views", "grams")
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.ann_views: Dict[object, AnnotationView] = {}
+        self.grams: Dict[Tuple[str, Callable], Tuple[str, object]] = {}
+
+    def view(self, ann) -> AnnotationView:
+        view = self.ann_views.get(ann)
+        if view is None:
+            view = self.ann_views[ann] = AnnotationView(ann)
+        return view
+
+    def views(self, anns) -> List[AnnotationView]:
+        return [self.view(ann) for ann in anns]
+
+    def anns(self) -> List[AnnotationView]:
+        """
+        Get the views of the <annotation>s currently in the sentence.
+        """
+        return self.views(self.sent.xpath("./annotations/annotation"))
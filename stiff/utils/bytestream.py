@@ -0,0 +1,215 @@
+"""
+Byte level streaming over the sentences of STIFF/unified XML files. This
+allows stages which only select whole sentences, such as head and sample, to
+copy sentences verbatim without building any elements.
+"""
+import re
+from lxml import etree
+from typing import IO, List
+from stiff.utils.xml import BREAK, BYPASS, BufferedOutput, transform_sentences
+
+CHUNK_SIZE = 1024 * 1024
+
+SENT_START_RE = re.compile(rb"<sentence[\s/>]")
+SENT_INNER_RE = re.compile(rb"<!\[CDATA\[|<!--|</sentence>")
+TAG_RE = re.compile(rb"<(/?)([^\s/>!?]+)[^>]*?(/?)>")
+WHITESPACE_RE = re.compile(rb"\s*")
+TAG_END_RE = re.compile(rb">")
+COMMENT_END_RE = re.compile(rb"-->")
+CDATA_END_RE = re.compile(rb"\]\]>")
+ENCODING_RE = re.compile(rb"""^<\?xml[^>]*encoding=["']([^"']+)["']""")
+
+OUTSIDE = object()
+SENTENCE = object()
+
+
+class PrefixedReader:
+    """
+    A file-like object which reads PREFIX and then the rest of INF.
+    """
+
+    def __init__(self, prefix: bytes, inf: IO):
+        self.prefix = prefix
+        self.inf = inf
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.inf.read(size)
+        if size < 0:
+            result = self.prefix + self.inf.read()
+            self.prefix = b""
+            return result
+        result = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return result
+
+
+class ByteSentenceScanner:
+    """
+    Iterates over a document as (OUTSIDE, data) chunks of bytes outside of any
+    <sentence> and (SENTENCE, data, tail) chunks where data is a whole
+    sentence element and tail is the whitespace following it. Concatenating
+    all the chunks gives back the input.
+
+    Assumes <sentence> tags do not occur outside of sentences inside comments
+    or CDATA sections.
+    """
+
+    def __init__(self, inf: IO, prefix: bytes = b""):
+        self.inf = inf
+        self.buf = bytearray(prefix)
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """
+        Read more input, dropping everything before self.pos. All offsets
+        kept across calls should therefore be relative to self.pos.
+        """
+        if self.eof:
+            return False
+        del self.buf[: self.pos]
+        self.pos = 0
+        data = self.inf.read(CHUNK_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def search(self, pattern, rel: int):
+        """
+        Search for the compiled regex PATTERN from self.pos + REL, reading
+        more input until it is found. Returns the match, which is only valid
+        until the next fill().
+        """
+        while True:
+            match = pattern.search(self.buf, self.pos + rel)
+            if match is not None:
+                return match
+            if not self.fill():
+                raise ValueError("Input ended in the middle of a <sentence>")
+
+    def take(self, end: int) -> bytes:
+        result = bytes(self.buf[self.pos : end])
+        self.pos = end
+        return result
+
+    def sentence_end(self) -> int:
+        """
+        Returns the end of the sentence starting at self.pos, relative to
+        self.pos.
+        """
+        match = self.search(TAG_END_RE, 0)
+        if self.buf[match.start() - 1] == ord("/"):
+            return match.end() - self.pos
+        rel = match.end() - self.pos
+        while True:
+            match = self.search(SENT_INNER_RE, rel)
+            token = match.group()
+            rel = match.end() - self.pos
+            if token == b"</sentence>":
+                return rel
+            elif token == b"<!--":
+                rel = self.search(COMMENT_END_RE, rel).end() - self.pos
+            else:
+                rel = self.search(CDATA_END_RE, rel).end() - self.pos
+
+    def tail_end(self, rel: int) -> int:
+        while True:
+            end = WHITESPACE_RE.match(self.buf, self.pos + rel).end()
+            if end < len(self.buf) or not self.fill():
+                return end - self.pos
+
+    def __iter__(self):
+        while True:
+            match = SENT_START_RE.search(self.buf, self.pos)
+            if match is None:
+                if self.eof:
+                    if self.pos < len(self.buf):
+                        yield OUTSIDE, self.take(len(self.buf))
+                    return
+                # Keep back any partial tag until there is more input
+                safe = self.buf.rfind(b"<", self.pos)
+                if safe == -1:
+                    safe = len(self.buf)
+                if safe > self.pos:
+                    yield OUTSIDE, self.take(safe)
+                self.fill()
+                continue
+            if match.start() > self.pos:
+                yield OUTSIDE, self.take(match.start())
+            sent_end = self.sentence_end()
+            tail_end = self.tail_end(sent_end)
+            sent = self.take(self.pos + sent_end)
+            yield SENTENCE, sent, self.take(self.pos + tail_end - sent_end)
+
+
+def track_open_tags(data: bytes, open_tags: List[bytes]):
+    for closing, tag, self_closing in TAG_RE.findall(data):
+        if closing:
+            assert open_tags and open_tags[-1] == tag, "Mismatched </{}>".format(
+                tag.decode("utf-8")
+            )
+            open_tags.pop()
+        elif not self_closing:
+            open_tags.append(tag)
+
+
+def is_plain_prologue(prologue: bytes) -> bool:
+    """
+    Checks whether the byte level path can deal with a document which starts
+    with PROLOGUE. Anything other than UTF-8 without an internal DTD subset
+    (which could define entities) is left to lxml.
+    """
+    if prologue.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return False
+    encoding = ENCODING_RE.match(prologue)
+    if encoding is not None and encoding.group(1).lower() not in (b"utf-8", b"utf8"):
+        return False
+    doctype_start = prologue.find(b"<!DOCTYPE")
+    if doctype_start != -1:
+        doctype_end = prologue.find(b">", doctype_start)
+        if prologue.find(b"[", doctype_start, doctype_end) != -1:
+            return False
+    return True
+
+
+def fast_transform_sentences(inf: IO, transformer, outf: IO):
+    """
+    Like transform_sentences(...) for transformers which only select
+    sentences. TRANSFORMER is passed each sentence as UTF-8 encoded bytes of
+    a single <sentence> element and should return BYPASS to drop it, BREAK to
+    stop or None to keep it.
+
+    Usually these are the raw bytes of the sentence in the input. Documents
+    with an unusual layout fall back to transform_sentences(...), in which
+    case the sentence is serialised by lxml first, so TRANSFORMER always gets
+    bytes but can only rely on them parsing to the same element.
+    """
+    prologue = inf.read(CHUNK_SIZE)
+    if not is_plain_prologue(prologue):
+
+        def elem_transformer(sent):
+            return transformer(etree.tostring(sent, encoding="utf-8", with_tail=False))
+
+        return transform_sentences(
+            PrefixedReader(prologue, inf), elem_transformer, outf
+        )
+    out = BufferedOutput(outf)
+    open_tags: List[bytes] = []
+    for chunk in ByteSentenceScanner(inf, prologue):
+        if chunk[0] is OUTSIDE:
+            track_open_tags(chunk[1], open_tags)
+            out.write(chunk[1])
+            continue
+        _, sent, tail = chunk
+        retval = transformer(sent)
+        if retval is BREAK:
+            for tag in reversed(open_tags):
+                out.write(b"</" + tag + b">\n")
+            break
+        if retval is not BYPASS:
+            out.write(sent)
+            out.write(tail)
+    out.flush()
@@ -0,0 +1,64 @@
+"""
+A stable external merge sort for streams of picklable records which may not
+fit in memory.
+
+Records are collected into runs of at most run_size records. Each run is
+sorted and, unless the whole input fits in a single run, pickled to an
+anonymous temporary file. The runs are then lazily merged.
+"""
+import heapq
+import pickle
+import tempfile
+from typing import Callable, IO, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_RUN_SIZE = 100000
+
+
+def write_run(run: List[T]) -> IO:
+    run_f = tempfile.TemporaryFile()
+    pickler = pickle.Pickler(run_f, protocol=pickle.HIGHEST_PROTOCOL)
+    for record in run:
+        pickler.dump(record)
+        # The memo would otherwise keep every record alive
+        pickler.clear_memo()
+    run_f.seek(0)
+    return run_f
+
+
+def read_run(run_f: IO) -> Iterator[T]:
+    unpickler = pickle.Unpickler(run_f)
+    try:
+        while True:
+            yield unpickler.load()
+    except EOFError:
+        pass
+    finally:
+        run_f.close()
+
+
+def external_sort(
+    records: Iterable[T], key: Callable[[T], object], run_size: int = DEFAULT_RUN_SIZE,
+) -> Iterator[T]:
+    """
+    Sort RECORDS by KEY, keeping records with equal keys in their original
+    order, while holding at most about RUN_SIZE records in memory.
+    """
+    run_files: List[IO] = []
+    run: List[T] = []
+    for record in records:
+        run.append(record)
+        if len(run) >= run_size:
+            run.sort(key=key)
+            run_files.append(write_run(run))
+            run = []
+    run.sort(key=key)
+    if not run_files:
+        yield from run
+        return
+    if run:
+        run_files.append(write_run(run))
+        run = []
+    # heapq.merge(...) prefers earlier iterables on ties which keeps it stable
+    yield from heapq.merge(*(read_run(run_f) for run_f in run_files), key=key)
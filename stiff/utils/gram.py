@@ -0,0 +1,83 @@
+"""
+Reading the <gram> elements of STIFF sentences.
+
+The finnpos gram is a JSON list of [lemma, feats] pairs, one per token. Since
+decoding it is relatively expensive and many stages need it, parsed grams are
+kept on the SentCache of the sentence, so that all stages run on it in the
+same process share them. Stages which only need the POS of each token
+can instead read the much smaller finnpos-pos gram, which gives one POS code
+per token, optionally followed by +PROPER for proper nouns.
+"""
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+from stiff.utils.anns import SentCache
+
+FINNPOS_GRAM = "finnpos"
+FINNPOS_POS_GRAM = "finnpos-pos"
+
+
+def get_gram_text(sent, gram_type: str) -> Optional[str]:
+    grams = sent.xpath("gram[@type='{}']".format(gram_type))
+    if not grams:
+        return None
+    assert len(grams) == 1
+    return grams[0].text
+
+
+def get_parsed_gram(cache: SentCache, gram_type: str, parse: Callable):
+    """
+    Get the gram of GRAM_TYPE of the sentence of CACHE parsed with PARSE,
+    reusing the result of any previous call with the same cache and gram text.
+    """
+    text = get_gram_text(cache.sent, gram_type)
+    if text is None:
+        return None
+    key = (gram_type, parse)
+    cached = cache.grams.get(key)
+    if cached is not None and cached[0] == text:
+        return cached[1]
+    parsed = parse(text)
+    cache.grams[key] = (text, parsed)
+    return parsed
+
+
+def encode_finnpos_pos(feats_list: List[Dict[str, str]]) -> str:
+    codes = []
+    for feats in feats_list:
+        code = feats.get("pos", "_")
+        if "proper" in feats:
+            code += "+" + feats["proper"]
+        codes.append(code)
+    return " ".join(codes)
+
+
+def parse_finnpos_pos(gram: str) -> List[Dict[str, str]]:
+    feats_list = []
+    for code in gram.split():
+        pos, _, proper = code.partition("+")
+        feats = {} if pos == "_" else {"pos": pos}
+        if proper:
+            feats["proper"] = proper
+        feats_list.append(feats)
+    return feats_list
+
+
+def get_finnpos_analys(cache: SentCache) -> List[Tuple[str, Dict[str, str]]]:
+    analys = get_parsed_gram(cache, FINNPOS_GRAM, json.loads)
+    assert analys is not None
+    return analys
+
+
+def get_finnpos_feats(cache: SentCache) -> List[Dict[str, str]]:
+    """
+    Get the POS features of each token of the sentence of CACHE from the
+    finnpos-pos gram if there is one and otherwise from the finnpos gram. Only
+    the pos and proper features are guaranteed to be present.
+    """
+    feats = get_parsed_gram(cache, FINNPOS_POS_GRAM, parse_finnpos_pos)
+    if feats is not None:
+        return feats
+    analys = get_parsed_gram(cache, FINNPOS_GRAM, json.loads)
+    assert analys is not None
+    return [feats for _lemma, feats in analys]
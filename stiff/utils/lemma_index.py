@@ -0,0 +1,182 @@
+"""
+An on-disk inverted index from lemmas, lemma.pos pairs and synset ids to the
+sentences of an uncompressed STIFF, variant or unified XML file, so that the
+sentences containing some lemma can be fetched without parsing everything.
+
+The index is an SQLite database, by default at INF.lemmas.sqlite, giving the
+id and byte offsets of each sentence as found by stiff.utils.offsets and a
+posting for each key it contains. The keys of a sentence are of three kinds:
+
+ * lemma: the lemma attribute of each <annotation> or <instance> as well as
+   the WordNet lemma names in the wnlemma attribute of STIFF annotations
+ * lemma-pos: lemma.pos for each lemma, where pos is the WordNet POS letter
+   from the synset ids of STIFF annotations or the pos attribute of instances,
+   with adjective satellites (s) counted as adjectives (a) in both cases
+ * synset: each synset id in the text of STIFF annotations or the key
+   attribute of instances, or for instances without a key attribute, such as
+   those from unified-split, the keys given for their id in a keyfile
+"""
+import os
+import sqlite3
+from lxml import etree
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple
+
+from stiff.data.constants import UNI_POS_WN_MAP
+from stiff.utils.anns import parse_qs_list
+from stiff.utils.offsets import (
+    BlockOffset,
+    iter_sentence_id_offsets,
+    map_file,
+    scan_offsets,
+)
+
+KINDS = ("lemma", "lemma-pos", "synset")
+LEMMA_INDEX_SUFFIX = ".lemmas.sqlite"
+BATCH_SIZE = 100000
+
+SCHEMA = """
+CREATE TABLE sentences (
+    id INTEGER PRIMARY KEY,
+    sent_id TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE TABLE postings (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    sentence INTEGER NOT NULL
+);
+"""
+
+
+def synset_pos(synset_id: str) -> Optional[str]:
+    bits = synset_id.rsplit(".", 2)
+    if len(bits) != 3:
+        return None
+    pos = bits[1]
+    return "a" if pos == "s" else pos
+
+
+def read_keyfile(keyin: IO) -> Dict[str, List[str]]:
+    """
+    Read a keyfile, as written by unified-split, into a dict from instance ids
+    to their keys.
+    """
+    inst_keys = {}
+    for line in keyin:
+        bits = line.split()
+        if bits:
+            inst_keys[bits[0]] = bits[1:]
+    return inst_keys
+
+
+def sentence_keys(
+    sent, inst_keys: Optional[Dict[str, List[str]]] = None
+) -> Set[Tuple[str, str]]:
+    keys = set()
+    for ann in sent.iter("annotation", "instance"):
+        lemmas = []
+        if "lemma" in ann.attrib:
+            lemmas.append(ann.attrib["lemma"])
+        if ann.tag == "annotation":
+            lemmas.extend(
+                wnlemma["l"]
+                for wnlemma in parse_qs_list(ann.attrib.get("wnlemma"))
+                if "l" in wnlemma
+            )
+            synsets = (ann.text or "").split()
+            poses = {synset_pos(synset) for synset in synsets}
+        else:
+            if "key" in ann.attrib or inst_keys is None:
+                synsets = ann.attrib.get("key", "").split()
+            else:
+                synsets = inst_keys.get(ann.attrib.get("id"), [])
+            poses = {UNI_POS_WN_MAP.get(ann.attrib.get("pos"))}
+        poses.discard(None)
+        for lemma in lemmas:
+            keys.add(("lemma", lemma))
+            for pos in poses:
+                keys.add(("lemma-pos", "{}.{}".format(lemma, pos)))
+        for synset in synsets:
+            keys.add(("synset", synset))
+    return keys
+
+
+def iter_sentence_blocks(buf) -> Iterator[Tuple[str, BlockOffset]]:
+    for sent_id, offset in iter_sentence_id_offsets(scan_offsets(buf)):
+        if offset.kind == "sentence":
+            yield sent_id, offset
+
+
+def build_lemma_index(
+    fp: IO, index_path: str, inst_keys: Optional[Dict[str, List[str]]] = None
+):
+    """
+    Build a lemma index of the uncompressed XML file object FP at INDEX_PATH,
+    replacing any existing one. INST_KEYS, as from read_keyfile(...), gives the
+    keys of instances without a key attribute.
+    """
+    buf = map_file(fp)
+    if os.path.exists(index_path):
+        os.unlink(index_path)
+    conn = sqlite3.connect(index_path)
+    conn.executescript(SCHEMA)
+    sentences = []
+    postings = []
+
+    def flush():
+        conn.executemany("INSERT INTO sentences VALUES (?, ?, ?, ?)", sentences)
+        conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+        sentences.clear()
+        postings.clear()
+
+    for idx, (sent_id, offset) in enumerate(iter_sentence_blocks(buf)):
+        sentences.append((idx, sent_id, offset.offset, offset.length))
+        sent = etree.fromstring(buf[offset.offset : offset.offset + offset.length])
+        postings.extend(
+            (kind, key, idx) for kind, key in sentence_keys(sent, inst_keys)
+        )
+        if len(postings) >= BATCH_SIZE:
+            flush()
+    flush()
+    conn.execute("CREATE INDEX postings_key ON postings (kind, key)")
+    conn.commit()
+    conn.close()
+
+
+class LemmaIndex:
+    def __init__(self, index_path: str):
+        self.conn = sqlite3.connect(index_path)
+
+    @classmethod
+    def for_file(cls, fp: IO, index_path: Optional[str] = None) -> "LemmaIndex":
+        """
+        Open the lemma index of the XML file object FP, checking that it is
+        not older than FP.
+        """
+        if index_path is None:
+            index_path = fp.name + LEMMA_INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            raise FileNotFoundError("No lemma index at {}".format(index_path))
+        if os.path.getmtime(index_path) < os.path.getmtime(fp.name):
+            raise ValueError("Lemma index {} is out of date".format(index_path))
+        return cls(index_path)
+
+    def lookup(self, kind: str, key: str) -> List[Tuple[str, BlockOffset]]:
+        """
+        Get the ids and offsets of the sentences containing KEY of KIND in
+        document order.
+        """
+        rows = self.conn.execute(
+            "SELECT s.sent_id, s.offset, s.length FROM postings p "
+            "JOIN sentences s ON s.id = p.sentence "
+            "WHERE p.kind = ? AND p.key = ? ORDER BY s.id",
+            (kind, key),
+        )
+        return [
+            (sent_id, BlockOffset("sentence", offset, length, sent_id, 0))
+            for sent_id, offset, length in rows
+        ]
+
+    def close(self):
+        self.conn.close()
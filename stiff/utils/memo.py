@@ -0,0 +1,95 @@
+"""
+A bounded LRU memo of a function of strings which can be persisted to disk
+between runs, with counters of how often it was hit.
+
+The memo is saved as a pickle of its entries from least to most recently
+used, together with a version string. A saved memo with a different version
+(for example from a different segmenter configuration) is ignored. Saving
+writes a temporary file which is then moved into place, so an interrupted run
+never leaves a truncated memo behind.
+"""
+import os
+import pickle
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Iterable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+MEMO_FORMAT = 1
+
+
+class LruMemo(Generic[T]):
+    def __init__(
+        self,
+        func: Callable[[str], T],
+        max_size: int,
+        path: Optional[str] = None,
+        version: str = "",
+    ):
+        self.func = func
+        self.max_size = max_size
+        self.path = path
+        self.version = version
+        self.memo: "OrderedDict[str, T]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __call__(self, key: str) -> T:
+        return self.map([key])[0]
+
+    def map(self, keys: Iterable[str]) -> List[T]:
+        """
+        Look up a batch of keys, such as all the tokens of a context, calling
+        func(...) once for each distinct key which is not yet memoised. Misses
+        are still looked up one key at a time since func(...) takes a single
+        key.
+        """
+        keys = list(keys)
+        batch: Dict[str, T] = {}
+        for key in keys:
+            if key in batch:
+                self.hits += 1
+                continue
+            if key in self.memo:
+                self.hits += 1
+                self.memo.move_to_end(key)
+                batch[key] = self.memo[key]
+            else:
+                self.misses += 1
+                batch[key] = self.memo[key] = self.func(key)
+        while len(self.memo) > self.max_size:
+            self.memo.popitem(last=False)
+        return [batch[key] for key in keys]
+
+    def load(self):
+        with open(self.path, "rb") as inf:
+            saved = pickle.load(inf)
+        if saved.get("format") != MEMO_FORMAT or saved.get("version") != self.version:
+            return
+        # Keep the most recently used entries
+        items = saved["items"]
+        self.memo.update(items[max(len(items) - self.max_size, 0) :])
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "wb") as outf:
+            pickle.dump(
+                {
+                    "format": MEMO_FORMAT,
+                    "version": self.version,
+                    "items": list(self.memo.items()),
+                },
+                outf,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        return "{} hits out of {} lookups ({:.1%}), {} entries memoised".format(
+            self.hits, lookups, self.hits / lookups if lookups else 0, len(self.memo)
+        )
@@ -0,0 +1,176 @@
+"""
+Byte offset indices of the <sentence> (and <subtitle>) elements of
+uncompressed STIFF/unified XML files so that individual sentences can be
+seeked to and parsed without parsing everything before them.
+
+The index is a TSV file with one line per block:
+
+    kind    offset    length    id    anns
+
+where kind is "sentence" or "subtitle", offset and length are in bytes, id is
+the id attribute of sentences and "sources; imdb" for subtitles, and anns is
+the number of <annotation> or <instance> elements in the block.
+"""
+import mmap
+import os
+import re
+from dataclasses import dataclass
+from lxml import etree
+from typing import Dict, IO, Iterator, List, Tuple
+from xml.sax.saxutils import unescape
+
+BLOCK_TAG_RE = re.compile(rb"<(/?)(sentence|subtitle)\b([^>]*)>")
+ATTR_RE = re.compile(rb"""\b([\w-]+)=(?:"([^"]*)"|'([^']*)')""")
+ANN_TAGS = (b"<annotation ", b"<annotation>", b"<instance ", b"<instance>")
+UNESCAPE_ENTITIES = {"&quot;": '"', "&apos;": "'", "&#10;": "\n", "&#9;": "\t"}
+INDEX_SUFFIX = ".idx"
+
+
+@dataclass
+class BlockOffset:
+    kind: str
+    offset: int
+    length: int
+    id: str
+    anns: int
+
+    def fmt(self) -> str:
+        return "{}\t{}\t{}\t{}\t{}\n".format(
+            self.kind, self.offset, self.length, self.id, self.anns
+        )
+
+    @classmethod
+    def parse(cls, line: str) -> "BlockOffset":
+        kind, offset, length, id, anns = line.rstrip("\n").split("\t")
+        return cls(kind, int(offset), int(length), id, int(anns))
+
+
+def parse_attrs(attrs: bytes) -> Dict[str, str]:
+    return {
+        key.decode("utf-8"): unescape(
+            (dq if dq is not None else sq).decode("utf-8"), UNESCAPE_ENTITIES
+        )
+        for key, dq, sq in ATTR_RE.findall(attrs)
+    }
+
+
+def count_anns(buf, start: int, end: int) -> int:
+    block = buf[start:end]
+    return sum(block.count(tag) for tag in ANN_TAGS)
+
+
+def subtitle_id(attrs: Dict[str, str]) -> str:
+    # Follows iter_sentences_opensubs18_stream(...)
+    return "{}; {}".format(" ".join(attrs["sources"].split("; ")), attrs["imdb"])
+
+
+def scan_offsets(buf) -> Iterator[BlockOffset]:
+    """
+    Scan a bytes-like buffer for blocks at the byte level. Assumes that the
+    block tags do not occur within comments or CDATA sections.
+    """
+    sent_start = None
+    sent_id = None
+    subtitle = None
+    subtitle_sents: List[BlockOffset] = []
+    for match in BLOCK_TAG_RE.finditer(buf):
+        closing, tag, attrs = match.groups()
+        if tag == b"sentence":
+            if closing:
+                assert sent_start is not None, "Unmatched </sentence>"
+                sent = BlockOffset(
+                    "sentence",
+                    sent_start,
+                    match.end() - sent_start,
+                    sent_id,
+                    count_anns(buf, sent_start, match.start()),
+                )
+                sent_start = None
+                if subtitle is not None:
+                    subtitle_sents.append(sent)
+                else:
+                    yield sent
+            elif attrs.endswith(b"/"):
+                sent_id = parse_attrs(attrs).get("id")
+                sent = BlockOffset(
+                    "sentence", match.start(), match.end() - match.start(), sent_id, 0
+                )
+                if subtitle is not None:
+                    subtitle_sents.append(sent)
+                else:
+                    yield sent
+            else:
+                assert sent_start is None, "Nested <sentence>"
+                sent_start = match.start()
+                sent_id = parse_attrs(attrs).get("id")
+        else:
+            if closing:
+                assert subtitle is not None, "Unmatched </subtitle>"
+                subtitle.length = match.end() - subtitle.offset
+                subtitle.anns = sum(sent.anns for sent in subtitle_sents)
+                yield subtitle
+                yield from subtitle_sents
+                subtitle = None
+                subtitle_sents = []
+            else:
+                subtitle = BlockOffset(
+                    "subtitle", match.start(), 0, subtitle_id(parse_attrs(attrs)), 0
+                )
+
+
+def map_file(fp: IO):
+    """
+    Memory map an uncompressed, seekable file object.
+    """
+    # An empty file cannot be memory mapped
+    if os.fstat(fp.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def write_offsets(offsets: Iterator[BlockOffset], outf: IO):
+    for offset in offsets:
+        outf.write(offset.fmt())
+
+
+def read_offsets(inf: IO) -> Iterator[BlockOffset]:
+    for line in inf:
+        yield BlockOffset.parse(line)
+
+
+def get_offsets(fp: IO) -> List[BlockOffset]:
+    """
+    Get the offsets of the blocks in the file object FP, using a prebuilt
+    index next to it if there is an up-to-date one or otherwise scanning it.
+    """
+    index_path = fp.name + INDEX_SUFFIX
+    fresh = os.path.exists(index_path) and (
+        os.path.getmtime(index_path) >= os.path.getmtime(fp.name)
+    )
+    if fresh:
+        with open(index_path) as index_f:
+            return list(read_offsets(index_f))
+    return list(scan_offsets(map_file(fp)))
+
+
+def iter_sentence_id_offsets(
+    offsets: Iterator[BlockOffset],
+) -> Iterator[Tuple[str, BlockOffset]]:
+    """
+    Like iter_sentence_id_pairs(...) in stiff.utils.xml but for an index.
+    """
+    subtitle = None
+    subtitle_end = 0
+    for offset in offsets:
+        if offset.kind == "subtitle":
+            subtitle = offset.id
+            subtitle_end = offset.offset + offset.length
+        elif subtitle is not None and offset.offset < subtitle_end:
+            yield "{}; {}".format(subtitle, offset.id), offset
+        else:
+            yield offset.id, offset
+
+
+def read_block(fp: IO, offset: BlockOffset):
+    fp.seek(offset.offset)
+    return etree.fromstring(fp.read(offset.length))
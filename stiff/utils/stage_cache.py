@@ -0,0 +1,167 @@
+"""
+A content-addressed cache of the output of each prefix of a chain of
+filter.py stages, so that variants sharing their first stages only run them
+once.
+
+Each entry is a zstd compressed XML file named after a hash of:
+
+ * the digest of the contents of the input file
+ * the list of stage command lines up to and including the stage
+ * the version of the code, which is a digest of the source of the stiff
+   package and filter.py, so that changing a tournament invalidates the cache
+
+Entries are first written to a temporary file and only moved into place once
+the whole pipeline has succeeded, so a failed run never leaves a truncated
+entry behind.
+"""
+import hashlib
+import json
+import os
+import subprocess
+from functools import lru_cache
+from typing import List, Sequence
+
+from stiff.utils.pipeline import ensure_dir
+
+CACHE_FORMAT = 1
+CACHE_SUFFIX = ".xml.zst"
+DIGESTS_DIR = "digests"
+COPY_BUFSIZE = 1024 * 1024
+
+STIFF_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+FILTER_PY = os.path.join(os.path.dirname(STIFF_DIR), "scripts", "filter.py")
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as inf:
+        while True:
+            chunk = inf.read(COPY_BUFSIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    digest = hashlib.sha256()
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(STIFF_DIR):
+        dirnames.sort()
+        paths.extend(
+            os.path.join(dirpath, filename)
+            for filename in sorted(filenames)
+            if filename.endswith(".py")
+        )
+    if os.path.exists(FILTER_PY):
+        paths.append(FILTER_PY)
+    for path in paths:
+        digest.update(os.path.relpath(path, STIFF_DIR).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(hash_file(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+class StageCache:
+    def __init__(self, cache_dir: str, inf: str):
+        ensure_dir(cache_dir)
+        self.cache_dir = cache_dir
+        self.input_digest = self.get_input_digest(inf)
+        self.tmp_paths: List[str] = []
+
+    def get_input_digest(self, inf: str) -> str:
+        """
+        Get the digest of INF, remembering it in the cache directory for as
+        long as the size and modification time of INF do not change.
+
+        Each input file gets its own file under DIGESTS_DIR, which is replaced
+        atomically, so concurrent runs on different inputs cannot lose each
+        other's digests.
+        """
+        real_path = os.path.realpath(inf)
+        digests_dir = os.path.join(self.cache_dir, DIGESTS_DIR)
+        ensure_dir(digests_dir)
+        path_digest = hashlib.sha256(real_path.encode("utf-8")).hexdigest()
+        digest_path = os.path.join(digests_dir, path_digest + ".json")
+        stat = os.stat(inf)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        if os.path.exists(digest_path):
+            with open(digest_path) as digest_f:
+                known = json.load(digest_f)
+            if known["path"] == real_path and known["stamp"] == stamp:
+                return known["digest"]
+        digest = hash_file(inf)
+        tmp_path = "{}.{}.tmp".format(digest_path, os.getpid())
+        with open(tmp_path, "w") as digest_f:
+            json.dump({"path": real_path, "stamp": stamp, "digest": digest}, digest_f)
+        os.replace(tmp_path, digest_path)
+        return digest
+
+    def key(self, stages: Sequence[str]) -> str:
+        blob = json.dumps(
+            [CACHE_FORMAT, self.input_digest, code_version(), list(stages)]
+        )
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def path(self, stages: Sequence[str]) -> str:
+        return os.path.join(self.cache_dir, self.key(stages) + CACHE_SUFFIX)
+
+    def longest_prefix(self, stages: Sequence[str]) -> int:
+        """
+        Get the length of the longest prefix of STAGES with a cached output,
+        or 0 if there is none.
+        """
+        for length in range(len(stages), 0, -1):
+            if os.path.exists(self.path(stages[:length])):
+                return length
+        return 0
+
+    def tmp_path(self, stages: Sequence[str]) -> str:
+        """
+        Get a temporary path to write the output of STAGES to. It will be
+        moved into the cache by commit().
+        """
+        tmp_path = "{}.{}.tmp".format(self.path(stages), os.getpid())
+        self.tmp_paths.append(tmp_path)
+        return tmp_path
+
+    def commit(self):
+        for tmp_path in self.tmp_paths:
+            # tee_zstd(...) removes its output if it fails, for example when
+            # a later stage exits early, leaving that prefix uncached
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, tmp_path.rsplit(".", 2)[0])
+        self.tmp_paths = []
+
+    def discard(self):
+        for tmp_path in self.tmp_paths:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        self.tmp_paths = []
+
+
+def tee_zstd(inf, outf, path: str):
+    """
+    Copy INF to OUTF while also writing a zstd compressed copy to PATH.
+    """
+    zstd = subprocess.Popen(
+        ["zstdmt", "-q", "-f", "-", "-o", path], stdin=subprocess.PIPE
+    )
+    try:
+        while True:
+            chunk = inf.read(COPY_BUFSIZE)
+            if not chunk:
+                break
+            outf.write(chunk)
+            zstd.stdin.write(chunk)
+        outf.flush()
+    except BaseException:
+        zstd.kill()
+        zstd.wait()
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+    zstd.stdin.close()
+    if zstd.wait() != 0:
+        raise subprocess.CalledProcessError(zstd.returncode, zstd.args)
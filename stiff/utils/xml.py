@@ -1,10 +1,12 @@
 from lxml import etree
 from xml.sax.saxutils import quoteattr, escape
+from contextlib import ExitStack
 from functools import partial
-from typing import Callable, IO
+from typing import Any, Callable, IO, List
 
 Matcher = Callable[[str], bool]
 Transformer = Callable[[etree.ElementBase], etree.ElementBase]
+MultiTransformer = Callable[[etree.ElementBase], Any]
 
 
 def eq_matcher(tag_name: str) -> Matcher:
@@ -22,10 +24,15 @@ def in_matcher(*tag_names: str) -> Matcher:
 
 
 def detatch_elem(elem):
-    # Eliminate now-empty references from the root node to elem
-    for ancestor in elem.xpath("ancestor-or-self::*"):
-        while ancestor.getprevious() is not None:
-            del ancestor.getparent()[0]
+    # Eliminate now-empty references from the root node to elem. Since this is
+    # done after every block, there is usually at most one previous sibling
+    # to delete per level, so this is bounded by the depth of elem.
+    parent = elem.getparent()
+    while parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+        elem = parent
+        parent = elem.getparent()
 
 
 def free_elem(elem):
@@ -68,17 +75,28 @@ def write_event(event, elem, outf):
         return False
 
 
-def fixup_missing_text(event, elem, outf):
+def missing_text(event, elem):
+    """
+    Returns the text of an element written out with write_event(...) which
+    could not be written when its start tag was, since at "start" time the
+    text has not necessarily been parsed yet. This should be called with the
+    next event after the "start" event.
+    """
     if event == "end":
         prev_elem = elem
         if len(elem):
-            return
+            return None
     else:
         prev_elem = elem.getparent()
         if prev_elem[0] != elem:
-            return
-    if prev_elem.text is not None:
-        outf.write(escape(prev_elem.text).encode("utf-8"))
+            return None
+    return prev_elem.text
+
+
+def fixup_missing_text(event, elem, outf):
+    text = missing_text(event, elem)
+    if text is not None:
+        outf.write(escape(text).encode("utf-8"))
 
 
 def close_all(elem, outf):
@@ -86,31 +104,128 @@ def close_all(elem, outf):
         outf.write(close_tag(par_elem).encode("utf-8"))
 
 
-def transform(stream, matcher: Matcher, transformer: Transformer, outf: IO):
-    outf.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class BufferedOutput:
+    """
+    Coalesces many small writes into a few large ones to OUTF.
+    """
+
+    def __init__(self, outf: IO, size: int = OUTPUT_BUFFER_SIZE):
+        self.outf = outf
+        self.size = size
+        self.buf = bytearray()
 
-    missing_text = False
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= self.size:
+            self.flush()
+        return len(data)
 
-    def always(event, elem):
-        nonlocal missing_text
-        if missing_text:
-            fixup_missing_text(event, elem, outf)
-            missing_text = False
+    def flush(self):
+        if self.buf:
+            self.outf.write(bytes(self.buf))
+            self.buf.clear()
 
-    def outside(event, elem):
-        nonlocal missing_text
-        missing_text = write_event(event, elem, outf)
+
+def transform(stream, matcher: Matcher, transformer: Transformer, outf: IO):
+    """
+    Stream from `stream` to `outf`, passing every block matched by `matcher` to
+    `transformer` and writing the (possibly modified) block back out. Outside
+    of the blocks, the document structure is written incrementally.
+    """
 
     def inside(elem):
         retval = transformer(elem)
-        if retval is BREAK:
-            close_all(elem, outf)
+        if retval is BYPASS or retval is BREAK:
+            return retval
+        return [elem]
+
+    transform_multi(stream, matcher, inside, [outf])
+
+
+def transform_blocks_multi(
+    matcher: Matcher, inf: IO, transformer: MultiTransformer, outfs: List[IO]
+):
+    stream = etree.iterparse(inf, events=("start", "end"))
+    transform_multi(stream, matcher, transformer, outfs)
+
+
+def transform_multi(
+    stream, matcher: Matcher, transformer: MultiTransformer, outfs: List[IO]
+):
+    """
+    Like transform(...) but writing to each of `outfs` from a single parse of
+    `stream`. The document structure is written to all of them while
+    `transformer` returns either BYPASS, BREAK or a list of blocks to write,
+    one per output. Transformers producing different blocks for different
+    outputs must copy the block they are passed.
+    """
+    outs = [BufferedOutput(outf) for outf in outfs]
+    for out in outs:
+        out.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+    # Text is only allowed inside the root element by xmlfile
+    trailing = []
+    with ExitStack() as stack:
+        xfs = [
+            stack.enter_context(etree.xmlfile(out, encoding="utf-8")) for out in outs
+        ]
+        open_elems = []
+        text_pending = False
+
+        def write_text(text):
+            for xf in xfs:
+                xf.write(text)
+
+        def write_tail(elem):
+            tail = elem.tail or "\n"
+            if open_elems:
+                write_text(tail)
+            else:
+                trailing.append(tail)
+
+        def close_elem():
+            elem, ctxs = open_elems.pop()
+            for ctx in ctxs:
+                ctx.__exit__(None, None, None)
+            write_tail(elem)
+
+        def always(event, elem):
+            nonlocal text_pending
+            if text_pending:
+                text = missing_text(event, elem)
+                if text is not None:
+                    write_text(text)
+                text_pending = False
+
+        def outside(event, elem):
+            nonlocal text_pending
+            if event == "start":
+                ctxs = [xf.element(elem.tag, elem.attrib) for xf in xfs]
+                for ctx in ctxs:
+                    ctx.__enter__()
+                open_elems.append((elem, ctxs))
+                text_pending = True
+            else:
+                close_elem()
+
+        def inside(elem):
+            retval = transformer(elem)
+            if retval is BREAK:
+                while open_elems:
+                    close_elem()
+                return retval
+            if retval is not BYPASS:
+                for xf, block in zip(xfs, retval):
+                    xf.write(block)
             return retval
-        if retval is not BYPASS:
-            outf.write(etree.tostring(elem, encoding="utf-8"))
-        return retval
 
-    chunk_stream_cb(stream, matcher, outside, inside, always)
+        chunk_stream_cb(stream, matcher, outside, inside, always)
+    trailing_bytes = "".join(trailing).encode("utf-8")
+    for out in outs:
+        out.write(trailing_bytes)
+        out.flush()
 
 
 class AbortThread(BaseException):
@@ -0,0 +1,85 @@
+from io import BytesIO
+from lxml import etree
+
+from stiff.ann_table import AnnTable, build_ann_table, project_table, stage_columns
+from stiff.filter import AlphabeticDom, FreqRankDom, HasSupportTournament
+
+SUPPORT = "transfer-type=aligned&amp;transfer-from=9"
+
+CORPUS = """<?xml version='1.0' encoding='UTF-8'?>
+<corpus>
+<sentence id="1">
+<text id="fi-tok" lang="fi">a b</text>
+<annotations>
+{}
+</annotations>
+</sentence>
+<sentence id="2">
+<text id="fi-tok" lang="fi">a b</text>
+<annotations>
+{}
+</annotations>
+</sentence>
+</corpus>
+"""
+
+
+def ann(id, tok, rank, text, support=True):
+    return (
+        f'<annotation id="{id}" type="stiff"'
+        + (f' support="{SUPPORT}"' if support else "")
+        + f' rank="{rank}" anchor-positions="from-id=fi-tok&amp;char=0'
+        + f'&amp;token={tok}&amp;token-length=1">{text}</annotation>'
+    )
+
+
+def mk_corpus():
+    return CORPUS.format(
+        "\n".join(
+            [
+                ann(0, 0, 1, "b.n.01"),
+                ann(1, 0, 1, "a.n.01"),
+                ann(2, 0, 2, "c.n.01", support=False),
+                ann(3, 1, 2, "d.n.01", support=False),
+                ann(4, 1, 1, "e.n.01", support=False),
+            ]
+        ),
+        "\n".join([ann(5, 0, 3, "f.n.01"), ann(6, 1, 1, "g.n.01")]),
+    ).encode("utf-8")
+
+
+def run_table(stages):
+    table_f = BytesIO()
+    build_ann_table(BytesIO(mk_corpus()), stage_columns(stages)).save(table_f)
+    table_f.seek(0)
+    table = AnnTable.load(table_f)
+    outf = BytesIO()
+    project_table(BytesIO(mk_corpus()), table, table.run_stages(stages), outf)
+    return outf.getvalue()
+
+
+def run_tournaments(tournaments):
+    data = mk_corpus()
+    for tournament in tournaments:
+        outf = BytesIO()
+        tournament.proc_stream(BytesIO(data), outf)
+        data = outf.getvalue()
+    return data
+
+
+def ann_ids(data):
+    return [ann.attrib["id"] for ann in etree.fromstring(data).iter("annotation")]
+
+
+def test_table_matches_tournaments():
+    assert run_table(["sup-dom", "freq-dom", "break-ties"]) == run_tournaments(
+        [HasSupportTournament(), FreqRankDom(), AlphabeticDom()]
+    )
+    assert run_table(["has-support-dom --proc=rm"]) == run_tournaments(
+        [HasSupportTournament(False, (0,))]
+    )
+
+
+def test_table_rm_ambg():
+    assert ann_ids(run_table(["rm-ambg"])) == ["5", "6"]
+    assert ann_ids(run_table(["freq-dom", "rm-ambg"])) == ["4", "5", "6"]
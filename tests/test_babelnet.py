@@ -0,0 +1,39 @@
+import io
+import pytest
+
+from stiff.munge.babelnet import (
+    CompiledBn2Wn,
+    compile_bn2wn,
+    open_bn2wn,
+    read_bn2wn_tsv,
+)
+
+BN2WN_TSV = "".join(
+    "bn:{:08d}n\twn:{:08d}{}\n".format(idx % 70, idx, "nvar"[idx % 4])
+    for idx in range(200)
+) + ("bn:00000003n\twn:00000003r\n")
+
+
+def test_compiled_bn2wn_matches_tsv(tmp_path):
+    tsv_path = tmp_path / "bn2wn.tsv"
+    tsv_path.write_text(BN2WN_TSV)
+    compiled_path = tmp_path / "bn2wn.bin"
+    with open(compiled_path, "wb") as outf:
+        compile_bn2wn(io.StringIO(BN2WN_TSV), outf)
+    from_tsv = open_bn2wn(str(tsv_path))
+    compiled = open_bn2wn(str(compiled_path))
+    expected = read_bn2wn_tsv(io.StringIO(BN2WN_TSV))
+    assert expected["bn:00000003n"] == "00000003-r 00000073-v 00000143-r"
+    for bn in list(expected) + ["", "bn:", "bn:00000070n", "bn:99999999n", "zz"]:
+        assert compiled(bn) == from_tsv(bn) == expected.get(bn)
+    # Empty annotations have no text
+    assert compiled(None) is None
+    assert from_tsv(None) is None
+
+
+def test_compiled_bn2wn_bad_magic(tmp_path):
+    tsv_path = tmp_path / "bn2wn.tsv"
+    tsv_path.write_text(BN2WN_TSV)
+    with open(tsv_path, "rb") as fp:
+        with pytest.raises(ValueError):
+            CompiledBn2Wn(fp)
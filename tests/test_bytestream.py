@@ -0,0 +1,65 @@
+from io import BytesIO
+from lxml import etree
+
+from stiff.utils import bytestream
+from stiff.utils.bytestream import fast_transform_sentences
+from stiff.utils.xml import BREAK, BYPASS
+
+CORPUS = """<?xml version="1.0" encoding="UTF-8"?>
+<corpus source="OpenSubtitles2018">
+<subtitle sources="a.xml b.xml" imdb="1">
+<sentence id="0">
+<text id="fi-tok" lang="fi">Murha !</text>
+<gram type="finnpos" for="fi-tok"><![CDATA[[["</sentence>", {}]]]]></gram>
+</sentence>
+<sentence id="1">
+<!-- </sentence> -->
+<text id="fi-tok" lang="fi">Hyvää !</text>
+</sentence>
+<sentence id="2"/>
+</subtitle>
+</corpus>
+""".encode(
+    "utf-8"
+)
+
+
+def sent_ids(result):
+    return [sent.attrib["id"] for sent in etree.fromstring(result).xpath("//sentence")]
+
+
+def run_fast(corpus, transformer):
+    outf = BytesIO()
+    fast_transform_sentences(BytesIO(corpus), transformer, outf)
+    return outf.getvalue()
+
+
+def test_fast_identity(monkeypatch):
+    # Make sure chunk boundaries fall everywhere
+    monkeypatch.setattr(bytestream, "CHUNK_SIZE", 7)
+    assert run_fast(CORPUS, lambda sent: None) == CORPUS
+
+
+def test_fast_bypass_break():
+    seen = 0
+
+    def select(sent):
+        nonlocal seen
+        seen += 1
+        if seen == 3:
+            return BREAK
+        if seen == 1:
+            return BYPASS
+
+    assert sent_ids(run_fast(CORPUS, select)) == ["1"]
+
+
+def test_fast_fallback():
+    corpus = CORPUS.replace(b'encoding="UTF-8"', b'encoding="ISO-8859-1"')
+
+    def only_second(sent):
+        assert isinstance(sent, bytes)
+        if etree.fromstring(sent).attrib["id"] != "1":
+            return BYPASS
+
+    assert sent_ids(run_fast(corpus, only_second)) == ["1"]
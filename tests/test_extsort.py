@@ -0,0 +1,16 @@
+import random
+
+from stiff.utils.extsort import external_sort
+
+
+def test_external_sort_is_stable():
+    rng = random.Random(0)
+    records = [(rng.randrange(50), idx) for idx in range(1000)]
+    expected = sorted(records, key=lambda record: record[0])
+    for run_size in (1, 7, 1000, 5000):
+        result = list(
+            external_sort(
+                iter(records), key=lambda record: record[0], run_size=run_size
+            )
+        )
+        assert result == expected
@@ -3,10 +3,18 @@ from string import Template
 
 from stiff.filter import (
     AlignTournament,
+    CmpTournament,
     NonDerivTournament,
     HasSupportTournament,
+    HypTournament,
+    SrcCharSpanTournament,
+    chain_stages,
     decode_dom_arg,
+    get_stage_transformer,
+    greedy_max_span,
+    mk_fold_support,
 )
+from stiff.utils.anns import SentCache, ann_view
 
 ALIGNED_NODERIV_SUPPORT = (
     "transfer-type=aligned&amp;transfer-from=3&amp;transform-chain=%5B%5D"
@@ -124,3 +132,163 @@ def test_filter_deriv_dom():
     tournament.proc_sent(sent2)
     assert len(sent2.xpath("//annotation")) == 1
     assert len(sent2.xpath("//annotation[@id='0']")) == 1
+
+
+def test_ann_view_follows_changes():
+    sent = etree.fromstring(FILTER_ALIGN_DOM_TEST_CORPUS_BOTH_ALIGNED)
+    ann = sent.xpath("//annotation[@id='0']")[0]
+    cache = SentCache(sent)
+    view = cache.view(ann)
+    assert cache.view(ann) is view
+    assert ann_view(view) is view
+    assert view in cache.anns()
+    assert view.pos == (0, 1)
+    assert len(view.supports) == 2
+    ann.attrib["support"] = ALIGNED_NODERIV_SUPPORT
+    assert len(view.supports) == 1
+    del ann.attrib["support"]
+    assert view.supports == []
+
+
+def test_src_char_span_nondominated_matches_cmp():
+    import random
+
+    rng = random.Random(42)
+    tournament = SrcCharSpanTournament()
+    for _ in range(2000):
+        group_spans = [
+            [(rng.randrange(6), rng.randrange(1, 4)) for _ in range(rng.randrange(4))]
+            for _ in range(rng.randrange(1, 6))
+        ]
+        expected = CmpTournament.nondominated(tournament, group_spans)
+        assert set(tournament.nondominated(group_spans)) == set(expected)
+
+
+class DagSynset:
+    def __init__(self, name, hypernyms=(), instance_hypernyms=()):
+        self.name = name
+        self._hypernyms = list(hypernyms)
+        self._instance_hypernyms = list(instance_hypernyms)
+
+    def hypernyms(self):
+        return self._hypernyms
+
+    def instance_hypernyms(self):
+        return self._instance_hypernyms
+
+    def hypernym_paths(self):
+        # As in nltk.corpus.reader.wordnet.Synset
+        hypernyms = self.hypernyms() + self.instance_hypernyms()
+        if not hypernyms:
+            return [[self]]
+        return [path + [self] for hyp in hypernyms for path in hyp.hypernym_paths()]
+
+
+def test_hyp_cmp_matches_hypernym_paths():
+    import random
+
+    def path_cmp(syn1, syn2):
+        def hypernym_of(hyper, hypo):
+            return len(hypo) > len(hyper) and hypo[: len(hyper)] == hyper
+
+        syn1_dom = syn2_dom = False
+        for hyp_path1 in syn1.hypernym_paths():
+            for hyp_path2 in syn2.hypernym_paths():
+                if hypernym_of(hyp_path1, hyp_path2):
+                    syn1_dom = True
+                elif hypernym_of(hyp_path2, hyp_path1):
+                    syn2_dom = True
+        if syn1_dom and not syn2_dom:
+            return 1
+        elif syn2_dom and not syn1_dom:
+            return -1
+        else:
+            return 0
+
+    rng = random.Random(7)
+    synsets = []
+    for idx in range(40):
+        parents = rng.sample(synsets, min(len(synsets), rng.randrange(3)))
+        split = rng.randrange(len(parents) + 1)
+        synsets.append(DagSynset(idx, parents[:split], parents[split:]))
+    for syn1 in synsets:
+        for syn2 in synsets:
+            assert HypTournament.cmp(syn1, syn2) == path_cmp(syn1, syn2)
+    group = rng.sample(synsets, 10) + [None]
+    expected = CmpTournament.nondominated(HypTournament(), group)
+    assert set(HypTournament().nondominated(group)) == set(expected)
+
+
+def test_fold_support():
+    sent = etree.fromstring(
+        """
+<sentence id="1">
+<annotations>
+<annotation id="3" lang="zh" anchor="谋杀" anchor-positions="from-id=zh-tok&amp;char=0&amp;token=0" lemma-path="whole" wordnets="cmn">murder.n.01</annotation>
+<annotation id="4" lang="fi" support="transfer-type=aligned&amp;transfer-from=3" anchor="Murha" anchor-positions="from-id=fi-tok&amp;char=0&amp;token=0" lemma-path="omor" wordnets="fin">murder.n.01</annotation>
+</annotations>
+</sentence>
+"""
+    )
+    mk_fold_support("fi")(sent)
+    ann = sent.xpath("//annotation[@id='4']")[0]
+    assert ann_view(ann).supports == [
+        {
+            "transfer-type": "aligned",
+            "transfer-from-wordnets": "cmn",
+            "transfer-from-source": "zh-tok",
+            "transfer-from-lemma-path": "whole",
+            "transfer-from-anchor-positions": "from-id=zh-tok&char=0&token=0",
+            "transfer-from-anchor-char-length": "2",
+        }
+    ]
+
+
+def test_greedy_max_span_matches_gap_walk():
+    import random
+
+    def gap_walk(positions):
+        max_pos = 0
+        for pos in positions:
+            positions[pos].sort(reverse=True, key=lambda pair: pair[0])
+            if pos > max_pos:
+                max_pos = pos
+        anns = []
+        cur_pos = 0
+        while cur_pos <= max_pos:
+            while cur_pos not in positions:
+                cur_pos += 1
+                if cur_pos > max_pos:
+                    break
+            if cur_pos > max_pos:
+                break
+            cur_len, ann = positions[cur_pos][0]
+            anns.append(ann)
+            for other_len, ann in positions[cur_pos][1:]:
+                if other_len != cur_len:
+                    break
+                anns.append(ann)
+            cur_pos += cur_len
+        return anns
+
+    rng = random.Random(3)
+    for _ in range(2000):
+        positions = {}
+        for ann in range(rng.randrange(10)):
+            positions.setdefault(rng.randrange(15), []).append(
+                (rng.randrange(1, 5), ann)
+            )
+        expected = gap_walk({pos: list(pairs) for pos, pairs in positions.items()})
+        assert greedy_max_span(positions) == expected
+
+
+def test_chain_stages_matches_separate_stages():
+    corpus = FILTER_ALIGN_DOM_TEST_CORPUS_BOTH_UNALIGNED
+    stages = ["align-dom --proc=dom", "finnpos-rm-pos --level=agg", "rm-ambg"]
+    separate = etree.fromstring(corpus)
+    for stage in stages:
+        get_stage_transformer(stage)(separate)
+    chained = etree.fromstring(corpus)
+    chain_stages(stages)(chained)
+    assert etree.tostring(chained) == etree.tostring(separate)
+    assert len(chained.xpath("./annotations/annotation")) == 1
@@ -0,0 +1,118 @@
+import io
+
+from stiff.utils.lemma_index import LemmaIndex, build_lemma_index, read_keyfile
+from stiff.utils.offsets import read_block
+
+STIFF_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<corpus source="OpenSubtitles2018">
+<subtitle sources="a.xml" imdb="1">
+<sentence id="0">
+<annotations>
+<annotation id="0" lang="fi" lemma="murha" wnlemma="l=murha&amp;wn=fin l=murhata&amp;wn=qf2" wordnets="fin">murder.n.01 murha.n.02</annotation>
+</annotations>
+</sentence>
+<sentence id="1">
+<annotations>
+<annotation id="0" lang="fi" lemma="olla" wnlemma="l=olla&amp;wn=fin" wordnets="fin">be.v.01</annotation>
+</annotations>
+</sentence>
+<sentence id="2">
+<annotations>
+<annotation id="0" lang="fi" lemma="kaunis" wnlemma="l=kaunis&amp;wn=fin" wordnets="fin">beautiful.s.01</annotation>
+</annotations>
+</sentence>
+</subtitle>
+</corpus>
+"""
+
+UNIFIED_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<corpus lang="fi" source="eurosense">
+<text id="eurosense">
+<sentence id="3">
+<wf>Se</wf>
+<instance id="3.0" lemma="murha" pos="NOUN" key="murder.n.01">murha</instance>
+</sentence>
+</text>
+</corpus>
+"""
+
+SPLIT_UNIFIED_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<corpus lang="fi" source="eurosense">
+<text id="eurosense">
+<sentence id="3">
+<wf>Se</wf>
+<instance id="3.00000000" lemma="murha" pos="NOUN">murha</instance>
+</sentence>
+<sentence id="4">
+<instance id="4.00000000" lemma="olla" pos="VERB">on</instance>
+</sentence>
+</text>
+</corpus>
+"""
+
+SPLIT_UNIFIED_KEY = "3.00000000 murder.n.01 murha.n.02\n4.00000000 be.v.01\n"
+
+
+def test_lemma_index(tmp_path):
+    xml_path = tmp_path / "stiff.xml"
+    xml_path.write_bytes(STIFF_XML)
+    index_path = str(tmp_path / "stiff.xml.lemmas.sqlite")
+    with open(xml_path, "rb") as fp:
+        build_lemma_index(fp, index_path)
+        lemma_index = LemmaIndex.for_file(fp)
+        assert [sent_id for sent_id, _ in lemma_index.lookup("lemma", "murha")] == [
+            "a.xml; 1; 0"
+        ]
+        assert lemma_index.lookup("lemma", "murhata") == lemma_index.lookup(
+            "lemma", "murha"
+        )
+        assert lemma_index.lookup("lemma-pos", "murha.v") == []
+        [(_, offset)] = lemma_index.lookup("lemma-pos", "olla.v")
+        assert read_block(fp, offset).attrib["id"] == "1"
+        assert len(lemma_index.lookup("synset", "murha.n.02")) == 1
+
+
+def test_lemma_index_satellite_pos(tmp_path):
+    xml_path = tmp_path / "stiff.xml"
+    xml_path.write_bytes(STIFF_XML)
+    index_path = str(tmp_path / "stiff.xml.lemmas.sqlite")
+    with open(xml_path, "rb") as fp:
+        build_lemma_index(fp, index_path)
+        lemma_index = LemmaIndex.for_file(fp)
+        assert [
+            sent_id for sent_id, _ in lemma_index.lookup("lemma-pos", "kaunis.a")
+        ] == ["a.xml; 1; 2"]
+        assert lemma_index.lookup("lemma-pos", "kaunis.s") == []
+        assert len(lemma_index.lookup("synset", "beautiful.s.01")) == 1
+
+
+def test_lemma_index_unified(tmp_path):
+    xml_path = tmp_path / "unified.xml"
+    xml_path.write_bytes(UNIFIED_XML)
+    index_path = str(tmp_path / "unified.idx")
+    with open(xml_path, "rb") as fp:
+        build_lemma_index(fp, index_path)
+        lemma_index = LemmaIndex.for_file(fp, index_path)
+        for kind, key in [
+            ("lemma", "murha"),
+            ("lemma-pos", "murha.n"),
+            ("synset", "murder.n.01"),
+        ]:
+            assert [sent_id for sent_id, _ in lemma_index.lookup(kind, key)] == ["3"]
+
+
+def test_lemma_index_unified_keyfile(tmp_path):
+    xml_path = tmp_path / "unified.xml"
+    xml_path.write_bytes(SPLIT_UNIFIED_XML)
+    index_path = str(tmp_path / "unified.idx")
+    inst_keys = read_keyfile(io.StringIO(SPLIT_UNIFIED_KEY))
+    with open(xml_path, "rb") as fp:
+        build_lemma_index(fp, index_path, inst_keys)
+        lemma_index = LemmaIndex.for_file(fp, index_path)
+        for kind, key, sent_ids in [
+            ("synset", "murder.n.01", ["3"]),
+            ("synset", "murha.n.02", ["3"]),
+            ("synset", "be.v.01", ["4"]),
+            ("lemma-pos", "olla.v", ["4"]),
+        ]:
+            assert [sent_id for sent_id, _ in lemma_index.lookup(kind, key)] == sent_ids
@@ -0,0 +1,46 @@
+from stiff.utils.memo import LruMemo
+
+
+def test_memo_map_calls_once_per_key():
+    calls = []
+
+    def upper(key):
+        calls.append(key)
+        return key.upper()
+
+    memo = LruMemo(upper, max_size=10)
+    assert memo.map(["a", "b", "a"]) == ["A", "B", "A"]
+    assert memo.map(["b", "c"]) == ["B", "C"]
+    assert calls == ["a", "b", "c"]
+    assert (memo.hits, memo.misses) == (2, 3)
+
+
+def test_memo_evicts_least_recently_used():
+    memo = LruMemo(str.upper, max_size=2)
+    memo.map(["a", "b"])
+    memo("a")
+    memo("c")
+    assert list(memo.memo) == ["a", "c"]
+
+
+def test_memo_persists(tmp_path):
+    path = str(tmp_path / "memo.pkl")
+    memo = LruMemo(str.upper, max_size=10, path=path, version="1")
+    memo.map(["a", "b"])
+    memo.save()
+
+    reloaded = LruMemo(str.upper, max_size=10, path=path, version="1")
+    assert reloaded.map(["a", "b"]) == ["A", "B"]
+    assert (reloaded.hits, reloaded.misses) == (2, 0)
+
+    other_version = LruMemo(str.upper, max_size=10, path=path, version="2")
+    assert len(other_version.memo) == 0
+
+
+def test_memo_load_keeps_most_recent(tmp_path):
+    path = str(tmp_path / "memo.pkl")
+    memo = LruMemo(str.upper, max_size=10, path=path)
+    memo.map(["a", "b", "c"])
+    memo.save()
+    assert list(LruMemo(str.upper, max_size=2, path=path).memo) == ["b", "c"]
+    assert len(LruMemo(str.upper, max_size=0, path=path).memo) == 0
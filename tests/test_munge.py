@@ -31,3 +31,205 @@ def test_head_doesnt_move():
     result = outf.getvalue()
     tree = etree.fromstring(result)
     assert tree.xpath("//context")[0].text.strip() == ""
+
+
+def load_script(name):
+    import importlib.util
+    from os.path import dirname, join as pjoin
+
+    path = pjoin(dirname(dirname(__file__)), "scripts", name + ".py")
+    spec = importlib.util.spec_from_file_location("stiff_scripts_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_cmd(group, *args):
+    from click.testing import CliRunner
+
+    result = CliRunner().invoke(group, [str(arg) for arg in args])
+    if result.exception is not None:
+        raise result.exception
+    assert result.exit_code == 0, result.output
+
+
+STIFF_XML = b"""<?xml version='1.0' encoding='UTF-8'?>
+<corpus source="OpenSubtitles2018">
+<subtitle sources="a.xml; b.xml" imdb="123">
+<sentence id="1">
+<text id="fi-tok" lang="fi">Pekka &amp; murha talo on .</text>
+<annotations>
+<annotation id="0" type="stiff" lang="fi" anchor="murha" anchor-positions="from-id=fi-tok&amp;char=8&amp;token=2&amp;token-length=1" lemma="murha" wnlemma="l=murha&amp;wn=fin,qf2" wordnets="fin qf2" lemma-path="omor">murder.n.01 murha.n.02</annotation>
+<annotation id="1" type="stiff" lang="fi" anchor="murha talo" anchor-positions="from-id=fi-tok&amp;char=8&amp;token=2&amp;token-length=2" lemma="murhatalo" wnlemma="l=murha_talo&amp;wn=qf2" wordnets="qf2" lemma-path="omor">murhatalo.n.01</annotation>
+<annotation id="2" type="stiff" lang="fi" anchor="on" anchor-positions="from-id=fi-tok&amp;char=19&amp;token=4&amp;token-length=1" lemma="olla" wnlemma="l=olla&amp;wn=qwf" wordnets="qwf" lemma-path="omor">be.v.01</annotation>
+<annotation id="3" type="stiff" lang="fi" anchor="on" anchor-positions="from-id=fi-tok&amp;char=19&amp;token=4&amp;token-length=1" lemma="olla" wnlemma="l=olla&amp;wn=qf2" wordnets="qf2" lemma-path="omor">olla.v.01</annotation>
+</annotations>
+</sentence>
+<sentence id="2">
+<text id="fi-tok" lang="fi">Talo .</text>
+<annotations>
+<annotation id="0" type="stiff" lang="fi" anchor="Talo" anchor-positions="from-id=fi-tok&amp;char=0&amp;token=0&amp;token-length=1" lemma="talo" wnlemma="l=talo&amp;wn=fin,qf2" wordnets="fin qf2" lemma-path="omor">house.n.01 talo.n.01</annotation>
+</annotations>
+</sentence>
+</subtitle>
+</corpus>
+"""
+
+
+def fake_lemma_to_synset(ann):
+    # Stands in for the WordNet lookup in ann_lemma_to_synset(...)
+    name, pos, num = ann.text.split(" ")[-1].rsplit(".", 2)
+    ann.text = "{}.{}-{}".format(name, num, pos)
+
+
+def test_stiff_to_unified_direct_matches_piped(tmp_path, monkeypatch):
+    munge = load_script("munge")
+    filter_py = load_script("filter")
+    monkeypatch.setattr(munge, "ann_lemma_to_synset", fake_lemma_to_synset)
+    stiff = tmp_path / "stiff.xml"
+    stiff.write_bytes(STIFF_XML)
+
+    run_cmd(munge.munge, "stiff-select-wn", "--wn", "qf2", stiff, tmp_path / "1.xml")
+    run_cmd(filter_py.filter, "tok-span-dom", tmp_path / "1.xml", tmp_path / "2.xml")
+    run_cmd(munge.munge, "lemma-to-synset", tmp_path / "2.xml", tmp_path / "3.xml")
+    run_cmd(munge.munge, "stiff-to-unified", tmp_path / "3.xml", tmp_path / "4.xml")
+    run_cmd(
+        munge.munge,
+        "unified-split",
+        tmp_path / "4.xml",
+        tmp_path / "piped.xml",
+        tmp_path / "piped.key",
+    )
+    run_cmd(
+        munge.munge,
+        "stiff-to-unified-direct",
+        stiff,
+        tmp_path / "direct.xml",
+        tmp_path / "direct.key",
+    )
+
+    piped_key = (tmp_path / "piped.key").read_bytes()
+    assert b"murhatalo.01-n" in piped_key
+    assert b"be.01-v" not in piped_key
+    assert (tmp_path / "direct.xml").read_bytes() == (
+        tmp_path / "piped.xml"
+    ).read_bytes()
+    assert (tmp_path / "direct.key").read_bytes() == piped_key
+
+
+EUROSENSE_XML = b"""<?xml version='1.0' encoding='UTF-8'?>
+<corpus source="europarl">
+<sentence id="0">
+<text lang="en">Isn't it the big houses ?</text>
+<text lang="fi">Eik\xc3\xb6 ei tied\xc3\xa4 isot talot talossa Rakennus auto ?</text>
+<annotations>
+<annotation lang="en" type="NASARI" anchor="houses" lemma="house" coherenceScore="0.1" nasariScore="0.2">bn:00000001n</annotation>
+<annotation lang="fi" type="NASARI" anchor="talossa" lemma="talo" coherenceScore="0.1" nasariScore="0.2">bn:00000001n</annotation>
+<annotation lang="fi" type="NASARI" anchor="Rakennus" lemma="rakennu" coherenceScore="0.1" nasariScore="0.2">bn:00000001n</annotation>
+<annotation lang="fi" type="NASARI" anchor="ei tied\xc3\xa4" lemma="ei tiet\xc3\xa4\xc3\xa4" coherenceScore="0.1" nasariScore="0.2">bn:00000002v</annotation>
+<annotation lang="fi" type="NASARI" anchor="isot talot" lemma="isotalo" coherenceScore="0.1" nasariScore="0.2">bn:00000003n</annotation>
+<annotation lang="fi" type="NASARI" anchor="auto" lemma="auto" coherenceScore="0.1" nasariScore="0.2">bn:00000001n</annotation>
+<annotation lang="fi" type="NASARI" anchor="auto" lemma="auto" coherenceScore="0.1" nasariScore="0.2">bn:00000009n</annotation>
+</annotations>
+</sentence>
+<sentence id="1">
+<text lang="en">A car .</text>
+<text lang="fi">Auto .</text>
+<annotations>
+<annotation lang="en" type="NASARI" anchor="car" lemma="car" coherenceScore="0.1" nasariScore="0.2">bn:00000001n</annotation>
+<annotation lang="fi" type="NASARI" anchor="Auto" lemma="auto" coherenceScore="0.1" nasariScore="0.2">bn:00000001n</annotation>
+</annotations>
+</sentence>
+<sentence id="2">
+<text lang="en">Houses .</text>
+<annotations>
+<annotation lang="en" type="NASARI" anchor="Houses" lemma="house" coherenceScore="0.1" nasariScore="0.2">bn:00000001n</annotation>
+</annotations>
+</sentence>
+</corpus>
+"""
+
+BN2WN_TSV = (
+    "bn:00000001n\twn:00000001n\n"
+    "bn:00000002v\twn:00000002v\n"
+    "bn:00000003n\twn:00000003n\n"
+)
+
+FAKE_SYNSET_LEMMAS = {
+    "00000001-n": ["talo", "rakennus"],
+    "00000002-v": ["tietää"],
+    "00000003-n": ["iso_talo"],
+}
+
+
+class FakeLemma:
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class FakeSynset:
+    def __init__(self, synset_id):
+        self.synset_id = synset_id
+
+    def lemmas(self):
+        return [FakeLemma(name) for name in FAKE_SYNSET_LEMMAS[self.synset_id]]
+
+
+def fake_iter_synsets(synset_list):
+    for synset_id in synset_list.split(" "):
+        yield synset_id, FakeSynset(synset_id)
+
+
+def fake_lemma_intersect(anchor_bits, lemma_bits):
+    # Stands in for OMorFi: bits match when they share a three letter stem
+    if [bit[:3] for bit in anchor_bits] == [bit[:3] for bit in lemma_bits]:
+        return lemma_bits
+    return None
+
+
+def test_eurosense_to_stifflike_matches_piped(tmp_path, monkeypatch):
+    munge = load_script("munge")
+    filter_py = load_script("filter")
+    monkeypatch.setattr(munge, "get_en_fi_maps", lambda: (None, None))
+    monkeypatch.setattr(munge, "iter_synsets", fake_iter_synsets)
+    monkeypatch.setattr(munge, "lemma_intersect", fake_lemma_intersect)
+    eurosense = tmp_path / "eurosense.xml"
+    eurosense.write_bytes(EUROSENSE_XML)
+    bn2wn = tmp_path / "bn2wn.tsv"
+    bn2wn.write_text(BN2WN_TSV, encoding="utf-8")
+
+    run_cmd(filter_py.filter, "lang", "fi", eurosense, tmp_path / "1.xml")
+    run_cmd(
+        munge.munge, "babelnet-lookup", tmp_path / "1.xml", bn2wn, tmp_path / "2.xml"
+    )
+    run_cmd(munge.munge, "eurosense-reanchor", tmp_path / "2.xml", tmp_path / "3.xml")
+    run_cmd(
+        munge.munge,
+        "eurosense-lemma-fix",
+        "--drop-unknown",
+        tmp_path / "3.xml",
+        tmp_path / "4.xml",
+    )
+    run_cmd(filter_py.filter, "rm-empty", tmp_path / "4.xml", tmp_path / "piped.xml")
+    munge.synset_list_lemma_map.cache_clear()
+    munge.synset_list_lemma_names.cache_clear()
+    run_cmd(
+        munge.munge, "eurosense-to-stifflike", eurosense, bn2wn, tmp_path / "fused.xml",
+    )
+
+    piped = (tmp_path / "piped.xml").read_bytes()
+    sents = etree.fromstring(piped).xpath("//sentence")
+    assert [sent.attrib["id"] for sent in sents] == ["0"]
+    assert [
+        (ann.attrib["anchor"], ann.attrib["lemma"], ann.text)
+        for ann in sents[0].xpath("./annotations/annotation")
+    ] == [
+        ("talossa", "talo", "00000001-n"),
+        ("Rakennus", "Rakennus", "00000001-n"),
+        ("tiedä", "tietää", "00000002-v"),
+        ("isot talot", "iso_talo", "00000003-n"),
+    ]
+    assert (tmp_path / "fused.xml").read_bytes() == piped
@@ -0,0 +1,62 @@
+from io import BytesIO, StringIO
+
+from stiff.utils.offsets import (
+    get_offsets,
+    iter_sentence_id_offsets,
+    map_file,
+    read_block,
+    read_offsets,
+    scan_offsets,
+    write_offsets,
+)
+from stiff.utils.xml import iter_sentence_id_pairs
+
+CORPUS = """<?xml version='1.0' encoding='UTF-8'?>
+<corpus source="OpenSubtitles2018">
+<subtitle sources="a.xml; b.xml" imdb="1">
+<sentence id="0">
+<text id="fi-tok" lang="fi">Murha !</text>
+<annotations>
+<annotation id="0" anchor="Murha">murder.n.01</annotation>
+<annotation id="1" anchor="Murha">bloodshed.n.01</annotation>
+</annotations>
+</sentence>
+<sentence id="1">
+<text id="fi-tok" lang="fi">Hyvää !</text>
+</sentence>
+</subtitle>
+</corpus>
+""".encode(
+    "utf-8"
+)
+
+
+def test_offsets_match_parse():
+    offsets = list(scan_offsets(CORPUS))
+    assert [(offset.kind, offset.anns) for offset in offsets] == [
+        ("subtitle", 2),
+        ("sentence", 2),
+        ("sentence", 0),
+    ]
+    parsed_ids = [sent_id for sent_id, _ in iter_sentence_id_pairs(BytesIO(CORPUS))]
+    indexed = list(iter_sentence_id_offsets(offsets))
+    assert [sent_id for sent_id, _ in indexed] == parsed_ids
+    fp = BytesIO(CORPUS)
+    for _, offset in indexed:
+        assert read_block(fp, offset).attrib["id"] == offset.id
+
+
+def test_offsets_roundtrip():
+    offsets = list(scan_offsets(CORPUS))
+    idx = StringIO()
+    write_offsets(offsets, idx)
+    idx.seek(0)
+    assert list(read_offsets(idx)) == offsets
+
+
+def test_offsets_empty_file(tmp_path):
+    xml_path = tmp_path / "empty.xml"
+    xml_path.write_bytes(b"")
+    with open(xml_path, "rb") as fp:
+        assert map_file(fp) == b""
+        assert get_offsets(fp) == []
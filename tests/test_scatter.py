@@ -0,0 +1,20 @@
+import random
+
+from stiff.munge.scatter import ScatterWriter
+
+
+def test_scatter_writer_matches_appends(tmp_path):
+    (tmp_path / "f0").write_text("stale")
+    rng = random.Random(0)
+    expected = {}
+    with ScatterWriter(max_open=3, spill_size=50, max_buffered=200) as writer:
+        for idx in range(2000):
+            path = str(tmp_path / "f{}".format(rng.randrange(10)))
+            text = "{}:{}\n".format(idx, "x" * rng.randrange(20))
+            writer.write(path, text)
+            expected[path] = expected.get(path, "") + text
+        assert len(writer.handles) <= 3
+    for path, contents in expected.items():
+        with open(path) as inf:
+            assert inf.read() == contents
+    assert writer.opens < writer.appends
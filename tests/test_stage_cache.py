@@ -0,0 +1,72 @@
+import io
+import subprocess
+
+from stiff.utils import stage_cache
+from stiff.utils.stage_cache import StageCache, tee_zstd
+
+
+def test_stage_cache_prefixes(tmp_path):
+    inf = tmp_path / "in.xml"
+    inf.write_bytes(b"<corpus></corpus>")
+    cache = StageCache(str(tmp_path / "cache"), str(inf))
+    stages = ["fold-support fi", "lang fi", "rm-ambg"]
+    assert cache.longest_prefix(stages) == 0
+    assert cache.key(stages[:1]) != cache.key(stages[:2])
+    for end in (1, 2):
+        with open(cache.tmp_path(stages[:end]), "wb"):
+            pass
+    assert cache.longest_prefix(stages) == 0
+    cache.commit()
+    assert cache.longest_prefix(stages) == 2
+    assert cache.longest_prefix(["lang fi"]) == 0
+
+    inf.write_bytes(b"<corpus> </corpus>")
+    assert StageCache(str(tmp_path / "cache"), str(inf)).longest_prefix(stages) == 0
+
+
+def test_stage_cache_commit_missing(tmp_path):
+    inf = tmp_path / "in.xml"
+    inf.write_bytes(b"<corpus></corpus>")
+    cache = StageCache(str(tmp_path / "cache"), str(inf))
+    stages = ["lang fi", "rm-ambg"]
+    with open(cache.tmp_path(stages[:1]), "wb"):
+        pass
+    # As if tee_zstd(...) had failed and removed its output
+    cache.tmp_path(stages)
+    cache.commit()
+    assert cache.longest_prefix(stages) == 1
+
+
+def test_stage_cache_input_digests(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    inf1 = tmp_path / "in1.xml"
+    inf1.write_bytes(b"<corpus></corpus>")
+    inf2 = tmp_path / "in2.xml"
+    inf2.write_bytes(b"<corpus> </corpus>")
+    hash_file = stage_cache.hash_file
+    digests = {}
+
+    def interleaved_hash_file(path):
+        # Another run remembers the digest of inf2 while inf1 is being hashed
+        if path == str(inf1):
+            digests[str(inf2)] = StageCache(cache_dir, str(inf2)).input_digest
+        return hash_file(path)
+
+    monkeypatch.setattr(stage_cache, "hash_file", interleaved_hash_file)
+    digests[str(inf1)] = StageCache(cache_dir, str(inf1)).input_digest
+
+    def no_hash_file(path):
+        raise AssertionError("{} hashed again".format(path))
+
+    monkeypatch.setattr(stage_cache, "hash_file", no_hash_file)
+    for inf, digest in digests.items():
+        assert StageCache(cache_dir, inf).input_digest == digest
+
+
+def test_tee_zstd(tmp_path):
+    data = b"<corpus>" + b"<sentence/>" * 100000 + b"</corpus>"
+    path = str(tmp_path / "out.xml.zst")
+    outf = io.BytesIO()
+    tee_zstd(io.BytesIO(data), outf, path)
+    assert outf.getvalue() == data
+    assert subprocess.run(["zstdcat", path], capture_output=True).stdout == data
@@ -0,0 +1,103 @@
+import json
+import pytest
+from urllib.parse import parse_qsl, urlencode
+
+from lxml import etree
+
+from stiff.utils import encode_qs, parse_qs_single
+from stiff.utils.anns import SentCache
+from stiff.utils.gram import (
+    encode_finnpos_pos,
+    get_finnpos_analys,
+    get_finnpos_feats,
+    parse_finnpos_pos,
+)
+
+QS_CASES = [
+    "from-id=fi-tok&char=3&token=0&token-length=1",
+    "transfer-type=unaligned&transfer-from=10&transform-chain=%5B%27deriv%27%5D",
+    "l=olla+kyse&wn=fin%2Cqf2",
+    "l=%C3%A4iti&wn=fin",
+    "l=&wn=fin",
+    "l&wn=fin&&",
+    "=x&y=a=b",
+    "",
+]
+
+DICT_CASES = [
+    {"from-id": "fi-tok", "char": 3, "token": 0},
+    {"transform-chain": "['deriv']", "transfer-from": "10"},
+    {"l": "olla kyse", "wn": "fin,qf2"},
+    {"l": "äiti~_.-", "x y": "a&b=c+d/e"},
+    {},
+]
+
+
+@pytest.mark.parametrize("qs", QS_CASES)
+def test_parse_qs_single_matches_parse_qsl(qs):
+    assert parse_qs_single(qs) == dict(parse_qsl(qs))
+
+
+def test_parse_qs_single_returns_fresh_dict():
+    qs = "l=murha&wn=fin"
+    parse_qs_single(qs)["l"] = "x"
+    assert parse_qs_single(qs) == {"l": "murha", "wn": "fin"}
+
+
+@pytest.mark.parametrize("qs_dict", DICT_CASES)
+def test_encode_qs_matches_urlencode(qs_dict):
+    assert encode_qs(qs_dict) == urlencode(qs_dict)
+
+
+def test_transform_chain_formats():
+    from stiff.utils.anns import encode_transform_chain, parse_transform_chain
+
+    assert parse_transform_chain("['deriv']") == ("deriv",)
+    assert parse_transform_chain("[]") == ()
+    assert parse_transform_chain(encode_transform_chain(["deriv"])) == ("deriv",)
+
+
+def test_fold_support_upgrades_transform_chain():
+    from stiff.utils.anns import upgrade_support
+
+    support = parse_qs_single(
+        "transfer-type=aligned&transfer-from=3&transform-chain=%5B%27deriv%27%5D"
+    )
+    upgrade_support(support)
+    assert encode_qs(support) == (
+        "transfer-type=aligned&transfer-from=3&transform-chain=%5B%22deriv%22%5D"
+    )
+
+
+def test_finnpos_pos_gram():
+    analys = [
+        ["murha", {"pos": "NOUN", "num": "SG", "case": "NOM"}],
+        ["Pekka", {"pos": "NOUN", "proper": "PROPER"}],
+        ["!", {"pos": "PUNCTUATION"}],
+        ["", {}],
+    ]
+    gram = encode_finnpos_pos([feats for _, feats in analys])
+    assert gram == "NOUN NOUN+PROPER PUNCTUATION _"
+    assert parse_finnpos_pos(gram) == [
+        {"pos": "NOUN"},
+        {"pos": "NOUN", "proper": "PROPER"},
+        {"pos": "PUNCTUATION"},
+        {},
+    ]
+    sent = etree.fromstring(
+        '<sentence id="1"><gram type="finnpos" for="fi-tok"><![CDATA['
+        + json.dumps(analys)
+        + "]]></gram></sentence>"
+    )
+    cache = SentCache(sent)
+    full_feats = get_finnpos_feats(cache)
+    assert get_finnpos_analys(cache) is get_finnpos_analys(cache)
+    assert get_finnpos_analys(SentCache(sent)) is not get_finnpos_analys(cache)
+    pos_gram = etree.SubElement(
+        sent, "gram", type="finnpos-pos", attrib={"for": "fi-tok"}
+    )
+    pos_gram.text = gram
+    assert get_finnpos_feats(cache) == [
+        {key: feats[key] for key in ("pos", "proper") if key in feats}
+        for feats in full_feats
+    ]
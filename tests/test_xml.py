@@ -0,0 +1,122 @@
+from io import BytesIO
+from lxml import etree
+
+from stiff.utils.xml import transform_sentences, BREAK, BYPASS
+
+
+CORPUS = """<?xml version='1.0' encoding='UTF-8'?>
+<corpus source="OpenSubtitles2018">
+<subtitle sources="a.xml b.xml" imdb="1">
+<sentence id="0">
+<text id="fi-tok" lang="fi">Murha &amp; kuolema !</text>
+</sentence>
+<sentence id="1">
+<text id="fi-tok" lang="fi">Hyvää !</text>
+</sentence>
+</subtitle>
+</corpus>
+""".encode(
+    "utf-8"
+)
+
+
+def run_transform(transformer):
+    outf = BytesIO()
+    transform_sentences(BytesIO(CORPUS), transformer, outf)
+    return outf.getvalue()
+
+
+def test_transform_identity():
+    assert run_transform(lambda sent: None) == CORPUS
+
+
+def test_transform_bypass():
+    result = run_transform(lambda sent: BYPASS if sent.attrib["id"] == "0" else None)
+    tree = etree.fromstring(result)
+    assert [sent.attrib["id"] for sent in tree.xpath("//sentence")] == ["1"]
+
+
+def test_transform_break():
+    result = run_transform(lambda sent: BREAK if sent.attrib["id"] == "1" else None)
+    tree = etree.fromstring(result)
+    assert [sent.attrib["id"] for sent in tree.xpath("//sentence")] == ["0"]
+    assert tree.xpath("//subtitle/@imdb") == ["1"]
+
+
+def test_transform_multi():
+    from copy import deepcopy
+    from stiff.utils.xml import eq_matcher, transform_blocks_multi
+
+    def mark_second(sent):
+        if sent.attrib["id"] == "1":
+            return BYPASS
+        marked = deepcopy(sent)
+        marked.attrib["marked"] = "yes"
+        return [sent, marked]
+
+    outfs = [BytesIO(), BytesIO()]
+    transform_blocks_multi(eq_matcher("sentence"), BytesIO(CORPUS), mark_second, outfs)
+    assert outfs[0].getvalue() == run_transform(
+        lambda sent: BYPASS if sent.attrib["id"] == "1" else None
+    )
+    tree = etree.fromstring(outfs[1].getvalue())
+    assert tree.xpath("//sentence/@marked") == ["yes"]
+    assert tree.xpath("//subtitle/@imdb") == ["1"]
+
+
+class GeneratedCorpus:
+    """
+    A file-like object lazily producing a corpus of `sentences` sentences, so
+    that arbitrarily long inputs can be streamed without being held in memory.
+    """
+
+    def __init__(self, sentences):
+        self.chunks = self.gen(sentences)
+        self.buf = b""
+
+    @staticmethod
+    def gen(sentences):
+        yield b"<?xml version='1.0' encoding='UTF-8'?>\n<corpus>\n"
+        for sent_id in range(sentences):
+            yield (
+                '<sentence id="{}">\n<text id="fi-tok" lang="fi">Murha !</text>\n'
+                "<annotations>\n"
+                '<annotation id="0" anchor="Murha">murha.n.01</annotation>\n'
+                '<annotation id="1" anchor="Murha">murha.n.02</annotation>\n'
+                "</annotations>\n</sentence>\n"
+            ).format(sent_id).encode("utf-8")
+        yield b"</corpus>\n"
+
+    def read(self, size):
+        while len(self.buf) < size:
+            try:
+                self.buf += next(self.chunks)
+            except StopIteration:
+                break
+        result = self.buf[:size]
+        self.buf = self.buf[size:]
+        return result
+
+
+def test_transform_reclaims_elements():
+    from stiff.utils.xml import eq_matcher, transform_blocks
+
+    max_live = 0
+
+    def count_live(ann):
+        # Count elements which have already been processed but are still in
+        # the tree. Elements after ann are lookahead from the parser.
+        nonlocal max_live
+        live = 0
+        for elem in ann.getroottree().getroot().iter():
+            if elem is ann:
+                break
+            live += 1
+        max_live = max(max_live, live)
+
+    transform_blocks(
+        eq_matcher("annotation"), GeneratedCorpus(20000), count_live, BytesIO()
+    )
+    # The live tree should stay around the size of a single sentence no
+    # matter how long the input is
+    assert max_live < 10